@@ -1,7 +1,45 @@
 import labrad
 import re
 
+from labrad import types as T
+from labrad.client import NotFoundError
+
+NO_CATALOG = 15 # code of the Data Vault's NoCatalogError
+
 def dv_search(data_vault,regex,path=[""]):
+    """Find datasets under path whose names match regex.
+
+    Uses the Data Vault's catalog search when it has one, and otherwise
+    walks the directory tree.  Either way trashed datasets are left out.
+    The search only takes the pattern, so regexes with flags (such as
+    re.I) always walk the tree.
+    """
+    found = None
+    if not regex.flags:
+        found = _dv_catalog_search(data_vault,regex,path)
+    if found is None:
+        for q in _dv_walk(data_vault,regex,list(path)):
+            yield q
+        return
+    for p,f in found:
+        yield (list(p),f)
+
+def _dv_catalog_search(data_vault,regex,path):
+    """Get the matches from the catalog, or None if there isn't one."""
+    try:
+        dv = data_vault.packet()
+        dv.cd(path)
+        dv.search('^(?:%s)' % regex.pattern, tags=['-trash'], key="found")
+        return dv.send().found
+    except NotFoundError:
+        # an older Data Vault, without the search setting
+        return None
+    except T.Error as e:
+        if e.code != NO_CATALOG:
+            raise
+        return None
+
+def _dv_walk(data_vault,regex,path):
     dv = data_vault.packet()
     dv.cd(path)
     dv.dir(key="contents")
@@ -12,9 +50,9 @@ def dv_search(data_vault,regex,path=[""]):
     for f in contents[1]:
         if regex.match(f):
             yield (path,f)
-            
+
     for d in contents[0]:
         path.append(d)
-        for q in dv_search(data_vault,regex,path):
+        for q in _dv_walk(data_vault,regex,path):
             yield q
         path.pop()
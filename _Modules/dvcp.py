@@ -2,11 +2,20 @@
 Create two separate connections to a(two) data_vault server(s).
 Access data/parameters for each dataset with one connection, and
 create  a new instance of the data/parameters with the other connection.
+
+copy_tree and auto_copy copy one dataset at a time.  To mirror a large
+tree, use replicate instead: it copies several datasets at once, moves
+rows in large chunks, and keeps a manifest file so that an interrupted
+run can be resumed.
 """
 
 from numpy import *
+import collections, json, os
 import labrad, sys
 
+REPLICATE_STREAMS = 4 # datasets copied at once, each in its own contexts
+REPLICATE_CHUNK_ROWS = 10000 # rows moved by each get_ex_t/add_ex_t
+
 # from http://code.activestate.com/recipes/577058/
 # Prompt the user with a y/n question, return true/false respectively
 def query_yes_no(question, default="yes"):
@@ -338,3 +347,257 @@ def auto_copy(wrap_from, wrap_to, copy_subdirs=True, exclude=[]):
         str(machine_from) + '".\nCheck that we are on the LabRAD whitelist for "' + 
         str(machine_from) + '".')
         return
+
+
+def _utf8(strings):
+    return [x.encode('utf-8') if isinstance(x, unicode) else x for x in strings]
+
+class Manifest(object):
+    """
+    A local record of replicated datasets, used to resume a replication.
+
+    Each line of the file is the JSON record of one source dataset:
+    {"source": [path..., name], "dest": [path..., name], "rows": n, "done": b}
+    where rows is the number of rows copied so far.  Later lines replace
+    earlier ones, so the file only ever grows while copying.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        line = '\n'
+        if os.path.exists(filename):
+            with open(filename) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # last line cut short by an interruption
+                    entry['source'] = _utf8(entry['source'])
+                    entry['dest'] = _utf8(entry['dest'])
+                    self.entries[tuple(entry['source'])] = entry
+        self._file = open(filename, 'a')
+        if not line.endswith('\n'):
+            self._file.write('\n') # start after the cut-off line
+
+    def get(self, path, name):
+        return self.entries.get(tuple(path) + (name,))
+
+    def record(self, path, name, dest_path, dest_name, rows, done=False):
+        entry = {'source': list(path) + [name],
+                 'dest': list(dest_path) + [dest_name],
+                 'rows': rows, 'done': done}
+        self.entries[tuple(entry['source'])] = entry
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+def _rows(data):
+    """Number of rows in a get_ex_t result."""
+    return len(data[0]) if len(data) else 0
+
+class Replicator(object):
+    """
+    Copy datasets between data vaults, several at a time.
+
+    Each dataset being copied gets its own context on both servers, and
+    every round sends one packet per dataset to each server without waiting
+    for the others, so the round trips of up to 'streams' datasets overlap.
+    Within a dataset, the next chunk is read while the last one is written.
+    """
+    def __init__(self, dv_from, dv_to, manifest, streams=REPLICATE_STREAMS,
+                 chunk_rows=REPLICATE_CHUNK_ROWS, report=None):
+        self.dv_from = dv_from
+        self.dv_to = dv_to
+        self.manifest = manifest
+        self.streams = streams
+        self.chunk_rows = chunk_rows
+        self.report = report or (lambda message: None)
+
+    def find(self, path, exclude=[]):
+        """
+        List the datasets in path and its subdirectories on the source,
+        as (path, name) tuples.  Directories and datasets named in exclude
+        are left out, as are trashed ones (the default filter of dir).
+        """
+        src = self.dv_from()
+        found = []
+        todo = [list(path)]
+        while todo:
+            here = todo.pop(0)
+            src.cd(here)
+            dirs, datasets = src.dir()
+            found += [(here, d) for d in sorted(datasets) if d not in exclude]
+            todo += [here + [d] for d in sorted(dirs) if d not in exclude]
+        return found
+
+    def estimate(self, datasets):
+        """
+        Estimate what is left to copy, returning (datasets, rows, bytes).
+
+        Uses the 'row count' setting of the source data vault.  Sizes
+        count 8 bytes per number and string, so they are only a guide.
+        """
+        todo = [(p, n) for p, n in datasets
+                if not (self.manifest.get(p, n) or {}).get('done')]
+        src = self.dv_from()
+        rows = nbytes = 0
+        for i in range(0, len(todo), 100):
+            pkt = src.packet()
+            for j, (path, name) in enumerate(todo[i:i+100]):
+                pkt.cd(path)
+                pkt.open(name)
+                pkt.variables_ex(key='vars%d' % j)
+                pkt.row_count(key='rows%d' % j)
+            ans = pkt.send()
+            for j, (path, name) in enumerate(todo[i:i+100]):
+                entry = self.manifest.get(path, name)
+                n = ans['rows%d' % j] - (entry['rows'] if entry else 0)
+                indep, dep = ans['vars%d' % j]
+                width = sum(product(v[-3]) for v in list(indep) + list(dep))
+                rows += n
+                nbytes += 8 * n * width
+        return len(todo), rows, nbytes
+
+    def run(self, datasets, path_from, path_to):
+        """
+        Copy datasets (from find) found under path_from into path_to,
+        keeping their relative paths.  Datasets the manifest lists as done
+        are skipped, and partly copied ones continue where they stopped.
+
+        Returns (copied, failed).
+        """
+        pending = collections.deque(
+            (p, n) for p, n in datasets
+            if not (self.manifest.get(p, n) or {}).get('done'))
+        active = []
+        copied = failed = 0
+        while pending or active:
+            while pending and len(active) < self.streams:
+                path, name = pending.popleft()
+                dest_dir = list(path_to) + list(path[len(path_from):])
+                job = self._copy(self.dv_from(), self.dv_to(), path, name, dest_dir)
+                active.append([(path, name), job, job.next()])
+            # send this round's packets for every dataset, then collect them
+            for item in active:
+                try:
+                    item[2] = [pkt.send_future() for pkt in item[2]]
+                except Exception, e:
+                    item[2] = e
+            for item in active[:]:
+                (path, name), job = item[0], item[1]
+                try:
+                    if isinstance(item[2], Exception):
+                        raise item[2]
+                    item[2] = job.send([f.result() for f in item[2]])
+                except StopIteration:
+                    active.remove(item)
+                    copied += 1
+                    self.report('copied %s' % (path + [name],))
+                except Exception, e:
+                    active.remove(item)
+                    failed += 1
+                    self.report('failed %s: %s' % (path + [name], e))
+        return copied, failed
+
+    def _copy(self, src, dst, path, name, dest_dir):
+        """
+        Copy one dataset.  Yields the packets for each round and receives
+        their results.
+        """
+        entry = self.manifest.get(path, name)
+        p = src.packet()
+        p.cd(path)
+        p.open(name)
+        p.variables_ex(key='vars')
+        p.get_parameters(key='params')
+        p.get_comments(key='comments')
+        q = dst.packet()
+        q.cd(dest_dir, True)
+        if entry:
+            # resume: append to the copy we started last time.  The copy
+            # may be ahead of the manifest if we stopped just after a
+            # write, so see what it already holds.
+            q.open(entry['dest'][-1], True)
+            q.row_count(key='rows')
+            q.get_parameters(key='params')
+            q.get_comments(key='comments')
+        info, ans = yield [p, q]
+        if entry:
+            dest_name, copied = entry['dest'][-1], ans['rows']
+            have_params = set(key for key, _ in ans['params'] or ())
+            have_comments = len(ans['comments'])
+        else:
+            indep, dep = info['vars']
+            q = dst.packet()
+            q.new_ex(name[8:], indep, dep, key='new')
+            ans, = yield [q]
+            dest_name, copied = ans['new'][1], 0
+            have_params, have_comments = set(), 0
+            self.manifest.record(path, name, dest_dir, dest_name, 0)
+
+        # read the next chunk while writing the last, starting after the
+        # rows that are already there
+        p = src.packet()
+        p.get_range_ex_t(copied, copied + self.chunk_rows, key='data')
+        ans, = yield [p]
+        data = ans['data']
+        while _rows(data):
+            start = copied + _rows(data)
+            p = src.packet()
+            p.get_range_ex_t(start, start + self.chunk_rows, key='data')
+            q = dst.packet()
+            q.add_ex_t(data)
+            ans, _ = yield [p, q]
+            copied += _rows(data)
+            self.manifest.record(path, name, dest_dir, dest_name, copied)
+            data = ans['data'] if _rows(data) == self.chunk_rows else ()
+
+        # parameters and comments that a previous attempt already added
+        # are left out, so that they are not added twice
+        q = dst.packet()
+        params = [param for param in info['params'] or ()
+                  if param[0] not in have_params]
+        if params:
+            q.add_parameters(tuple(params))
+        for _, user, comment in info['comments'][have_comments:]:
+            q.add_comment(comment, user)
+        yield [q]
+        self.manifest.record(path, name, dest_dir, dest_name, copied, done=True)
+
+def replicate(wrap_from, wrap_to, manifest_file, exclude=[], dry_run=False,
+              streams=REPLICATE_STREAMS, chunk_rows=REPLICATE_CHUNK_ROWS):
+    """
+    Mirror a data_vault directory tree to another data_vault.
+
+    wrap_from and wrap_to are (machine, path) tuples as for auto_copy.
+    manifest_file records what has been copied; run again with the same
+    file to resume an interrupted replication.  With dry_run, only report
+    how much would be copied.
+
+    Return (copied, failed), or (datasets, rows, bytes) for a dry run.
+    """
+    [machine_from, path_from] = wrap_from
+    [machine_to, path_to] = wrap_to
+    def report(message):
+        print message
+    manifest = Manifest(manifest_file)
+    try:
+        with labrad.connect(machine_from) as manager_from:
+            with labrad.connect(machine_to) as manager_to:
+                replicator = Replicator(manager_from.data_vault,
+                                        manager_to.data_vault, manifest,
+                                        streams, chunk_rows, report)
+                datasets = replicator.find(path_from, exclude)
+                if dry_run:
+                    todo, rows, nbytes = replicator.estimate(datasets)
+                    print("%d of %d datasets to copy: %d rows, about %.1f MB"
+                          % (todo, len(datasets), rows, nbytes / 1e6))
+                    return todo, rows, nbytes
+                copied, failed = replicator.run(datasets, path_from, path_to)
+                print("Copied %d datasets, %d failed." % (copied, failed))
+                return copied, failed
+    finally:
+        manifest.close()
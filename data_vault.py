@@ -41,7 +41,7 @@ from twisted.internet.defer import inlineCallbacks, returnValue
 import labrad.util
 import labrad.wrappers
 
-from datavault import SessionStore
+from datavault import SessionStore, backend, catalog, workers
 from datavault.server import DataVault
 
 
@@ -81,6 +81,80 @@ def load_settings(cxn, name):
         print 'To change this, edit the registry keys and restart the server.'
     returnValue(datadir)
 
+@inlineCallbacks
+def load_storage_settings(cxn, name):
+    """Load the default HDF5 layout for new datasets from the registry.
+
+    The optional 'Compression' (filter pipeline, e.g. 'shuffle+gzip'),
+    'Chunk Rows' and 'Layout' ('rows' or 'columns') keys in the server's
+    registry directory are used for all new datasets unless new_ex asks for
+    something else.
+    """
+    reg = cxn.registry
+    p = reg.packet()
+    p.cd(['', 'Servers', name])
+    p.get('Compression', 's', False, '', key='compression')
+    p.get('Chunk Rows', 'w', False, 0, key='chunk_rows')
+    p.get('Layout', 's', False, '', key='layout')
+    ans = yield p.send()
+    returnValue(backend.parse_storage(ans.compression, ans.chunk_rows,
+                                      layout=ans.layout))
+
+@inlineCallbacks
+def load_io_settings(cxn, name):
+    """Load the worker thread settings for dataset file I/O from the registry.
+
+    With 'IO Threads' set to a nonzero number of threads, dataset reads and
+    writes run in worker threads, at most 'IO Max Reads' reads at a time.
+    Returns a started workers.IOScheduler, or None to do I/O in the reactor.
+    """
+    reg = cxn.registry
+    p = reg.packet()
+    p.cd(['', 'Servers', name])
+    p.get('IO Threads', 'w', False, 0, key='threads')
+    p.get('IO Max Reads', 'w', False, 0, key='max_reads')
+    ans = yield p.send()
+    if not ans.threads:
+        returnValue(None)
+    max_reads = ans.max_reads or max(ans.threads // 2, 1)
+    io = workers.IOScheduler(ans.threads, max_reads)
+    io.start()
+    returnValue(io)
+
+@inlineCallbacks
+def load_share_params(cxn, name):
+    """Check whether to store large parameters once per directory.
+
+    Set 'Share Parameters' in the registry to keep large parameter values in
+    a store shared by the datasets of each directory (see
+    backend.ParamBlobStore), rather than in every dataset file.
+    """
+    reg = cxn.registry
+    p = reg.packet()
+    p.cd(['', 'Servers', name])
+    p.get('Share Parameters', 'b', False, False, key='share')
+    ans = yield p.send()
+    returnValue(ans.share)
+
+def load_catalog(datadir):
+    """Open the dataset catalog, building it from the files if need be.
+
+    The catalog is built in a thread, so the server starts right away; until
+    it is done, searches fail with NoCatalogError and clients walk the tree.
+    """
+    dataset_catalog = catalog.open_catalog(datadir)
+    if dataset_catalog.outdated:
+        print 'Building the dataset catalog in {}...'.format(datadir)
+        def report(message):
+            print 'Could not catalog', message
+        def built(count):
+            print 'Cataloged {} datasets.'.format(count)
+        def failed(failure):
+            print 'Could not build the dataset catalog:', failure.getErrorMessage()
+        d = dataset_catalog.rebuildInThread(datadir, report)
+        d.addCallbacks(built, failed)
+    return dataset_catalog
+
 def main(argv=sys.argv):
     @inlineCallbacks
     def start():
@@ -88,8 +162,13 @@ def main(argv=sys.argv):
         cxn = yield labrad.wrappers.connectAsync(
             host=opts['host'], port=int(opts['port']), password=opts['password'])
         datadir = yield load_settings(cxn, opts['name'])
+        storage = yield load_storage_settings(cxn, opts['name'])
+        io = yield load_io_settings(cxn, opts['name'])
+        share_params = yield load_share_params(cxn, opts['name'])
         yield cxn.disconnect()
-        session_store = SessionStore(datadir, hub=None)
+        session_store = SessionStore(datadir, hub=None, storage=storage, io=io,
+                                     catalog=load_catalog(datadir),
+                                     share_params=share_params)
         server = DataVault(session_store)
         session_store.hub = server
 
@@ -48,7 +48,7 @@ from twisted.internet.defer import inlineCallbacks, returnValue
 from labrad import constants, protocol, util
 import labrad.wrappers
 
-from datavault import SessionStore
+from datavault import SessionStore, backend
 from datavault.server import DataVaultMultiHead
 
 def lock_path(d):
@@ -196,15 +196,16 @@ class DataVaultServiceHost(MultiService):
         'onTagsUpdated',
         'onDataAvailable',
         'onNewParameter',
-        'onCommentsAvailable'
+        'onCommentsAvailable',
+        'onDataCount'
     ]
 
-    def __init__(self, path, managers):
+    def __init__(self, path, managers, storage=backend.DEFAULT_STORAGE):
         MultiService.__init__(self)
         self.path = path
         self.managers = managers
         self.servers = set()
-        self.session_store = SessionStore(path, self)
+        self.session_store = SessionStore(path, self, storage=storage)
         for signal in self.signals:
             self.wrapSignal(signal)
         for host, port, password in managers:
@@ -322,11 +323,16 @@ def load_settings_registry(cxn):
     p.get("Repository", 's', key="repo")
     p.get("Managers", "*(sws)", key="managers")
     p.get("Node", "s", False, "", key="node")
+    p.get("Compression", "s", False, "", key="compression")
+    p.get("Chunk Rows", "w", False, 0, key="chunk_rows")
+    p.get("Layout", "s", False, "", key="layout")
     ans = yield p.send()
     if ans.node and (ans.node != util.getNodeName()):
         raise RuntimeError('Node name "%s" from registry does not match current host "%s"' % (ans.node, util.getNodeName()))
     cxn.disconnect()
-    returnValue((ans.repo, ans.managers))
+    storage = backend.parse_storage(ans.compression, ans.chunk_rows,
+                                    layout=ans.layout)
+    returnValue((ans.repo, ans.managers, storage))
 
 def load_settings_cmdline(argv):
     if len(argv) < 3:
@@ -344,10 +350,10 @@ def load_settings_cmdline(argv):
         else:
             port = int(port)
         managers.append((host, port, password))
-    return path, managers
+    return path, managers, backend.DEFAULT_STORAGE
 
 def start_server(args):
-    path, managers = args
+    path, managers, storage = args
     if not os.path.exists(path):
         raise Exception('data path %s does not exist' % path)
     if not os.path.isdir(path):
@@ -363,7 +369,7 @@ def start_server(args):
 
     lock_path(path)
     managers = [parseManagerInfo(m) for m in managers]
-    service = DataVaultServiceHost(path, managers)
+    service = DataVaultServiceHost(path, managers, storage)
     service.startService()
 
 def main(argv=sys.argv):
@@ -1,13 +1,20 @@
 import base64
+import bisect
 from datetime import datetime
 import os
 import re
 import collections
+import StringIO
+import time
 import weakref
 
+import numpy as np
+from twisted.internet import defer, reactor
+from twisted.python import failure
+
 from labrad import types as T
 
-from . import backend, errors, util
+from . import backend, errors, summary, util, workers
 
 
 ## Filename translation.
@@ -81,12 +88,63 @@ def parse_dependent(s):
 
 DATA_URL_PREFIX = 'data:application/labrad;base64,'
 
+SESSION_SAVE_DELAY = 10 # seconds to wait before writing out session.ini changes
+INDEX_MTIME_SLACK = 2 # directory mtimes younger than this may miss changes
+NOTIFY_MAX_ROWS = 1000 # most new rows that can be sent with a data count
+SYNC_DELAY = 1 # seconds from a change to a dataset until its file is flushed
+RECENT_SESSIONS = 100 # sessions kept in memory after they were last used
+RECENT_DATASETS = 1000 # datasets kept in memory after they were last used
+
+
+class RecentObjects(object):
+    """Keeps the most recently used sessions or datasets in memory.
+
+    Sessions and datasets are looked up in weak maps, so they are dropped as
+    soon as no context uses them, and using them again means reading their
+    metadata back from disk.  Each use is recorded here, which holds on to
+    the last capacity objects used, and counts the lookups that found the
+    object still in memory (hits) and those that had to load it (misses).
+    """
+    def __init__(self, capacity):
+        self._objects = util.LRUCache(capacity)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._objects)
+
+    @property
+    def capacity(self):
+        return self._objects.capacity
+
+    def resize(self, capacity):
+        self._objects.resize(capacity)
+
+    def hit(self, key, obj):
+        self.hits += 1
+        self.add(key, obj)
+
+    def miss(self, key, obj):
+        self.misses += 1
+        self.add(key, obj)
+
+    def add(self, key, obj):
+        """Record a use of obj that was not a lookup, such as creating it."""
+        self._objects[key] = obj
+
 
 class SessionStore(object):
-    def __init__(self, datadir, hub):
+    def __init__(self, datadir, hub, storage=backend.DEFAULT_STORAGE, io=None,
+                 catalog=None, share_params=False):
         self._sessions = weakref.WeakValueDictionary()
+        self.recent_sessions = RecentObjects(RECENT_SESSIONS)
+        self.recent_datasets = RecentObjects(RECENT_DATASETS) # of all sessions
         self.datadir = datadir
         self.hub = hub
+        self.storage = storage # default HDF5 layout for new datasets
+        self.io = io # workers.IOScheduler for dataset file I/O, if any
+        self.catalog = catalog # catalog.Catalog to keep up to date, if any
+        self.share_params = share_params # store large parameters once per directory
 
     def get_all(self):
         return self._sessions.values()
@@ -106,13 +164,113 @@ class SessionStore(object):
         Otherwise, create a new session instance.
         """
         path = tuple(path)
-        if path in self._sessions:
-            return self._sessions[path]
-        session = Session(self.datadir, path, self.hub, self)
+        session = self._sessions.get(path)
+        if session is not None:
+            self.recent_sessions.hit(path, session)
+            return session
+        session = Session(self.datadir, path, self.hub, self, io=self.io,
+                          catalog=self.catalog, share_params=self.share_params)
         self._sessions[path] = session
+        self.recent_sessions.miss(path, session)
         return session
 
 
+class DirectoryIndex(object):
+    """In-memory listing of the entries in a session directory.
+
+    Holds the sorted names of subdirectories and datasets, and a map from
+    dataset number to name, so that listing a directory or looking up a
+    dataset by number doesn't have to read and decode every filename.
+    The session adds entries as it creates them, and the listing is read
+    again from disk whenever the directory mtime changes.  Filesystems
+    (NFS in particular) only keep coarse mtimes, so an mtime younger than
+    INDEX_MTIME_SLACK is not trusted and the directory is read again.  The
+    slack only guards against changes made by others: when we change the
+    directory ourselves and the listing was up to date just before, the
+    listing is still right and changed() records the new mtime however
+    recent it is.
+    """
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._mtime = None # mtime the listing is known to match, if any
+        self.dirs = []
+        self.datasets = []
+        self.dirNames = set()
+        self.datasetNames = set()
+        self.numbers = {}
+
+    def mtime(self):
+        """Get the directory mtime, to pass to changed() after a change."""
+        return os.path.getmtime(self.path)
+
+    def refresh(self):
+        """Read the directory again if it may have changed on disk."""
+        mtime = self.mtime()
+        if mtime != self._mtime:
+            self._scan(mtime)
+
+    def _scan(self, mtime):
+        dirs = set()
+        datasets = set()
+        for s in os.listdir(self.path):
+            base, _, ext = s.rpartition('.')
+            if ext == 'dir':
+                dirs.add(filename_decode(base))
+            elif ext in ['csv', 'hdf5']:
+                datasets.add(filename_decode(base))
+        self.dirNames = dirs
+        self.datasetNames = datasets
+        self.dirs = sorted(dirs)
+        self.datasets = sorted(datasets)
+        self.numbers = {}
+        for name in self.datasets:
+            self._number(name)
+        if self.clock() - mtime < INDEX_MTIME_SLACK:
+            self._mtime = None # too recent; look again next time
+        else:
+            self._mtime = mtime
+
+    def changed(self, before):
+        """Record that we just changed the directory ourselves.
+
+        before is the directory mtime read just before the change.  If the
+        listing did not match the directory then, someone else may have
+        changed it too, so the listing is read again on the next refresh.
+        """
+        if self._mtime is not None and self._mtime == before:
+            self._mtime = self.mtime()
+        else:
+            self._mtime = None
+
+    def _number(self, name):
+        try:
+            num = int(name[:5])
+        except ValueError:
+            return
+        # several names can share a number; like a search of the sorted
+        # listing, the first one wins
+        if num not in self.numbers or name < self.numbers[num]:
+            self.numbers[num] = name
+
+    def addDir(self, name, before):
+        """Record a subdirectory that was just created."""
+        self._add(name, self.dirs, self.dirNames, before)
+
+    def addDataset(self, name, before):
+        """Record a dataset that was just created."""
+        if self._add(name, self.datasets, self.datasetNames, before):
+            self._number(name)
+
+    def _add(self, name, names, nameSet, before):
+        added = name not in nameSet
+        if added:
+            nameSet.add(name)
+            bisect.insort(names, name)
+        self.changed(before)
+        return added
+
+
 class Session(object):
     """Stores information about a directory on disk.
 
@@ -121,30 +279,45 @@ class Session(object):
     file, and manages the datasets in this directory.
     """
 
-    def __init__(self, datadir, path, hub, session_store):
+    def __init__(self, datadir, path, hub, session_store, reactor=reactor,
+                 io=None, catalog=None, share_params=False):
         """Initialization that happens once when session object is created."""
         self.path = path
         self.hub = hub
+        self.reactor = reactor
+        self.io = io
+        self.catalog = catalog
+        self.share_params = share_params
+        self._saveCall = None
         self.dir = filedir(datadir, path)
         self.infofile = os.path.join(self.dir, 'session.ini')
         self.datasets = weakref.WeakValueDictionary()
+        self.opening = {} # name -> Deferreds waiting for it to be opened
+        self.recent = session_store.recent_datasets
+        self.index = DirectoryIndex(self.dir)
 
         if not os.path.exists(self.dir):
-            os.makedirs(self.dir)
-
-            # notify listeners about this new directory
-            parent_session = session_store.get(path[:-1])
-            hub.onNewDir(path[-1], parent_session.listeners)
+            # notify listeners about this new directory (the root has no parent)
+            if len(path) > 1:
+                parent_session = session_store.get(path[:-1])
+                before = parent_session.index.mtime()
+                os.makedirs(self.dir)
+                parent_session.index.addDir(path[-1], before)
+                hub.onNewDir(path[-1], parent_session.listeners)
+            else:
+                os.makedirs(self.dir)
 
         if os.path.exists(self.infofile):
             self.load()
+            # the new access time goes out with the next save
+            self.accessed = datetime.now()
         else:
             self.counter = 1
-            self.created = self.modified = datetime.now()
+            self.created = self.modified = self.accessed = datetime.now()
             self.session_tags = {}
             self.dataset_tags = {}
+            self.save()
 
-        self.access() # update current access time and save
         self.listeners = set()
 
     def load(self):
@@ -169,7 +342,16 @@ class Session(object):
             self.dataset_tags = {}
 
     def save(self):
-        """Save info to the session.ini file."""
+        """Save info to the session.ini file.
+
+        The file is replaced atomically, so a crash while saving can never
+        leave a truncated file or lose the dataset counter.
+        """
+        if self._saveCall is not None:
+            if self._saveCall.active():
+                self._saveCall.cancel()
+            self._saveCall = None
+
         S = util.DVSafeConfigParser()
 
         sec = 'File System'
@@ -187,27 +369,43 @@ class Session(object):
         S.set(sec, 'sessions', repr(self.session_tags))
         S.set(sec, 'datasets', repr(self.dataset_tags))
 
-        with open(self.infofile, 'w') as f:
-            S.write(f)
+        f = StringIO.StringIO()
+        S.write(f)
+        before = self.index.mtime()
+        util.write_atomic(self.infofile, f.getvalue())
+        # the rename moved the directory mtime on
+        self.index.changed(before)
+
+    def saveLater(self):
+        """Schedule a save, so that many quick changes cost one write.
+
+        The pending call also keeps this session alive until it is saved.
+        """
+        if self._saveCall is None:
+            self._saveCall = self.reactor.callLater(SESSION_SAVE_DELAY, self.save)
+
+    def flush(self):
+        """Save now if there are changes waiting to be saved."""
+        if self._saveCall is not None:
+            self.save()
 
     def access(self):
-        """Update last access time and save."""
+        """Update last access time, to be saved shortly."""
         self.accessed = datetime.now()
-        self.save()
+        self.saveLater()
 
     def listContents(self, tagFilters):
         """Get a list of directory names in this directory."""
-        files = os.listdir(self.dir)
-        dirs = [filename_decode(s[:-4]) for s in files if s.endswith('.dir')]
-        csv_datasets = [filename_decode(s[:-4]) for s in files if s.endswith('.ini') and s.lower() != 'session.ini' ]
-        hdf5_datasets = [filename_decode(s[:-5]) for s in files if s.endswith('.hdf5')]
-        datasets = sorted(csv_datasets + hdf5_datasets)
+        self.index.refresh()
+        dirs, dirNames = self.index.dirs, self.index.dirNames
+        datasets, datasetNames = self.index.datasets, self.index.datasetNames
         # apply tag filters
-        def include(entries, tag, tags):
+        def include(entries, names, tag, tags):
             """Include only entries that have the specified tag."""
-            return [e for e in entries
-                    if e in tags and tag in tags[e]]
-        def exclude(entries, tag, tags):
+            # only tagged entries can match, so look through those
+            return sorted(e for e, entryTags in tags.iteritems()
+                          if tag in entryTags and e in names)
+        def exclude(entries, names, tag, tags):
             """Exclude all entries that have the specified tag."""
             return [e for e in entries
                     if e not in tags or tag not in tags[e]]
@@ -217,32 +415,44 @@ class Session(object):
                 tag = tag[1:]
             else:
                 filter = include
-            dirs = filter(dirs, tag, self.session_tags)
-            datasets = filter(datasets, tag, self.dataset_tags)
-        return sorted(dirs), sorted(datasets)
+            dirs = filter(dirs, dirNames, tag, self.session_tags)
+            datasets = filter(datasets, datasetNames, tag, self.dataset_tags)
+            dirNames, datasetNames = set(dirs), set(datasets)
+        return list(dirs), list(datasets)
 
     def listDatasets(self):
         """Get a list of dataset names in this directory."""
-        files = os.listdir(self.dir)
-        filenames = []
-        for s in files:
-            base, _, ext = s.rpartition('.')
-            if ext in ['csv', 'hdf5']:
-                filenames.append(filename_decode(base))
-        return sorted(filenames)
+        self.index.refresh()
+        return list(self.index.datasets)
 
-    def newDataset(self, title, independents, dependents, extended=False):
+    def newDataset(self, title, independents, dependents, extended=False,
+                   storage=backend.DEFAULT_STORAGE, grid=None):
         num = self.counter
         self.counter += 1
         self.modified = datetime.now()
 
         name = '%05d - %s' % (num, title)
+        before = self.index.mtime()
         dataset = Dataset(self, name, title, create=True,
                           independents=independents,
                           dependents=dependents,
-                          extended=extended)
+                          extended=extended,
+                          storage=storage,
+                          grid=grid,
+                          io=self.io,
+                          catalog=self.catalog,
+                          share_params=self.share_params)
         self.datasets[name] = dataset
-        self.access()
+        self.recent.add((tuple(self.path), name), dataset)
+        self.index.addDataset(name, before)
+        if self.catalog is not None:
+            self.catalog.addDataset(
+                    self.path, name, num, title, time.time(),
+                    [v.label for v in dataset.getIndependents()],
+                    [v.label for v in dataset.getDependents()])
+        # save the new counter right away so numbers are never reused
+        self.accessed = datetime.now()
+        self.save()
 
         # notify listeners about the new dataset
         self.hub.onNewDataset(name, self.listeners)
@@ -251,11 +461,8 @@ class Session(object):
     def openDataset(self, name):
         # first lookup by number if necessary
         if isinstance(name, (int, long)):
-            for oldName in self.listDatasets():
-                num = int(oldName[:5])
-                if name == num:
-                    name = oldName
-                    break
+            self.index.refresh()
+            name = self.index.numbers.get(name, name)
         # if it's still a number, we didn't find the set
         if isinstance(name, (int, long)):
             raise errors.DatasetNotFoundError(name)
@@ -265,15 +472,43 @@ class Session(object):
         if not (os.path.exists(file_base + '.csv') or os.path.exists(file_base + '.hdf5')):
             raise errors.DatasetNotFoundError(name)
 
-        if name in self.datasets:
-            dataset = self.datasets[name]
+        dataset = self.datasets.get(name)
+        if dataset is not None:
             dataset.access()
-        else:
-            # need to create a new wrapper for this dataset
-            dataset = Dataset(self, name)
-            self.datasets[name] = dataset
+            self.recent.hit((tuple(self.path), name), dataset)
+            self.access()
+            return dataset
+        if self.io is None:
+            return self._opened(Dataset.openFile(file_base), name)
+
+        # open the file in a worker thread; opening the same dataset again
+        # meanwhile waits for that rather than opening the file twice
+        waiting = self.opening.get(name)
+        if waiting is None:
+            waiting = self.opening[name] = []
+            d = self.io.call(Dataset.openFile, file_base)
+            d.addBoth(self._openDone, name)
+        d = defer.Deferred()
+        waiting.append(d)
+        return d
+
+    def _openDone(self, result, name):
+        waiting = self.opening.pop(name)
+        if not isinstance(result, failure.Failure):
+            try:
+                result = self._opened(result, name)
+            except Exception:
+                result = failure.Failure()
+        for d in waiting:
+            d.callback(result)
+
+    def _opened(self, opened, name):
+        """Make the wrapper for a dataset whose file was just opened."""
+        dataset = Dataset(self, name, io=self.io, catalog=self.catalog,
+                          share_params=self.share_params, opened=opened)
+        self.datasets[name] = dataset
+        self.recent.miss((tuple(self.path), name), dataset)
         self.access()
-
         return dataset
 
     def updateTags(self, tags, sessions, datasets):
@@ -312,6 +547,11 @@ class Session(object):
         dataUpdates = updateTagDict(tags, datasets, self.dataset_tags)
 
         self.access()
+        if self.catalog is not None:
+            for name, entryTags in sessUpdates:
+                self.catalog.setDirTags(list(self.path) + [name], entryTags)
+            for name, entryTags in dataUpdates:
+                self.catalog.setTags(self.path, name, entryTags)
         if len(sessUpdates) + len(dataUpdates):
             # fire a message about the new tags
             msg = (sessUpdates, dataUpdates)
@@ -322,29 +562,137 @@ class Session(object):
         dataTags = [(d, sorted(self.dataset_tags.get(d, []))) for d in datasets]
         return sessTags, dataTags
 
+class WriteBuffer(object):
+    """In-memory rows waiting to be appended to a dataset backend.
+
+    Rows are collected in a preallocated record array and handed to write
+    in one go when max_rows have accumulated, when the oldest row is
+    max_age seconds old, or when flush is called.  While rows are pending,
+    the flush timer keeps the buffer (and thus its dataset) alive.
+    """
+    def __init__(self, dtype, max_rows, max_age, write, reactor=reactor):
+        self._rows = np.empty((max_rows,), dtype=dtype)
+        self.count = 0
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.write = write
+        self.reactor = reactor
+        self._flushCall = None
+
+    def add(self, data):
+        if self.count + len(data) > self.max_rows:
+            self.flush()
+        if len(data) >= self.max_rows:
+            # too big to be worth buffering
+            self.write(data)
+            return
+        self._rows[self.count:self.count + len(data)] = data
+        self.count += len(data)
+        if self.count == self.max_rows:
+            self.flush()
+        elif self._flushCall is None:
+            self._flushCall = self.reactor.callLater(self.max_age, self.flush)
+
+    def pending(self):
+        """Get the rows that have not been written yet."""
+        return self._rows[:self.count]
+
+    def flush(self):
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+        if self.count:
+            self.write(self.pending())
+            self.count = 0
+
+
+DatasetInfo = collections.namedtuple(
+    'DatasetInfo',
+    ['version', 'independents', 'dependents', 'rowType', 'transposeType',
+     'dtype'])
+
+
 class Dataset(object):
     """
     This object basically takes care of listeners and notifications.
     All the actual data or metadata access is proxied through to a
     backend object.
     """
-    def __init__(self, session, name, title=None, create=False, independents=[], dependents=[], extended=False):
+    def __init__(self, session, name, title=None, create=False, independents=[], dependents=[], extended=False,
+                 storage=backend.DEFAULT_STORAGE, reactor=reactor, io=None,
+                 catalog=None, grid=None, share_params=False, opened=None):
         self.hub = session.hub
+        self.path = session.path
+        self.index = session.index
         self.name = name
+        self.reactor = reactor
+        self.io = io # workers.IOScheduler, or None to do I/O right away
+        self.catalog = catalog
+        self._buffer = None
+        self._summary = None
         file_base = os.path.join(session.dir, filename_encode(name))
         self.listeners = set() # contexts that want to hear about added data
         self.param_listeners = set()
         self.comment_listeners = set()
+        self.count_listeners = set() # contexts that have this dataset open
+        self.notify_interval = 0
+        self.notify_rows = 0
+        self._notifyCall = None
+        self._lastNotify = None
+        self._notified = 0 # data notifications sent so far
+        self._syncCall = None
+        self._rows = None # row count, once rows have been added
+        self._counting = None # rows added while the stored rows are counted
+        self._recent = [] # rows added since the last data count, if few
 
         if create:
             indep = [self.makeIndependent(i, extended) for i in independents]
             dep = [self.makeDependent(d, extended) for d in dependents]
-            self.data = backend.create_backend(file_base, title, indep, dep, extended)
+            self.data = backend.create_backend(file_base, title, indep, dep, extended, storage, grid)
             self.save()
+            self._info = self.describe(self.data)
         else:
-            self.data = backend.open_backend(file_base)
-            self.load()
+            # opened is what openFile returned, if the caller already ran it
+            if opened is None:
+                opened = self.openFile(file_base)
+            self.data, self._info = opened
+            self.data._file.unpin() # hand the file over to the FilePool
             self.access()
+        # see backend.ParamBlobStore
+        self.data.share_params = share_params
+
+    @classmethod
+    def openFile(cls, file_base):
+        """Open and load a dataset file, and describe it.
+
+        This does file I/O, so the server runs it in a worker thread when
+        it has an I/O scheduler.  The file stays pinned, away from the
+        FilePool, until the Dataset made from it unpins it in the reactor
+        thread.  Returns the backend and its description.
+        """
+        data = backend.open_backend(file_base, pinned=True)
+        try:
+            data.load()
+            return data, cls.describe(data)
+        except Exception:
+            data._file().close() # the pool never knew of it
+            raise
+
+    @staticmethod
+    def describe(data):
+        """Read what never changes about a dataset: version, variables and types.
+
+        The dataset keeps these, so that settings that only need them don't
+        read the file.
+        """
+        try:
+            dtype = data.dtype
+        except errors.UnsupportedDatasetError:
+            dtype = None # gridded datasets have no rows
+        return DatasetInfo(tuple(data.version), data.getIndependents(),
+                           data.getDependents(), data.getRowType(),
+                           data.getTransposeType(), dtype)
 
     def save(self):
         self.data.save()
@@ -353,11 +701,25 @@ class Dataset(object):
         self.data.load()
 
     def version(self):
-        v = self.data.version
-        return '.'.join(str(x) for x in v)
+        return '.'.join(str(x) for x in self._info.version)
+
+    @property
+    def extended(self):
+        """Whether this is an extended dataset (version 3)."""
+        return self._info.version[0] >= 3
+
+    @property
+    def dtype(self):
+        """The numpy dtype of a row."""
+        if self._info.dtype is None:
+            raise errors.UnsupportedDatasetError('row data')
+        return self._info.dtype
 
     def access(self):
         """Update time of last access for this dataset."""
+        return self._run(workers.SMALL, self._access)
+
+    def _access(self):
         self.data.access()
         self.save()
 
@@ -382,53 +744,391 @@ class Dataset(object):
         return backend.Dependent(label=label, legend=legend, shape=(1,), datatype='v', unit=units)
 
     def getIndependents(self):
-        return self.data.getIndependents()
+        return self._info.independents
 
     def getDependents(self):
-        return self.data.getDependents()
+        return self._info.dependents
 
     def getRowType(self):
-        return self.data.getRowType()
+        return self._info.rowType
 
     def getTransposeType(self):
-        return self.data.getTransposeType()
+        return self._info.transposeType
 
-    def addParameter(self, name, data, saveNow=True):
-        self.data.addParam(name, data)
-        if saveNow:
-            self.save()
+    def _run(self, kind, func, *args):
+        """Run func(*args), which uses this dataset's file.
 
-        # notify all listening contexts
-        self.hub.onNewParameter(None, self.param_listeners)
-        self.param_listeners = set()
-        return name
+        Without an I/O scheduler func runs right away and its result is
+        returned.  Otherwise it runs in a worker thread after the jobs
+        already submitted for this dataset, and a Deferred is returned.
+        kind is workers.READ, WRITE or SMALL.
+        """
+        if self.io is None:
+            return func(*args)
+        return self.io.submit(self.data._file, kind, func, *args)
 
-    def addParameters(self, params, saveNow=True):
-        for name, data in params:
-            self.data.addParam(name, data)
-        if saveNow:
-            self.save()
+    def _change(self, kind, func, *args):
+        """Run a job that changes the file, and flush the file soon after.
 
+        HDF5 keeps recent changes in memory until the file is flushed, so
+        this is what lets other processes read the file directly (see
+        datavault.direct) while the dataset is being written.  The file is
+        flushed at most once every SYNC_DELAY seconds.
+        """
+        result = self._run(kind, func, *args)
+        if self._syncCall is None:
+            self._syncCall = self.reactor.callLater(SYNC_DELAY, self._sync)
+        return result
+
+    def _sync(self):
+        self._syncCall = None
+        return self._run(workers.WRITE, self.data._file.flush)
+
+    def addParameter(self, name, data, saveNow=True):
+        result = self.addParameters([(name, data)], saveNow)
+        return workers.then(result, lambda _: name)
+
+    def addParameters(self, params, saveNow=True):
+        def add():
+            for name, data in params:
+                self.data.addParam(name, data)
+            if saveNow:
+                self.save()
+        before = self.index.mtime()
+        return workers.then(self._change(workers.SMALL, add), self._paramsAdded,
+                            params, before)
+
+    def _paramsAdded(self, _, params, before):
+        if self.data.share_params:
+            # the shared parameter store is in the directory
+            self.index.changed(before)
+        if self.catalog is not None:
+            self.catalog.addParams(self.path, self.name, params)
         # notify all listening contexts
         self.hub.onNewParameter(None, self.param_listeners)
         self.param_listeners = set()
 
     def getParameter(self, name, case_sensitive=True):
-        return self.data.getParameter(name, case_sensitive)
+        return self._run(workers.SMALL, self.data.getParameter, name,
+                         case_sensitive)
 
     def getParamNames(self):
-        return self.data.getParamNames()
+        return self._run(workers.SMALL, self.data.getParamNames)
 
-    def addData(self, data):
-        # append the data to the file
+    def getParameters(self):
+        """Get a list of (name, value) for all dataset parameters."""
+        return self._run(workers.SMALL, self._getParameters)
+
+    def _getParameters(self):
+        return [(name, self.data.getParameter(name))
+                for name in self.data.getParamNames()]
+
+    def setBuffering(self, max_rows, max_age):
+        """Collect added rows in memory and write them in batches.
+
+        Buffered rows are written once max_rows have accumulated or the
+        oldest is max_age seconds old.  max_rows of zero turns buffering off.
+        """
+        self.flush()
+        if not max_rows:
+            self._buffer = None
+            return
+        if not hasattr(self.data, 'formatRows'):
+            raise errors.UnsupportedDatasetError('buffer writes')
+        self._buffer = WriteBuffer(self.dtype, max_rows, max_age,
+                                   self._write, reactor=self.reactor)
+
+    def flush(self):
+        """Write any buffered rows to the backend."""
+        if self._buffer is not None:
+            self._buffer.flush()
+
+    def _write(self, data):
+        """Append rows to the backend, keeping the block summary current."""
+        if self.io is not None:
+            data = data.copy() # the write buffer reuses its rows
+        return self._change(workers.WRITE, self._writeNow, data)
+
+    def _writeNow(self, data):
         self.data.addData(data)
+        if self._summary is not None:
+            self._summary.add(summary.numeric_columns(data, 'summary'))
 
-        # notify all listening contexts
+    def addData(self, data):
+        if (self._rows is None and self._counting is None and
+                hasattr(self.data, '__len__')):
+            # nothing has been written through this object yet, so count
+            # the stored rows first (in the file's queue, ahead of the write)
+            self._counting = 0
+            workers.then(self._run(workers.SMALL, len, self.data),
+                         self._counted)
+        # append the data to the file (or to the write buffer)
+        if self._buffer is None:
+            result = self._write(data)
+        else:
+            result = self._buffer.add(data)
+        if self._rows is not None:
+            self._addRows(len(data))
+        elif self._counting is not None:
+            self._counting += len(data)
+        if self._recent is not None:
+            if sum(len(rows) for rows in self._recent) + len(data) <= self.notify_rows:
+                self._recent.append(data)
+            else:
+                self._recent = None
+
+        # notify all listening contexts; their reads queue up behind the write
+        self._notify()
+        return result
+
+    def _counted(self, stored):
+        added, self._counting = self._counting, None
+        self._rows = stored
+        self._addRows(added)
+
+    def _addRows(self, count):
+        self._rows += count
+        if self.catalog is not None:
+            self.catalog.setRows(self.path, self.name, self._rows)
+
+    def _notify(self):
+        """Tell listeners about new data now, or after notify_interval."""
+        if not self.notify_interval:
+            self._notifyData()
+        elif self._notifyCall is None:
+            now = self.reactor.seconds()
+            wait = 0 if self._lastNotify is None else self._lastNotify + self.notify_interval - now
+            if wait <= 0:
+                self._notifyData()
+            else:
+                self._notifyCall = self.reactor.callLater(wait, self._notifyData)
+
+    def setNotify(self, interval, max_rows):
+        """Send data notifications at most once every interval seconds.
+
+        Contexts that have the dataset open also get the new row count, and
+        the new rows themselves if there are at most max_rows of them.
+        """
+        self.notify_interval = interval
+        self.notify_rows = min(max_rows, NOTIFY_MAX_ROWS)
+        if self._notifyCall is not None and not interval:
+            self._notifyCall.cancel()
+            self._notifyData()
+
+    def _notifyData(self):
+        self._notifyCall = None
+        self._lastNotify = self.reactor.seconds()
+        self._notified += 1
         self.hub.onDataAvailable(None, self.listeners)
         self.listeners = set()
+        if self.count_listeners and self._rows is not None:
+            self.hub.onDataCount((self._rows, self._recentValues()),
+                                 self.count_listeners)
+        self._recent = []
+
+    def _recentValues(self):
+        """Get the rows added since the last data count, if they are few."""
+        if not self._recent:
+            return np.zeros((0, len(self.dtype)))
+        try:
+            return summary.numeric_columns(np.concatenate(self._recent), 'notify')
+        except errors.UnsupportedDatasetError:
+            return np.zeros((0, len(self.dtype)))
+
+    def _pending(self):
+        """Get the rows in the write buffer, copied for worker threads."""
+        if self._buffer is None or not self._buffer.count:
+            return ()
+        pending = self._buffer.pending()
+        return pending if self.io is None else pending.copy()
 
     def getData(self, limit, start, transpose=False, simpleOnly=False):
-        return self.data.getData(limit, start, transpose, simpleOnly)
+        return self._run(workers.READ, self._getData, limit, start, transpose,
+                         simpleOnly, self._pending())
+
+    def _getData(self, limit, start, transpose, simpleOnly, pending):
+        if not len(pending):
+            return self.data.getData(limit, start, transpose, simpleOnly)
+        # the requested rows may be split between the file and the buffer
+        stored = len(self.data)
+        total = stored + len(pending)
+        stop = total if limit is None else min(start + limit, total)
+        if stop <= stored:
+            return self.data.getData(limit, start, transpose, simpleOnly)
+        rows = pending[max(start - stored, 0):stop - stored]
+        if start < stored:
+            rows = np.concatenate((self.data.readRows(stored - start, start), rows))
+        return self.data.formatRows(rows, transpose, simpleOnly), start + len(rows)
+
+    def readValues(self, start, stop, setting):
+        """Read stored rows [start, stop) as a 2-D float array.
+
+        Raises UnsupportedDatasetError, naming setting, unless every column
+        holds scalar numbers.
+        """
+        if hasattr(self.data, 'readRows'):
+            rows = self.data.readRows(stop - start, start)
+            return summary.numeric_columns(rows, setting)
+        data, _ = self.data.getData(stop - start, start, False, True)
+        return np.asarray(data, dtype=float).reshape((-1, len(self.dtype)))
+
+    def rowCount(self, setting):
+        """Get the number of rows, including any still in the write buffer."""
+        if not hasattr(self.data, '__len__'):
+            raise errors.UnsupportedDatasetError(setting)
+        pending = self._buffer.count if self._buffer is not None else 0
+        return workers.then(self._run(workers.SMALL, len, self.data),
+                            lambda stored: stored + pending)
+
+    def getSummary(self, setting):
+        """Get the block summary of this dataset, building it if needed."""
+        self.flush()
+        return self._run(workers.READ, self._getSummary, setting)
+
+    def _getSummary(self, setting):
+        # buffered rows are summarized as they are written
+        if not hasattr(self.data, '__len__'):
+            raise errors.UnsupportedDatasetError(setting)
+        rows = len(self.data)
+        if self._summary is None:
+            blocks = summary.BlockSummary(len(self.dtype))
+            step = 64 * blocks.block_rows
+            for start in xrange(0, rows, step):
+                blocks.add(self.readValues(start, min(start + step, rows), setting))
+            self._summary = blocks
+        return self._summary
+
+    def getDecimated(self, x_col, n_buckets, start, stop):
+        """Get a min/max envelope of rows [start, stop) for plotting.
+
+        See summary.BlockSummary.decimate.  stop of None means the end of
+        the dataset.
+        """
+        self.flush()
+        return self._run(workers.READ, self._getDecimated, x_col, n_buckets,
+                         start, stop)
+
+    def _getDecimated(self, x_col, n_buckets, start, stop):
+        name = 'get decimated'
+        blocks = self._getSummary(name)
+        if x_col >= blocks.cols:
+            raise errors.BadColumnError(x_col, blocks.cols)
+        if not n_buckets:
+            return np.zeros((0, blocks.cols))
+        stop = blocks.rows if stop is None else min(stop, blocks.rows)
+        start = min(start, stop)
+        read = lambda a, b: self.readValues(a, b, name)
+        return blocks.decimate(read, x_col, n_buckets, start, stop)
+
+    def query(self, column, lo, hi, limit, start):
+        """Find the rows from start on whose value in column is in [lo, hi].
+
+        See summary.BlockSummary.query.  Returns up to limit rows (all of
+        them if limit is None) and the row at which to continue the query.
+        """
+        self.flush()
+        return self._run(workers.READ, self._query, column, lo, hi, limit, start)
+
+    def _query(self, column, lo, hi, limit, start):
+        name = 'query'
+        blocks = self._getSummary(name)
+        if column >= blocks.cols:
+            raise errors.BadColumnError(column, blocks.cols)
+        start = min(start, blocks.rows)
+        read = lambda a, b: self.readValues(a, b, name)
+        return blocks.query(read, column, lo, hi, limit, start)
+
+    def getRange(self, start, stop, step, columns, transpose=False):
+        """Get every step'th row in [start, stop), with only some columns.
+
+        columns is a list of column indices; all columns are returned if it
+        is empty.  stop of None means the end of the dataset.  Unlike
+        getData this does not change any streaming position or listeners.
+        Returns a 2-D float array, or a tuple of columns if transpose is set.
+        """
+        return self._run(workers.READ, self._getRange, start, stop, step,
+                         columns, transpose, self._pending())
+
+    def _getRange(self, start, stop, step, columns, transpose, pending):
+        cols = len(self.dtype)
+        columns = list(columns) or range(cols)
+        for col in columns:
+            if col >= cols:
+                raise errors.BadColumnError(col, cols)
+        step = max(step, 1)
+        if not hasattr(self.data, 'readRange'):
+            # csv datasets: every column is a float
+            limit = None if stop is None else max(stop - start, 0)
+            data, _ = self.data.getData(limit, start, False, True)
+            data = np.asarray(data, dtype=float).reshape((-1, cols))
+            data = data[::step, columns]
+            return tuple(data.T) if transpose else data
+
+        names = [self.dtype.names[col] for col in columns]
+        stored = len(self.data)
+        total = stored + len(pending)
+        stop = total if stop is None else min(stop, total)
+        rows = self.data.readRange(start, min(stop, stored), step, names)
+        if stop > stored:
+            # continue the stride into the rows still in the write buffer
+            first = start if start >= stored else start + -(-(stored - start) // step) * step
+            buffered = pending[first - stored:stop - stored:step]
+            rows = np.concatenate((rows, buffered[names].astype(rows.dtype)))
+        if transpose:
+            return self.data._transposeRows(rows)
+        for name in names:
+            if rows.dtype[name] != np.float64:
+                raise errors.DataVersionMismatchError()
+        if not len(names):
+            return np.zeros((len(rows), 0))
+        return np.column_stack([rows[name] for name in names])
+
+    def _grid(self, setting):
+        """Get the backend of a gridded dataset, for setting."""
+        if not hasattr(self.data, 'readSlab'):
+            raise errors.UnsupportedDatasetError(setting)
+        return self.data
+
+    def gridShape(self):
+        return self._grid('grid shape').gridShape()
+
+    def getAxis(self, axis):
+        return self._run(workers.SMALL, self._grid('get axis').getAxis, axis)
+
+    def setAxis(self, axis, values):
+        return self._change(workers.SMALL, self._grid('set axis').setAxis, axis,
+                            values)
+
+    def addSlab(self, start, data):
+        """Write the points of a slab of a gridded dataset.
+
+        See backend.GriddedHDF5Data.writeSlab.  Listeners are notified as
+        for added rows.
+        """
+        grid = self._grid('add slab')
+        if self.io is not None:
+            data = [np.array(d) for d in data]
+        result = self._change(workers.WRITE, grid.writeSlab, start, data)
+        self._notify()
+        return result
+
+    def getSlab(self, start, stop):
+        return self._run(workers.READ, self._grid('get slab').readSlab, start,
+                         stop)
+
+    def getSlice(self, axis, index):
+        return self._run(workers.READ, self._grid('get slice').readSlice,
+                         axis, index)
+
+    def hasMore(self, pos):
+        pending = self._buffer.count if self._buffer is not None else 0
+        return self._run(workers.SMALL, self._hasMore, pos, pending)
+
+    def _hasMore(self, pos, pending):
+        # buffered rows stay in the buffer until a later write job
+        if pending:
+            return pos < len(self.data) + pending
+        return self.data.hasMore(pos)
 
     def keepStreaming(self, context, pos):
         # keepStreaming does something a bit odd and has a confusing name (ERJ)
@@ -445,7 +1145,14 @@ class Dataset(object):
         # 
         # If a client reads, but not to the end of the dataset, it is immediately notified that
         # there is more data for it to read, and then removed from the set of notifiers.
-        if self.data.hasMore(pos):
+        #
+        # With an I/O scheduler hasMore answers later, so a notification sent
+        # in the meantime also counts as more data.
+        return workers.then(self.hasMore(pos), self._stream, context,
+                            self._notified)
+
+    def _stream(self, more, context, notified):
+        if more or notified != self._notified:
             if context in self.listeners:
                 self.listeners.remove(context)
             self.hub.onDataAvailable(None, [context])
@@ -453,18 +1160,25 @@ class Dataset(object):
             self.listeners.add(context)
 
     def addComment(self, user, comment):
-        self.data.addComment(user, comment)
-        self.save()
+        def add():
+            self.data.addComment(user, comment)
+            self.save()
+        return workers.then(self._change(workers.SMALL, add), self._commentAdded)
 
+    def _commentAdded(self, _):
         # notify all listening contexts
         self.hub.onCommentsAvailable(None, self.comment_listeners)
         self.comment_listeners = set()
 
     def getComments(self, limit, start):
-        return self.data.getComments(limit, start)
+        return self._run(workers.SMALL, self.data.getComments, limit, start)
 
     def keepStreamingComments(self, context, pos):
-        if pos < self.data.numComments():
+        count = self._run(workers.SMALL, self.data.numComments)
+        return workers.then(count, self._streamComments, context, pos)
+
+    def _streamComments(self, count, context, pos):
+        if pos < count:
             if context in self.comment_listeners:
                 self.comment_listeners.remove(context)
             self.hub.onCommentsAvailable(None, [context])
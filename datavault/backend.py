@@ -1,10 +1,14 @@
 import base64
 import collections
 import datetime
+import hashlib
 import os
 import re
+import sqlite3
 import sys
+import threading
 import time
+import weakref
 
 import h5py
 from twisted.internet import reactor
@@ -26,12 +30,86 @@ from . import errors, util
 Independent = collections.namedtuple('Independent', ['label', 'shape', 'datatype', 'unit'])
 Dependent = collections.namedtuple('Dependent', ['label', 'legend', 'shape', 'datatype', 'unit'])
 
+## HDF5 storage layout for new datasets
+
+StorageOptions = collections.namedtuple('StorageOptions', ['chunk_rows', 'compression', 'compression_opts', 'shuffle', 'layout'])
+DEFAULT_STORAGE = StorageOptions(chunk_rows=0, compression=None, compression_opts=None, shuffle=False, layout='rows')
+
+LAYOUTS = ('rows', 'columns')
+
+def parse_storage(filters='', chunk_rows=0, default=DEFAULT_STORAGE, layout=''):
+    """Build StorageOptions from a filter pipeline and chunk size.
+
+    filters is a '+' separated list of HDF5 filters shipped with h5py:
+    'shuffle', 'gzip' or 'gzip:<level>', and 'lzf', e.g. 'shuffle+gzip:4'.
+    'none' turns compression off.  layout is 'rows' for one HDF5 dataset of
+    rows (version 2 and 3 files) or 'columns' for one HDF5 dataset per
+    column (version 4 files).  An empty filters string or layout, or zero
+    chunk_rows, keeps the corresponding setting from default.
+    """
+    if layout and layout.lower() not in LAYOUTS:
+        raise errors.BadLayoutError(layout)
+    compression = default.compression
+    compression_opts = default.compression_opts
+    shuffle = default.shuffle
+    if filters:
+        compression = compression_opts = None
+        shuffle = False
+        for f in filters.lower().split('+'):
+            name, _, level = f.strip().partition(':')
+            if name == 'shuffle' and not level:
+                shuffle = True
+            elif name == 'lzf' and not level:
+                compression = 'lzf'
+            elif name == 'gzip':
+                compression = 'gzip'
+                if level:
+                    if not level.isdigit() or int(level) > 9:
+                        raise errors.BadStorageError(filters)
+                    compression_opts = int(level)
+            elif name != 'none':
+                raise errors.BadStorageError(filters)
+    return StorageOptions(chunk_rows=chunk_rows or default.chunk_rows,
+                          compression=compression,
+                          compression_opts=compression_opts,
+                          shuffle=shuffle,
+                          layout=layout.lower() if layout else default.layout)
+
+def _create_kw(storage, shape=(), chunk_rows=0):
+    """Keyword arguments for h5py create_dataset to apply storage options.
+
+    shape is the shape of each element for datasets of arrays.  chunk_rows
+    is used when storage does not set a chunk size; 0 lets h5py choose.
+    """
+    chunk_rows = storage.chunk_rows or chunk_rows
+    kw = dict(maxshape=(None,) + shape,
+              chunks=(chunk_rows,) + shape if chunk_rows else True)
+    if storage.compression:
+        kw['compression'] = storage.compression
+        kw['compression_opts'] = storage.compression_opts
+    if storage.shuffle:
+        kw['shuffle'] = True
+    return kw
+
 TIME_FORMAT = '%Y-%m-%d, %H:%M:%S'
 PRECISION = 12 # digits of precision to use when saving data
 DATA_FORMAT = '%%.%dG' % PRECISION
 FILE_TIMEOUT_SEC = 60 # how long to keep datafiles open if not accessed
 DATA_TIMEOUT = 300 # how long to keep data in memory if not accessed
+MAX_OPEN_FILES = 256 # most datafiles to keep open at once
+MAX_GROWTH_ROWS = 1 << 20 # most rows to preallocate in a single HDF5 resize
+COLUMN_CHUNK_BYTES = 1 << 16 # default chunk size of each column in version 4 files
+GRID_CHUNK_BYTES = 1 << 20 # most bytes per chunk of a gridded (version 5) dataset
+COMMENT_CHUNK_ROWS = 64 # chunk size of the resizable 'Comments' HDF5 dataset
+CSV_BLOCK_ROWS = 256 # rows between byte offsets kept in the CSV row index
+CSV_READ_BYTES = 1 << 20 # how much of a CSV file to scan at a time when indexing
+CSV_CACHE_BYTES = 64 << 20 # memory budget for parsed CSV blocks, shared by all files
 DATA_URL_PREFIX = 'data:application/labrad;base64,'
+PARAM_BLOB_FILE = 'params.blobs' # shared parameter values of a session directory
+PARAM_BLOB_PREFIX = 'blob:sha256:'
+PARAM_BLOB_MIN_BYTES = 256 # smaller parameter values are always stored inline
+PARAM_CACHE_BYTES = 32 << 20 # memory budget for decoded shared parameter values
+PARAM_BLOB_STORES = 64 # most parameter stores to keep open at once
 
 def time_to_str(t):
     return t.strftime(TIME_FORMAT)
@@ -62,38 +140,233 @@ def labrad_urldecode(data_url):
         raise ValueError("Trying to labrad_urldecode data that doesn't start "
                          "with prefix: {}".format(DATA_URL_PREFIX))
 
+class ParamBlobStore(object):
+    """Parameter values shared by the datasets of a session directory.
+
+    Experiment scripts tend to attach the same large parameters (registry
+    snapshots, calibration arrays) to every dataset.  With parameter sharing
+    on, each encoded value of at least PARAM_BLOB_MIN_BYTES is stored once
+    in an SQLite file in the directory, keyed by its SHA-256 hash, and the
+    dataset only stores a 'blob:sha256:<hash>' reference.  Decoded values
+    are kept in an LRU cache shared by all directories, since the same hash
+    always means the same value.
+
+    Stores are used from worker threads, so access is locked.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.filename, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS blobs '
+                             '(hash TEXT PRIMARY KEY, data BLOB NOT NULL)')
+            self._db.commit()
+        return self._db
+
+    def share(self, data_url):
+        """Store an encoded value, returning the reference to save instead.
+
+        Small values are returned unchanged.
+        """
+        if len(data_url) < PARAM_BLOB_MIN_BYTES:
+            return data_url
+        key = hashlib.sha256(data_url).hexdigest()
+        with self._lock:
+            db = self._connect()
+            cursor = db.execute('INSERT OR IGNORE INTO blobs VALUES (?, ?)',
+                                (key, buffer(data_url)))
+            if cursor.rowcount:
+                db.commit()
+        return PARAM_BLOB_PREFIX + key
+
+    def load(self, ref):
+        """Get the decoded value of a reference returned by share."""
+        key = ref[len(PARAM_BLOB_PREFIX):]
+        with _param_values_lock:
+            entry = _param_values.get(key)
+        if entry is not None:
+            return entry[1]
+        with self._lock:
+            row = None
+            if os.path.exists(self.filename):
+                row = self._connect().execute(
+                        'SELECT data FROM blobs WHERE hash = ?', (key,)).fetchone()
+        if row is None:
+            raise errors.ParameterBlobError(ref)
+        data_url = str(row[0])
+        value = labrad_urldecode(data_url)
+        with _param_values_lock:
+            _param_values[key] = (len(data_url), value)
+        return value
+
+_param_values = util.LRUCache(PARAM_CACHE_BYTES, sizeof=lambda entry: entry[0])
+_param_values_lock = threading.Lock()
+_blob_stores = util.LRUCache(PARAM_BLOB_STORES)
+_blob_stores_lock = threading.Lock()
+
+def param_blobs(dirname):
+    """Get the ParamBlobStore of a directory."""
+    dirname = os.path.abspath(dirname)
+    with _blob_stores_lock:
+        store = _blob_stores.get(dirname)
+        if store is None:
+            store = ParamBlobStore(os.path.join(dirname, PARAM_BLOB_FILE))
+            _blob_stores[dirname] = store
+    return store
+
+class FilePool(object):
+    """Keeps track of the open SelfClosingFiles and closes idle ones.
+
+    One sweep timer for the whole pool closes files that have not been
+    used within their timeout, instead of every file keeping a timer of its
+    own.  When more than max_open files are open, the least recently used
+    ones are closed straight away.  hits, misses and evictions count uses
+    of an already-open file, (re)opens and closes forced by max_open.
+    """
+    def __init__(self, max_open=MAX_OPEN_FILES, reactor=reactor):
+        self.max_open = max_open
+        self.reactor = reactor
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._open = collections.OrderedDict() # file -> time of last use
+        self._sweepCall = None
+
+    def __len__(self):
+        return len(self._open)
+
+    def touch(self, f, opened):
+        """Record a use of an open file, newly opened if opened is set."""
+        if opened:
+            self.misses += 1
+        elif f not in self._open:
+            return # used by an onClose callback while being closed
+        else:
+            self.hits += 1
+            del self._open[f]
+        self._open[f] = self.reactor.seconds()
+        self.shrink(keep=f)
+        if self._sweepCall is None:
+            self._sweepCall = self.reactor.callLater(f.timeout, self._sweep)
+
+    def discard(self, f):
+        """Forget a file that has been closed."""
+        self._open.pop(f, None)
+        if not self._open and self._sweepCall is not None:
+            self._sweepCall.cancel()
+            self._sweepCall = None
+
+    def shrink(self, keep=None):
+        """Close least recently used files until at most max_open are open.
+
+        Pinned files and keep (the file being used) are never closed, even
+        if that leaves too many open.
+        """
+        excess = len(self._open) - self.max_open
+        if excess <= 0:
+            return
+        for f in [f for f in self._open if not f.pins and f is not keep][:excess]:
+            del self._open[f]
+            self.evictions += 1
+            f._fileTimeout()
+
+    def _sweep(self):
+        self._sweepCall = None
+        now = self.reactor.seconds()
+        nextSweep = None
+        for f, used in self._open.items():
+            if f.pins:
+                # in use by a worker thread; unpin counts as a use
+                left = f.timeout
+                nextSweep = left if nextSweep is None else min(nextSweep, left)
+            elif now - used >= f.timeout:
+                del self._open[f]
+                f._fileTimeout()
+            else:
+                left = f.timeout - (now - used)
+                nextSweep = left if nextSweep is None else min(nextSweep, left)
+        if nextSweep is not None:
+            self._sweepCall = self.reactor.callLater(nextSweep, self._sweep)
+
+_pools = weakref.WeakKeyDictionary()
+
+def file_pool(reactor=reactor):
+    """Get the FilePool shared by all files using the given reactor."""
+    if reactor not in _pools:
+        _pools[reactor] = FilePool(reactor=reactor)
+    return _pools[reactor]
+
 class SelfClosingFile(object):
     """A container for a file object that manages the underlying file handle.
 
     The file will be opened on demand when this container is called, then
-    closed automatically if not accessed within a specified timeout.
+    closed automatically if not accessed within a specified timeout, or
+    sooner if the FilePool needs room for other files.  A pinned file stays
+    open and can be used from worker threads, which must not touch the pool.
+    With pinned, the file is opened already pinned without touching the
+    pool, so it can be made in a worker thread; the pool hears of it at the
+    matching unpin, which must be in the reactor thread.
     """
     def __init__(self, opener=open, open_args=(), open_kw={},
-                 timeout=FILE_TIMEOUT_SEC, touch=True, reactor=reactor):
+                 timeout=FILE_TIMEOUT_SEC, touch=True, reactor=reactor,
+                 pool=None, pinned=False):
         self.opener = opener
         self.open_args = open_args
         self.open_kw = open_kw
         self.timeout = timeout
         self.callbacks = []
         self.reactor = reactor
-        if touch:
+        self.pool = file_pool(reactor) if pool is None else pool
+        self.pins = 0
+        self._pooled = False # whether the pool knows the file is open
+        if pinned:
+            self._file = self.opener(*self.open_args, **self.open_kw)
+            self.pins = 1
+        elif touch:
             self.__call__()
 
     def __call__(self):
+        if self.pins:
+            return self._file
         if not hasattr(self, '_file'):
             self._file = self.opener(*self.open_args, **self.open_kw)
-            self._fileTimeoutCall = self.reactor.callLater(
-                    self.timeout, self._fileTimeout)
-        else:
-            self._fileTimeoutCall.reset(self.timeout)
+        self.pool.touch(self, not self._pooled)
+        self._pooled = True
         return self._file
 
+    def pin(self):
+        """Open the file and keep it open until a matching unpin."""
+        self()
+        self.pins += 1
+
+    def unpin(self):
+        self.pins -= 1
+        if not self.pins:
+            self()
+
     def _fileTimeout(self):
         for callback in self.callbacks:
             callback(self)
         self._file.close()
         del self._file
-        del self._fileTimeoutCall
+        self._pooled = False
+
+    def close(self):
+        """Close the file now if it is open, running the onClose callbacks."""
+        if hasattr(self, '_file'):
+            self.pool.discard(self)
+            self._fileTimeout()
+
+    def flush(self):
+        """Write out whatever the open file still holds in memory.
+
+        Does nothing if the file is closed, since closing flushes it.
+        """
+        if hasattr(self, '_file'):
+            self._file.flush()
 
     def size(self):
         return os.fstat(self().fileno()).st_size
@@ -102,6 +375,38 @@ class SelfClosingFile(object):
         """Calls callback *before* the file is closes."""
         self.callbacks.append(callback)
 
+class ReadOnlyFile(object):
+    """A file opened read-only, outside the FilePool.
+
+    It can stand in for a SelfClosingFile, but stays open until closed and
+    never touches the pool or the reactor, so it can be used from any
+    thread.  The backends register callbacks that trim the file when it
+    closes; those are for the server's own handles, so they are dropped.
+    """
+    def __init__(self, opener=open, open_args=(), open_kw={}):
+        self._file = opener(*open_args, **open_kw)
+
+    def __call__(self):
+        return self._file
+
+    def pin(self):
+        pass
+
+    def unpin(self):
+        pass
+
+    def close(self):
+        self._file.close()
+
+    def flush(self):
+        pass
+
+    def size(self):
+        return os.fstat(self._file.fileno()).st_size
+
+    def onClose(self, callback):
+        pass
+
 class IniData(object):
     """Handles dataset metadata stored in INI files.
 
@@ -146,9 +451,13 @@ class IniData(object):
             sec = 'Parameter {}'.format(i+1)
             label = S.get(sec, 'Label', raw=True)
             raw = S.get(sec, 'Data', raw=True)
-            if raw.startswith(DATA_URL_PREFIX):
-                # decode parameter data from dataurl
-                data = labrad_urldecode(raw)
+            if raw.startswith((DATA_URL_PREFIX, PARAM_BLOB_PREFIX)):
+                # decode parameter data from dataurl or shared value
+                if raw.startswith(PARAM_BLOB_PREFIX):
+                    data = param_blobs(os.path.dirname(self.infofile)).load(raw)
+                else:
+                    data = labrad_urldecode(raw)
+                return dict(label=label, data=data, raw=raw)
             else:
                 # old parameters may have been saved using repr
                 try:
@@ -208,9 +517,10 @@ class IniData(object):
             sec = 'Parameter {}'.format(i+1)
             S.add_section(sec)
             S.set(sec, 'Label', par['label'])
-            # encode the parameter value as a data-url
-            data_url = labrad_urlencode(par['data'])
-            S.set(sec, 'Data', data_url)
+            # encode the parameter value as a data-url, once
+            if 'raw' not in par:
+                par['raw'] = labrad_urlencode(par['data'])
+            S.set(sec, 'Data', par['raw'])
 
         sec = 'Comments'
         S.add_section(sec)
@@ -257,11 +567,16 @@ class IniData(object):
         type_tag = '({})'.format(','.join(units))
         return type_tag
 
+    share_params = False # keep large values in the directory's ParamBlobStore
+
     def addParam(self, name, data):
         for p in self.parameters:
             if p['label'] == name:
                 raise errors.ParameterInUseError(name)
         d = dict(label=name, data=data)
+        if self.share_params:
+            d['raw'] = param_blobs(os.path.dirname(self.infofile)).share(
+                    labrad_urlencode(data))
         self.parameters.append(d)
 
     def getParameter(self, name, case_sensitive=True):
@@ -300,11 +615,12 @@ class CsvListData(IniData):
                  filename,
                  file_timeout=FILE_TIMEOUT_SEC,
                  data_timeout=DATA_TIMEOUT,
-                 reactor=reactor):
+                 reactor=reactor,
+                 pinned=False):
         self.filename = filename
         self._file = SelfClosingFile(open_args=(filename, 'a+'),
                                      timeout=file_timeout,
-                                     reactor=reactor)
+                                     reactor=reactor, pinned=pinned)
         self.timeout = data_timeout
         self.infofile = filename[:-4] + '.ini'
         self.reactor = reactor
@@ -369,64 +685,132 @@ class CsvListData(IniData):
     def hasMore(self, pos):
         return pos < len(self.data)
 
-class CsvNumpyData(CsvListData):
-    """Data backed by a csv-formatted file.
+_csv_blocks = util.LRUCache(CSV_CACHE_BYTES, sizeof=lambda block: block.nbytes)
+_csv_blocks_lock = threading.Lock()
 
-    Stores the entire contents of the file in memory as a list or numpy array
+class CsvIndexedData(IniData):
+    """Data backed by a csv-formatted file, read in blocks on demand.
+
+    Rather than loading the whole file, this keeps the byte offset of every
+    CSV_BLOCK_ROWS'th row.  Reads parse only the blocks covering the
+    requested rows, and complete blocks are kept in an LRU cache shared by
+    all files, so memory stays within CSV_CACHE_BYTES however many CSV
+    datasets are open.  New rows are appended straight to the file, and
+    the index picks up the new lines the next time it is used.  Blank lines
+    are skipped, and a last line without a line break (which older files
+    can end with) is a row too.
     """
 
-    def __init__(self, filename, reactor=reactor):
+    def __init__(self, filename, reactor=reactor, cache=None, read_only=False,
+                 pinned=False):
         self.filename = filename
-        self._file = SelfClosingFile(open_args=(filename, 'a+'), reactor=reactor)
+        self.read_only = read_only
+        # binary mode, so that offsets are exact bytes on every platform
+        if read_only:
+            self._file = ReadOnlyFile(open_args=(filename, 'rb'))
+        else:
+            self._file = SelfClosingFile(open_args=(filename, 'ab+'),
+                                         reactor=reactor, pinned=pinned)
         self.infofile = filename[:-4] + '.ini'
         self.reactor = reactor
+        self.cache = _csv_blocks if cache is None else cache
+        self._offsets = [] # byte offset of row i * CSV_BLOCK_ROWS
+        self._rows = 0 # complete rows covered by the index
+        self._end = 0 # byte offset just past the last indexed row
 
     @property
     def file(self):
         return self._file()
 
-    def _get_data(self):
-        """Read data from file on demand.
-
-        The data is scheduled to be cleared from memory unless accessed."""
-        if not hasattr(self, '_data'):
-            try:
-                # if the file is empty, this line can barf in certain versions
-                # of numpy.  Clearly, if the file does not exist on disk, this
-                # will be the case.  Even if the file exists on disk, we must
-                # check its size
-                if self._file.size() > 0:
-                    self.file.seek(0)
-                    self._data = np.loadtxt(self.file, delimiter=',')
-                else:
-                    self._data = np.array([[]])
-                if len(self._data.shape) == 1:
-                    self._data.shape = (1, len(self._data))
-            except ValueError:
-                # no data saved yet
-                # this error is raised by numpy <=1.2
-                self._data = np.array([[]])
-            except IOError:
-                # no data saved yet
-                # this error is raised by numpy 1.3
-                self.file.seek(0)
-                self._data = np.array([[]])
-            self._timeout_call = self.reactor.callLater(DATA_TIMEOUT, self._on_timeout)
-        else:
-            self._timeout_call.reset(DATA_TIMEOUT)
-        return self._data
-
-    def _set_data(self, data):
-        self._data = data
+    @property
+    def version(self):
+        return np.asarray([1,0,0], np.int32)
 
-    data = property(_get_data, _set_data)
+    def __len__(self):
+        self._updateIndex()
+        return self._rows
 
-    def _on_timeout(self):
-        del self._data
-        del self._timeout_call
+    def _updateIndex(self):
+        """Index any lines added to the file since the last call."""
+        size = self._file.size()
+        f = self.file
+        read_bytes = CSV_READ_BYTES
+        while self._end < size:
+            f.seek(self._end)
+            buf = f.read(read_bytes)
+            chars = np.frombuffer(buf, dtype=np.uint8)
+            newlines = np.flatnonzero(chars == ord('\n'))
+            if not len(newlines):
+                if len(buf) < read_bytes:
+                    self._indexLastLine(buf)
+                    break
+                read_bytes *= 2 # a very long line; try again with more
+                continue
+            starts = np.empty(len(newlines), dtype=np.int64)
+            starts[0] = 0
+            starts[1:] = newlines[:-1] + 1
+            # np.loadtxt skips blank lines, so they are not rows
+            lengths = newlines - starts
+            blank = (lengths == 0) | ((lengths == 1) & (chars[starts] == ord('\r')))
+            starts = starts[~blank]
+            rows = np.arange(self._rows, self._rows + len(starts))
+            self._offsets.extend(int(self._end + x) for x in starts[rows % CSV_BLOCK_ROWS == 0])
+            self._rows += len(starts)
+            self._end += int(newlines[-1]) + 1
+
+    def _indexLastLine(self, line):
+        """Index the last line of the file, which has no line break."""
+        if not line.strip():
+            return
+        if self._rows % CSV_BLOCK_ROWS == 0:
+            self._offsets.append(self._end)
+        self._rows += 1
+        self._end += len(line)
+
+    def _parse(self, text, rows):
+        """Parse rows of CSV lines into a 2-D array of floats."""
+        text = text.strip()
+        cols = text[:text.find('\n')].count(',') + 1
+        flat = text.replace('\r', '').replace('\n', ',')
+        values = np.fromstring(flat, dtype=float, sep=',') if flat else np.zeros(0)
+        if len(values) != cols * rows:
+            # something fromstring can't handle (such as blank lines); let
+            # numpy do it properly
+            return np.loadtxt(text.splitlines(), delimiter=',', ndmin=2)
+        return values.reshape((-1, cols))
+
+    def _block(self, index):
+        """Get the parsed rows of one block, from the cache if possible."""
+        key = (self.filename, index)
+        with _csv_blocks_lock:
+            block = self.cache.get(key)
+        if block is None:
+            start = self._offsets[index]
+            if index + 1 < len(self._offsets):
+                stop = self._offsets[index + 1]
+            else:
+                stop = self._end
+            rows = min(CSV_BLOCK_ROWS, self._rows - index * CSV_BLOCK_ROWS)
+            f = self.file
+            f.seek(start)
+            block = self._parse(f.read(stop - start), rows)
+            if len(block) == CSV_BLOCK_ROWS:
+                # complete blocks never change, so they can be shared
+                with _csv_blocks_lock:
+                    self.cache[key] = block
+        return block
 
     def _saveData(self, data):
         f = self.file
+        size = self._file.size()
+        if size:
+            f.seek(size - 1)
+            if f.read(1) != '\n':
+                # end the last row first; the index skips the blank line
+                # this leaves if the row was already indexed
+                f.seek(0, os.SEEK_END)
+                f.write('\r\n')
+        f.seek(0, os.SEEK_END) # C stdio needs a seek between reads and writes
         # always save with dos linebreaks (requires numpy 1.5.0 or greater)
         np.savetxt(f, data, fmt=DATA_FORMAT, delimiter=',', newline='\r\n')
         f.flush()
@@ -435,38 +819,57 @@ class CsvNumpyData(CsvListData):
         # check row length
         if len(data[0]) != self.cols:
             raise errors.BadDataError(self.cols, len(data[0]))
-
-        # Ordinarily, we are using record arrays, but for numpy savetxt we want a 2-D array
-        record_data = util.from_record_array(data)
-        # append data to in-memory data
-        if self.data.size > 0:
-            self.data = np.vstack((self.data, record_data))
-        else:
-            self.data = record_data
-
-        # append data to file
         self._saveData(data)
 
     def getData(self, limit, start, transpose, simpleOnly):
         if transpose:
             raise RuntimeError("Transpose specified for simple data format: not supported")
-
-        if limit is None:
-            data = self.data[start:]
-        else:
-            data = self.data[start:start+limit]
-        # nrows should be zero for an empty row
-        nrows = len(data) if data.size > 0 else 0
-        return data, start + nrows
+        rows = len(self)
+        stop = rows if limit is None else min(start + limit, rows)
+        if start >= stop:
+            return np.zeros((0, len(self.dtype))), start
+        first = start // CSV_BLOCK_ROWS
+        last = (stop - 1) // CSV_BLOCK_ROWS
+        blocks = [self._block(i) for i in xrange(first, last + 1)]
+        data = blocks[0] if len(blocks) == 1 else np.vstack(blocks)
+        offset = first * CSV_BLOCK_ROWS
+        return data[start - offset:stop - offset], stop
 
     def hasMore(self, pos):
-        # cheesy hack: if pos == 0, we only need to check whether
-        # the filesize is nonzero
-        if pos == 0:
-            return os.path.getsize(self.filename) > 0
-        else:
-            nrows = len(self.data) if self.data.size > 0 else 0
-            return pos < nrows
+        return pos < len(self)
+
+# CSV files used to be read whole by CsvNumpyData; the name is kept for
+# code that still uses it.
+CsvNumpyData = CsvIndexedData
+
+def _column_dtype(col):
+    """Get the numpy dtype used to store a column in an HDF5 file.
+
+    Array columns get a subarray dtype of the column's shape.
+    """
+    shape = col.shape
+    ttag = col.datatype
+    unit = col.unit
+    if len(shape) == 1 and shape[0] == 1:
+        shapestr = ''
+    else:
+        shapestr = str(tuple(shape))
+    if unit != '' and ttag not in ['v', 'c']:
+        raise RuntimeError('Unit {} specfied for datatype {}.  Only v and c may have units'.format(unit, ttag))
+    if ttag == 'i':
+        return np.dtype(shapestr + 'i4')
+    elif ttag == 's':
+        if shapestr:
+            raise ValueError("Cannot create string array column")
+        return h5py.special_dtype(vlen=str)
+    elif ttag == 't':
+        return np.dtype(shapestr + 'i8')
+    elif ttag == 'v':
+        return np.dtype(shapestr + 'f8')
+    elif ttag == 'c':
+        return np.dtype(shapestr + 'c16')
+    else:
+        raise RuntimeError("Invalid type tag {}".format(ttag))
 
 class HDF5MetaData(object):
     """Class to store metadata inside the file itself.
@@ -504,7 +907,7 @@ class HDF5MetaData(object):
         attrs['Access Time'] = t
         attrs['Modification Time'] = t
         attrs['Creation Time'] = t
-        attrs['Comments'] = np.ndarray((0,), dtype=self.comment_type)
+        self._comments(create=True)
 
         for idx, i in enumerate(indep):
             prefix = 'Independent{}.'.format(idx)
@@ -597,55 +1000,241 @@ class HDF5MetaData(object):
         type_tag = '({})'.format(','.join(column_type))
         return type_tag
 
+    share_params = False # keep large values in the directory's ParamBlobStore
+
+    _paramKeys = None # parameter name -> attribute key
+    _paramLower = None # lower-cased parameter name -> parameter name
+    _paramValues = None # parameter name -> decoded value
+
+    def _paramIndex(self):
+        """Map parameter names to attribute keys, scanning the attributes once.
+
+        Parameter names in the HDF5 file are prefixed with 'Param.' to avoid
+        conflicts with the other metadata.
+        """
+        if self._paramKeys is None:
+            keys = {}
+            lower = {}
+            for k in self.dataset.attrs:
+                if k.startswith('Param.'):
+                    name = str(k[6:])
+                    keys[name] = k
+                    lower.setdefault(name.lower(), name)
+            self._paramKeys = keys
+            self._paramLower = lower
+        return self._paramKeys
+
     def addParam(self, name, data):
-        keyname = 'Param.{}'.format(name)
-        if keyname in self.dataset.attrs:
+        if name in self._paramIndex():
             raise errors.ParameterInUseError(name)
+        keyname = 'Param.{}'.format(name)
         value = labrad_urlencode(data)
+        if self.share_params:
+            value = self._paramBlobs().share(value)
         self.dataset.attrs[keyname] = value
+        if self._paramKeys is not None:
+            self._paramKeys[name] = keyname
+            self._paramLower.setdefault(name.lower(), name)
 
     def getParameter(self, name, case_sensitive=True):
-        """Get a parameter from the dataset."""
-        keyname = 'Param.{}'.format(name)
-        if case_sensitive:
-            if keyname in self.dataset.attrs:
-                return labrad_urldecode(self.dataset.attrs[keyname])
-        else:
-            for k in self.dataset.attrs:
-                if k.lower() == keyname.lower():
-                    return labrad_urldecode(self.dataset.attrs[k])
-        raise errors.BadParameterError(name)
+        """Get a parameter from the dataset.
+
+        Values are decoded on first use and then kept, since parameters
+        never change once they have been added.
+        """
+        keys = self._paramIndex()
+        found = name
+        if not case_sensitive and found not in keys:
+            found = self._paramLower.get(name.lower(), name)
+        if found not in keys:
+            raise errors.BadParameterError(name)
+        if self._paramValues is None:
+            self._paramValues = {}
+        if found not in self._paramValues:
+            raw = self.dataset.attrs[keys[found]]
+            if raw.startswith(PARAM_BLOB_PREFIX):
+                value = self._paramBlobs().load(raw)
+            else:
+                value = labrad_urldecode(raw)
+            self._paramValues[found] = value
+        return self._paramValues[found]
 
     def getParamNames(self):
         """Get the names of all dataset parameters.
 
-        Parameter names in the HDF5 file are prefixed with 'Param.' to avoid
-        conflicts with the other metadata.
+        HDF5 lists attributes in name order, so the names are sorted to
+        match the order of the file.
         """
-        names = [str(k[6:]) for k in self.dataset.attrs if k.startswith('Param.')]
-        return names
+        return sorted(self._paramIndex())
 
-    def addComment(self, user, comment):
-        """Add a comment to the dataset."""
-        t = time.time()
+    def _paramBlobs(self):
+        return param_blobs(os.path.dirname(self.dataset.file.filename))
+
+    def _comments(self, create=False):
+        """Get the resizable 'Comments' dataset next to the data.
+
+        Older files keep their comments in a 'Comments' attribute, which has
+        to be rewritten in full for every new comment and cannot grow past
+        64 KB.  For those files this returns None, unless create is set, in
+        which case the comments are moved into a new dataset.
+        """
+        group = self.dataset.parent
+        if 'Comments' in group:
+            return group['Comments']
+        if not create:
+            return None
+        attrs = self.dataset.attrs
+        old_comments = attrs['Comments'] if 'Comments' in attrs else []
+        comments = group.create_dataset('Comments', (len(old_comments),),
+                                        dtype=self.comment_type,
+                                        maxshape=(None,),
+                                        chunks=(COMMENT_CHUNK_ROWS,))
+        if len(old_comments):
+            comments[:] = old_comments
+        if 'Comments' in attrs:
+            del attrs['Comments']
+        return comments
+
+    def addComment(self, user, comment, timestamp=None):
+        """Add a comment to the dataset, by default timestamped now."""
+        t = time.time() if timestamp is None else timestamp
         new_comment = np.array([(t, user, comment)], dtype=self.comment_type)
-        old_comments = self.dataset.attrs['Comments']
-        data = np.hstack((old_comments, new_comment))
-        self.dataset.attrs.create('Comments', data, dtype=self.comment_type)
+        comments = self._comments(create=True)
+        n = comments.shape[0]
+        comments.resize((n + 1,))
+        comments[n:n+1] = new_comment
 
     def getComments(self, limit, start):
         """Get comments in [(datetime, username, comment), ...] format."""
-        if limit is None:
-            raw_comments = self.dataset.attrs['Comments'][start:]
+        stop = None if limit is None else start + limit
+        comments = self._comments()
+        if comments is None:
+            raw_comments = self.dataset.attrs['Comments'][start:stop]
         else:
-            raw_comments = self.dataset.attrs['Comments'][start:start+limit]
+            raw_comments = comments[start:stop] if start < comments.shape[0] else []
         comments = [(datetime.datetime.fromtimestamp(c[0]), str(c[1]), str(c[2])) for c in raw_comments]
         return comments, start+len(comments)
 
     def numComments(self):
-        return len(self.dataset.attrs['Comments'])
+        comments = self._comments()
+        if comments is None:
+            return len(self.dataset.attrs['Comments'])
+        return comments.shape[0]
+
+class HDF5RowStorage(object):
+    """Amortized appends to the resizable 1-D 'DataVault' HDF5 dataset.
+
+    Resizing the dataset by a few rows on every append makes HDF5 rewrite
+    chunks over and over, so instead the dataset grows geometrically in whole
+    chunks and the logical number of rows is kept in the 'Row Count'
+    attribute.  The unused capacity is trimmed off when the file is closed.
+    Files without the attribute were never padded, so for them the logical
+    length is simply the dataset shape.
+
+    Subclasses must provide the dataset property and register _trim to be
+    called when the file closes.
+    """
 
-class ExtendedHDF5Data(HDF5MetaData):
+    _rows = None
+
+    def __len__(self):
+        if self._rows is None:
+            attrs = self.dataset.attrs
+            if 'Row Count' in attrs:
+                self._rows = int(attrs['Row Count'])
+            else:
+                self._rows = self.dataset.shape[0]
+        return self._rows
+
+    def hasMore(self, pos):
+        return pos < len(self)
+
+    def _appendRows(self, data):
+        """Write rows after the current logical end, growing if needed."""
+        dataset = self.dataset
+        old_rows = len(self)
+        new_rows = old_rows + len(data)
+        if new_rows > dataset.shape[0]:
+            dataset.resize((self._capacityFor(dataset, new_rows),))
+        dataset[old_rows:new_rows] = data
+        if 'Row Count' in dataset.attrs:
+            dataset.attrs.modify('Row Count', new_rows)
+        else:
+            dataset.attrs['Row Count'] = new_rows
+        self._rows = new_rows
+
+    @staticmethod
+    def _capacityFor(dataset, rows):
+        """Choose a new, chunk-aligned size that holds at least rows."""
+        capacity = dataset.shape[0]
+        target = max(rows, capacity + min(capacity, MAX_GROWTH_ROWS))
+        chunk = dataset.chunks[0] if dataset.chunks else 1
+        return -(-target // chunk) * chunk
+
+    def readRows(self, limit, start):
+        """Read up to limit rows (all if None) as a struct array."""
+        stop = len(self) if limit is None else min(start + limit, len(self))
+        return self.dataset[min(start, stop):stop]
+
+    def readRange(self, start, stop, step, names):
+        """Read every step'th row in [start, stop), only the named columns.
+
+        This maps to a single strided hyperslab and field selection, and
+        returns a struct array with just those fields.
+        """
+        dataset = self.dataset
+        dtype = np.dtype([(name, dataset.dtype[name]) for name in names])
+        stop = min(stop, len(self))
+        if start >= stop:
+            return np.zeros((0,), dtype=dtype)
+        data = dataset[(slice(start, stop, step),) + tuple(names)]
+        if len(names) == 1:
+            # h5py returns a plain array when only one field is selected
+            rows = np.zeros(data.shape, dtype=dtype)
+            rows[names[0]] = data
+            return rows
+        return data
+
+    def getData(self, limit, start, transpose, simpleOnly):
+        """Get up to limit rows from a dataset."""
+        struct_data = self.readRows(limit, start)
+        data = self.formatRows(struct_data, transpose, simpleOnly)
+        return data, start + struct_data.shape[0]
+
+    def _transposeRows(self, struct_data):
+        columns = []
+        for name in struct_data.dtype.names:
+            col = struct_data[name]
+            # Strings are stored as hdf5 vlen objects.  Numpy can't do
+            # variable length strings, so they get encoded as object
+            # arrays by hdf5.  we don't know how to flatten object
+            # arrays so we special case vlen types here and convert
+            # them to lists.  Also, h5py has a bug where when you
+            # index a dataset with a compound type, it loses the
+            # special dtype information, so we pull it directly from
+            # self.dtype rather than the data returned by readRows
+            if self.dtype[name] == np.object:
+                base_type = h5py.check_dtype(vlen=self.dtype[name])
+                if not base_type or not issubclass(base_type, str):
+                    raise RuntimeError("Found object type array, but not vlen str.  Not supported.  This shouldn't happen")
+                col = [base_type(x) for x in col]
+            columns.append(col)
+        return tuple(columns)
+
+    def _trim(self, fh):
+        """Drop preallocated rows just before the file gets closed.
+
+        Another backend object may have added rows to the same file, so the
+        row count is read from the file rather than taken from len(self).
+        """
+        dataset = fh._file['DataVault']
+        if 'Row Count' not in dataset.attrs:
+            return # never padded
+        rows = int(dataset.attrs['Row Count'])
+        if dataset.shape[0] > rows:
+            dataset.resize((rows,))
+
+class ExtendedHDF5Data(HDF5RowStorage, HDF5MetaData):
     """Dataset backed by HDF5 file
 
     This supports the extended dataset format which allows each column
@@ -654,40 +1243,16 @@ class ExtendedHDF5Data(HDF5MetaData):
 
     def __init__(self, fh):
         self._file = fh
+        fh.onClose(self._trim)
         if 'Version' not in self.file.attrs:
             self.file.attrs['Version'] = np.asarray([3, 0, 0], dtype=np.int32)
         self.version = np.asarray(self.file.attrs['Version'], np.int32)
 
-    def initialize_info(self, title, indep, dep):
+    def initialize_info(self, title, indep, dep, storage=DEFAULT_STORAGE):
         """Initialize the columns when creating a new dataset"""
-        dtype = []
-        for idx, col in enumerate(indep + dep):
-            shape = col.shape
-            ttag = col.datatype
-            unit = col.unit
-            if len(shape) == 1 and shape[0] == 1:
-                shapestr = ''
-            else:
-                shapestr = str(tuple(shape))
-            varname = 'f{}'.format(idx)
-            if unit != '' and ttag not in ['v', 'c']:
-                raise RuntimeError('Unit {} specfied for datatype {}.  Only v and c may have units'.format(unit, ttag))
-            if ttag == 'i':
-                dtype.append((varname, shapestr + 'i4'))
-            elif ttag == 's':
-                if shapestr:
-                    raise ValueError("Cannot create string array column")
-                dtype.append((varname, h5py.special_dtype(vlen=str)))
-            elif ttag == 't':
-                dtype.append((varname, shapestr + 'i8'))
-            elif ttag == 'v':
-                dtype.append((varname, shapestr + 'f8'))
-            elif ttag == 'c':
-                dtype.append((varname, shapestr + 'c16'))
-            else:
-                raise RuntimeError("Invalid type tag {}".format(ttag))
-
-        self.file.create_dataset('DataVault', (0,), dtype=dtype, maxshape=(None,))
+        dtype = [('f{}'.format(idx), _column_dtype(col))
+                 for idx, col in enumerate(indep + dep)]
+        self.file.create_dataset('DataVault', (0,), dtype=dtype, **_create_kw(storage))
         HDF5MetaData.initialize_info(self, title, indep, dep)
 
     @property
@@ -700,62 +1265,20 @@ class ExtendedHDF5Data(HDF5MetaData):
 
     def addData(self, data):
         """Adds one or more rows or data from a numpy struct array."""
-        new_rows = len(data)
-        old_rows = self.dataset.shape[0]
-        self.dataset.resize((old_rows + new_rows,))
-        self.dataset[old_rows:(old_rows + new_rows)] = data
+        self._appendRows(data)
 
-    def getData(self, limit, start, transpose, simpleOnly):
-        """Get up to limit rows from a dataset."""
+    def formatRows(self, struct_data, transpose, simpleOnly):
+        """Convert rows read from the dataset to the format sent to clients."""
         if simpleOnly:
             datatype = self.dataset.dtype
             for idx in range(len(datatype)):
                 if datatype[idx] != np.float64:
                     raise errors.DataVersionMismatchError()
         if transpose:
-            return self.getDataTranspose(limit, start)
+            return self._transposeRows(struct_data)
+        return [tuple(row) for row in struct_data]
 
-        data, new_pos = self._getData(limit, start)
-        row_data = [tuple(row) for row in data]
-        return row_data, new_pos
-
-    def getDataTranspose(self, limit, start):
-        struct_data, new_pos = self._getData(limit, start)
-        columns = []
-        for idx in range(len(struct_data.dtype)):
-            col = struct_data['f{}'.format(idx)]
-            # Strings are stored as hdf5 vlen objects.  Numpy can't do
-            # variable length strings, so they get encoded as object
-            # arrays by hdf5.  we don't know how to flatten object
-            # arrays so we special case vlen types here and convert
-            # them to lists.  Also, h5py has a bug where when you
-            # index a dataset with a compound type, it loses the
-            # special dtype information, so we pull it directly from
-            # self.dataset.dtype rather than the data returned by
-            # _getData
-            if self.dataset.dtype[idx] == np.object:
-                base_type = h5py.check_dtype(vlen=self.dataset.dtype[idx])
-                if not base_type or not issubclass(base_type, str):
-                    raise RuntimeError("Found object type array, but not vlen str.  Not supported.  This shouldn't happen")
-                col = [base_type(x) for x in col]
-            columns.append(col)
-        columns = tuple(columns)
-        return columns, new_pos
-
-    def _getData(self, limit, start):
-        if limit is None:
-            struct_data = self.dataset[start:]
-        else:
-            struct_data = self.dataset[start:start+limit]
-        return struct_data, start + struct_data.shape[0]
-
-    def __len__(self):
-        return self.dataset.shape[0]
-
-    def hasMore(self, pos):
-        return pos < len(self)
-
-class SimpleHDF5Data(HDF5MetaData):
+class SimpleHDF5Data(HDF5RowStorage, HDF5MetaData):
     """Basic dataset backed by HDF5 file.
 
     This is a very simple implementation that only supports a single 2-D dataset
@@ -765,15 +1288,16 @@ class SimpleHDF5Data(HDF5MetaData):
     """
     def __init__(self, fh):
         self._file = fh
+        fh.onClose(self._trim)
         if 'Version' not in self.file.attrs:
             self.file.attrs['Version'] = np.asarray([2, 0, 0], dtype=np.int32)
         self.version = np.asarray(self.file.attrs['Version'], dtype=np.int32)
 
-    def initialize_info(self, title, indep, dep):
+    def initialize_info(self, title, indep, dep, storage=DEFAULT_STORAGE):
         ncol = len(indep) + len(dep)
         dtype = [('f{}'.format(idx), np.float64) for idx in range(ncol)]
         if 'DataVault' not in self.file:
-            self.file.create_dataset('DataVault', (0,), dtype=dtype, maxshape=(None,))
+            self.file.create_dataset('DataVault', (0,), dtype=dtype, **_create_kw(storage))
         HDF5MetaData.initialize_info(self, title, indep, dep)
 
     @property
@@ -786,78 +1310,401 @@ class SimpleHDF5Data(HDF5MetaData):
 
     def addData(self, data):
         """Adds one or more rows or data from a 2D array of floats."""
-        new_rows = data.shape[0]
-        old_rows = self.dataset.shape[0]
-        #if data.shape[1] != len(self.dataset.dtype):
-        #    raise errors.BadDataError(len(self.dataset.dtype), data.shape[1])
-
-        self.dataset.resize((old_rows + new_rows,))
-        #new_data = np.zeros((new_rows,), dtype=self.dataset.dtype)
-        #for col in range(data.shape[1]):
-        #    field = "f%d" % (col,)
-        #    new_data[field] = data[:,col]
-        self.dataset[old_rows:(old_rows + new_rows)] = data
+        self._appendRows(data)
 
-    def getData(self, limit, start, transpose, simpleOnly):
-        """Get up to limit rows from a dataset."""
+    def formatRows(self, struct_data, transpose, simpleOnly):
+        """Convert rows read from the dataset to a 2D array of floats."""
         if transpose:
             raise RuntimeError("Transpose specified for simple data format: not supported")
-        if limit is None:
-            struct_data = self.dataset[start:]
-        else:
-            struct_data = self.dataset[start:start+limit]
         columns = []
         for idx in range(len(struct_data.dtype)):
             columns.append(struct_data['f{}'.format(idx)])
-        data = np.column_stack(columns)
-        return data, start + data.shape[0]
+        return np.column_stack(columns)
+
+class ColumnarHDF5Data(HDF5RowStorage, HDF5MetaData):
+    """Dataset backed by an HDF5 file with one HDF5 dataset per column.
+
+    This is the version 4 layout, for wide datasets of which clients only
+    read a few columns at a time.  'DataVault' is a group holding the
+    metadata attributes and a resizable dataset 'f<n>' for each column,
+    chunked along rows, so reading some columns only touches their chunks
+    and transposed reads return the stored arrays without reshuffling.
+    Columns take the same types as in the extended format; datasets made
+    with 'new' simply have a float column for each variable.  All columns
+    grow together and 'Row Count' on the group gives the valid rows.
+    """
+    def __init__(self, fh):
+        self._file = fh
+        fh.onClose(self._trim)
+        if 'Version' not in self.file.attrs:
+            self.file.attrs['Version'] = np.asarray([4, 0, 0], dtype=np.int32)
+        self.version = np.asarray(self.file.attrs['Version'], np.int32)
 
-    def __len__(self):
-        return self.dataset.shape[0]
+    def initialize_info(self, title, indep, dep, storage=DEFAULT_STORAGE):
+        """Create a dataset for each column of a new dataset."""
+        group = self.file.create_group('DataVault')
+        for idx, col in enumerate(indep + dep):
+            dtype = _column_dtype(col)
+            base, shape = dtype.subdtype or (dtype, ())
+            chunk_rows = max(1, COLUMN_CHUNK_BYTES // dtype.itemsize)
+            group.create_dataset('f{}'.format(idx), (0,) + shape, dtype=base,
+                                 **_create_kw(storage, shape, chunk_rows))
+        group.attrs['Row Count'] = 0
+        HDF5MetaData.initialize_info(self, title, indep, dep)
 
-    def hasMore(self, pos):
-        return pos < len(self)
+    @property
+    def file(self):
+        return self._file()
+
+    @property
+    def dataset(self):
+        """The 'DataVault' group, which holds the metadata."""
+        return self.file["DataVault"]
+
+    _dtype = None
+
+    @property
+    def dtype(self):
+        """The struct dtype of a row, with a field for each column."""
+        if self._dtype is None:
+            group = self.dataset
+            fields = []
+            for idx in xrange(sys.maxint):
+                name = 'f{}'.format(idx)
+                if name not in group:
+                    break
+                col = group[name]
+                shape = col.shape[1:]
+                fields.append((name, (col.dtype, shape) if shape else col.dtype))
+            self._dtype = np.dtype(fields)
+        return self._dtype
+
+    def _columns(self, names=None):
+        group = self.dataset
+        return [group[name] for name in (names or self.dtype.names)]
+
+    def addData(self, data):
+        """Adds one or more rows from a numpy struct array."""
+        self._appendRows(data)
+
+    def _appendRows(self, data):
+        old_rows = len(self)
+        new_rows = old_rows + len(data)
+        for name, col in zip(self.dtype.names, self._columns()):
+            if new_rows > col.shape[0]:
+                col.resize((self._capacityFor(col, new_rows),) + col.shape[1:])
+            col[old_rows:new_rows] = data[name]
+        self.dataset.attrs.modify('Row Count', new_rows)
+        self._rows = new_rows
+
+    def readRows(self, limit, start):
+        """Read up to limit rows (all if None) as a struct array."""
+        stop = len(self) if limit is None else min(start + limit, len(self))
+        start = min(start, stop)
+        rows = np.zeros((stop - start,), dtype=self.dtype)
+        if stop > start:
+            for name, col in zip(self.dtype.names, self._columns()):
+                rows[name] = col[start:stop]
+        return rows
+
+    def readRange(self, start, stop, step, names):
+        """Read every step'th row in [start, stop), only the named columns.
+
+        Only the datasets of those columns are read.
+        """
+        dtype = np.dtype([(name, self.dtype[name]) for name in names])
+        stop = min(stop, len(self))
+        if start >= stop:
+            return np.zeros((0,), dtype=dtype)
+        rows = np.zeros((len(xrange(start, stop, step)),), dtype=dtype)
+        for name, col in zip(names, self._columns(names)):
+            rows[name] = col[start:stop:step]
+        return rows
+
+    def getData(self, limit, start, transpose, simpleOnly):
+        """Get up to limit rows from a dataset.
+
+        Transposed reads return each column as read from its dataset.
+        """
+        if simpleOnly:
+            self._checkSimple()
+        stop = len(self) if limit is None else min(start + limit, len(self))
+        start = min(start, stop)
+        if transpose:
+            columns = []
+            for name, col in zip(self.dtype.names, self._columns()):
+                values = col[start:stop]
+                if self.dtype[name] == np.object:
+                    values = [str(x) for x in values]
+                columns.append(values)
+            return tuple(columns), stop
+        return self.formatRows(self.readRows(stop - start, start), False,
+                               simpleOnly), stop
+
+    def _checkSimple(self):
+        for idx in range(len(self.dtype)):
+            if self.dtype[idx] != np.float64:
+                raise errors.DataVersionMismatchError()
+
+    def formatRows(self, struct_data, transpose, simpleOnly):
+        """Convert rows read from the dataset to the format sent to clients."""
+        if simpleOnly:
+            self._checkSimple()
+        if transpose:
+            return self._transposeRows(struct_data)
+        if simpleOnly:
+            if not len(self.dtype):
+                return np.zeros((len(struct_data), 0))
+            return np.column_stack([struct_data[name] for name in self.dtype.names])
+        return [tuple(row) for row in struct_data]
+
+    def _trim(self, fh):
+        """Drop preallocated rows just before the file gets closed.
 
-def open_hdf5_file(filename):
+        As for HDF5RowStorage, the row count is read from the file.
+        """
+        group = fh._file['DataVault']
+        rows = int(group.attrs['Row Count'])
+        for name in self.dtype.names:
+            col = group[name]
+            if col.shape[0] > rows:
+                col.resize((rows,) + col.shape[1:])
+
+def _grid_chunks(shape, itemsize):
+    """Choose chunks of a grid of at most GRID_CHUNK_BYTES.
+
+    The longest axis is halved until a chunk fits, so chunks stay roughly
+    square and a plane along any axis touches few of them.
+    """
+    chunks = list(shape)
+    while np.prod(chunks) * itemsize > GRID_CHUNK_BYTES and max(chunks) > 1:
+        i = chunks.index(max(chunks))
+        chunks[i] = -(-chunks[i] // 2)
+    return tuple(chunks)
+
+class GriddedHDF5Data(HDF5MetaData):
+    """Dataset backed by an HDF5 file holding N-dimensional grids.
+
+    This is the version 5 layout, for sweeps over a fixed grid of points.
+    Each independent variable is an axis of the grid with its coordinates
+    in a dataset 'Axis<n>', and each dependent variable is an N-D dataset
+    'f<n>' of the grid shape (times the dependent's own shape, if it is an
+    array), chunked in blocks so that any plane can be read without reading
+    the rest.  Points are written by index or in rectangular slabs, in any
+    order, and the 'Filled' dataset marks which points have been written.
+
+    Gridded datasets have no rows, so the row-based settings do not apply.
+    """
+    def __init__(self, fh):
+        self._file = fh
+        if 'Version' not in self.file.attrs:
+            self.file.attrs['Version'] = np.asarray([5, 0, 0], dtype=np.int32)
+        self.version = np.asarray(self.file.attrs['Version'], np.int32)
+
+    def initialize_info(self, title, indep, dep, storage=DEFAULT_STORAGE, grid=()):
+        """Create the grids of a new dataset of the given shape."""
+        grid = tuple(int(n) for n in grid)
+        if len(grid) != len(indep) or not all(grid):
+            raise errors.BadGridError('give a nonzero length for each independent')
+        for col in indep:
+            if tuple(col.shape) != (1,) or col.datatype != 'v':
+                raise errors.BadGridError("independents must be scalar 'v' columns")
+        group = self.file.create_group('DataVault')
+        group.attrs['Grid Shape'] = np.asarray(grid, dtype=np.int64)
+        for idx, n in enumerate(grid):
+            group.create_dataset('Axis{}'.format(idx), data=np.arange(n, dtype=float))
+        kw = {}
+        if storage.compression:
+            kw['compression'] = storage.compression
+            kw['compression_opts'] = storage.compression_opts
+        if storage.shuffle:
+            kw['shuffle'] = True
+        for idx, col in enumerate(dep):
+            if col.datatype == 's':
+                raise errors.BadGridError('string dependents are not supported')
+            dtype = _column_dtype(col)
+            base, shape = dtype.subdtype or (dtype, ())
+            chunks = _grid_chunks(grid, dtype.itemsize) + shape
+            fill = np.array(complex(np.nan, np.nan) if base.kind == 'c' else
+                            np.nan if base.kind == 'f' else 0, dtype=base)
+            group.create_dataset('f{}'.format(idx), grid + shape, dtype=base,
+                                 chunks=chunks, fillvalue=fill, **kw)
+        group.create_dataset('Filled', grid, dtype=np.bool_,
+                             chunks=_grid_chunks(grid, 1), **kw)
+        HDF5MetaData.initialize_info(self, title, indep, dep)
+
+    @property
+    def file(self):
+        return self._file()
+
+    @property
+    def dataset(self):
+        """The 'DataVault' group, which holds the metadata."""
+        return self.file["DataVault"]
+
+    @property
+    def dtype(self):
+        raise errors.UnsupportedDatasetError('row data')
+
+    def getData(self, limit, start, transpose, simpleOnly):
+        raise errors.UnsupportedDatasetError('row data')
+
+    def hasMore(self, pos):
+        return False
+
+    def gridShape(self):
+        return tuple(int(n) for n in self.dataset.attrs['Grid Shape'])
+
+    def _deps(self):
+        group = self.dataset
+        return [group['f{}'.format(idx)] for idx in range(len(self.getDependents()))]
+
+    def _axisName(self, axis):
+        if axis >= len(self.gridShape()):
+            raise errors.BadGridError('there is no axis {}'.format(axis))
+        return 'Axis{}'.format(axis)
+
+    def getAxis(self, axis):
+        """Get the coordinates of the points along an axis."""
+        return self.dataset[self._axisName(axis)][:]
+
+    def setAxis(self, axis, values):
+        """Set the coordinates of the points along an axis."""
+        name = self._axisName(axis)
+        values = np.asarray(values, dtype=float)
+        if values.shape != (self.gridShape()[axis],):
+            raise errors.BadGridError('axis {} has {} points'.format(
+                    axis, self.gridShape()[axis]))
+        self.dataset[name][:] = values
+
+    def _slab(self, start, shape):
+        """Get the index for a slab, checking it fits in the grid."""
+        grid = self.gridShape()
+        if len(start) != len(grid) or len(shape) != len(grid):
+            raise errors.BadGridError('give an index for each of {} axes'.format(len(grid)))
+        for a, n, size in zip(start, shape, grid):
+            if a + n > size:
+                raise errors.BadGridError('slab does not fit in grid {}'.format(grid))
+        return tuple(slice(a, a + n) for a, n in zip(start, shape))
+
+    def writeSlab(self, start, data):
+        """Write the points of a slab with its first corner at start.
+
+        data has an array for each dependent, whose leading dimensions are
+        the shape of the slab.
+        """
+        deps = self._deps()
+        if len(data) != len(deps):
+            raise errors.BadGridError('give an array for each of {} dependents'.format(len(deps)))
+        ndim = len(self.gridShape())
+        arrays = [np.asarray(d) for d in data]
+        shape = arrays[0].shape[:ndim]
+        index = self._slab(start, shape)
+        for array, dep in zip(arrays, deps):
+            if array.shape != shape + dep.shape[ndim:]:
+                raise errors.BadGridError('dependents must all cover the slab')
+        for array, dep in zip(arrays, deps):
+            dep[index] = array
+        self.dataset['Filled'][index] = True
+        self.dataset.attrs['Modification Time'] = time.time()
+
+    def readSlab(self, start, stop):
+        """Read the points in [start, stop) along each axis.
+
+        Returns an array for each dependent, and a boolean array marking the
+        points that have been written.  stop is clipped to the grid.
+        """
+        grid = self.gridShape()
+        stop = [min(b, n) for b, n in zip(stop, grid)]
+        start = [min(a, b) for a, b in zip(start, stop)]
+        index = self._slab(start, [b - a for a, b in zip(start, stop)])
+        return [dep[index] for dep in self._deps()], self.dataset['Filled'][index]
+
+    def readSlice(self, axis, index):
+        """Read the plane of points at index along axis."""
+        grid = self.gridShape()
+        self._axisName(axis)
+        if index >= grid[axis]:
+            raise errors.BadGridError('axis {} has {} points'.format(axis, grid[axis]))
+        start = [0] * len(grid)
+        stop = list(grid)
+        start[axis], stop[axis] = index, index + 1
+        deps, filled = self.readSlab(start, stop)
+        return [d.take(0, axis) for d in deps], filled.take(0, axis)
+
+def open_hdf5_file(filename, fh=None):
     """Factory for HDF5 files.  
 
-    We check the version of the file to construct the proper class.  Currently, only two
-    options exist: version 2.0.0 -> legacy format, 3.0.0 -> extended format.
-    Version 1 is reserved for CSV files.
+    We check the version of the file to construct the proper class:
+    version 2.0.0 -> legacy format, 3.0.0 -> extended format, 4.0.0 ->
+    extended format stored by column, 5.0.0 -> gridded format.  Version 1
+    is reserved for CSV files.  fh is the SelfClosingFile to use, by
+    default one that opens the file for appending.
     """
-    fh = SelfClosingFile(h5py.File, open_args=(filename, 'a'))
+    if fh is None:
+        fh = SelfClosingFile(h5py.File, open_args=(filename, 'a'))
     version = fh().attrs['Version']
     if version[0] == 2:
         return SimpleHDF5Data(fh)
+    elif version[0] == 4:
+        return ColumnarHDF5Data(fh)
+    elif version[0] == 5:
+        return GriddedHDF5Data(fh)
     else:
         return ExtendedHDF5Data(fh)
 
-def create_backend(filename, title, indep, dep, extended):
+def create_backend(filename, title, indep, dep, extended, storage=DEFAULT_STORAGE,
+                   grid=None):
+    """Create the file for a new dataset.
+
+    grid gives the number of points along each independent for a gridded
+    dataset, or None for a dataset of rows.
+    """
     hdf5_file = filename + '.hdf5'
     fh = SelfClosingFile(h5py.File, open_args=(hdf5_file, 'a'))
-    if extended:
+    if grid:
+        data = GriddedHDF5Data(fh)
+        try:
+            data.initialize_info(title, indep, dep, storage, grid)
+        except Exception:
+            fh.close()
+            os.remove(hdf5_file)
+            raise
+        return data
+    if storage.layout == 'columns':
+        data = ColumnarHDF5Data(fh)
+    elif extended:
         data = ExtendedHDF5Data(fh)
     else:
         data = SimpleHDF5Data(fh)
-    data.initialize_info(title, indep, dep)
+    data.initialize_info(title, indep, dep, storage)
     return data
 
-def open_backend(filename):
+def open_backend(filename, read_only=False, pinned=False):
     """Make a data object that manages in-memory and on-disk storage for a dataset.
 
     filename should be specified without a file extension. If there is an existing
     file in csv format, we create a backend of the appropriate type. If
     no file exists, we create a new backend to store data in binary form.
+    With read_only, the file is opened read-only with a ReadOnlyFile, so it
+    can be read from any thread while the server has it open.  With
+    pinned, the file starts out pinned (see SelfClosingFile), so that it can
+    be opened in a worker thread.
     """
     csv_file = filename + '.csv'
     hdf5_file = filename + '.hdf5'
 
     if os.path.exists(csv_file):
         if use_numpy:
-            return CsvNumpyData(csv_file)
+            return CsvIndexedData(csv_file, read_only=read_only, pinned=pinned)
         else:
-            return CsvListData(csv_file)
+            return CsvListData(csv_file, pinned=pinned)
     elif os.path.exists(hdf5_file):
-        return open_hdf5_file(hdf5_file)
+        if read_only:
+            fh = ReadOnlyFile(h5py.File, open_args=(hdf5_file, 'r'))
+        else:
+            fh = SelfClosingFile(h5py.File, open_args=(hdf5_file, 'a'),
+                                 pinned=pinned)
+        return open_hdf5_file(hdf5_file, fh)
     else: # We should have already checked, this should not happen
         raise errors.DatasetNotFoundError(filename)
@@ -0,0 +1,328 @@
+"""Throughput and latency benchmarks for the Data Vault.
+
+Each benchmark drives the DataVault settings in-process against a fresh
+temporary directory, timing every setting call, and reports the number of
+calls, p50/p99/mean latency in milliseconds and, where rows are moved,
+rows per second.  Results are printed as JSON so that runs can be kept and
+compared to catch regressions in the storage paths:
+
+  add 1, add 100, add 10000    add calls of that many rows each
+  add_ex_t arrays              add_ex_t with 100-point array columns
+  get stream                   get of a large dataset, 10000 rows per call
+  get range wide rows, columns 3 of 200 columns, in each storage layout
+  dir 10k                      dir of a directory holding 10000 datasets
+  open by number               open in that directory by dataset number
+  add parameters               add parameters with 1000 parameters
+  get parameters               get parameters of those datasets
+  concurrent add, get          many contexts adding to their own datasets
+
+Settings run synchronously in the calling thread, without the network or
+the IOScheduler, so the numbers are those of the storage layer itself.
+--scale multiplies the number of calls and the size of the datasets; use
+a small scale for a quick check.
+
+usage: python -m datavault.benchmark [--scale S] [-o FILE] [name ...]
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import collections
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from . import SessionStore, server
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(*names):
+    """Register a benchmark function producing the named results.
+
+    The function is called with a Bench and returns a Timer for each name.
+    """
+    def register(func):
+        BENCHMARKS[names] = func
+        return func
+    return register
+
+
+class Timer(object):
+    """Collects the latency of each call and the rows it moved."""
+    def __init__(self):
+        self.latencies = []
+        self.rows = 0
+
+    def time(self, rows, func, *args):
+        start = time.time()
+        result = func(*args)
+        self.latencies.append(time.time() - start)
+        self.rows += rows
+        return result
+
+    def result(self):
+        t = np.array(self.latencies) * 1e3
+        total = sum(self.latencies)
+        result = collections.OrderedDict([
+            ('calls', len(t)),
+            ('p50_ms', float(np.percentile(t, 50))),
+            ('p99_ms', float(np.percentile(t, 99))),
+            ('mean_ms', float(t.mean())),
+            ('total_s', total),
+        ])
+        if self.rows:
+            result['rows'] = self.rows
+            result['rows_per_s'] = self.rows / total if total else None
+        return result
+
+
+class _Context(dict):
+    def __init__(self, ID):
+        self.ID = ID
+
+
+class _Hub(object):
+    """Drops the signals, which need a connection to a manager."""
+    def __getattr__(self, name):
+        return lambda data, contexts=None: None
+
+
+class Bench(object):
+    """A Data Vault server running on a temporary directory."""
+    def __init__(self, datadir, scale=1.0):
+        self.datadir = datadir
+        self.scale = scale
+        self.store = SessionStore(datadir, _Hub())
+        self.dv = server.DataVault(self.store)
+        self.dv.initServer()
+        self._contexts = 0
+        self._bigDir = None
+
+    def n(self, count):
+        """Scale a count, keeping at least one."""
+        return max(1, int(round(count * self.scale)))
+
+    def context(self, path=None):
+        """Make a new context, in a new directory if path is given."""
+        self._contexts += 1
+        c = _Context((0, self._contexts))
+        self.dv.initContext(c)
+        if path is not None:
+            self.dv.cd(c, path, True)
+        return c
+
+    def newDataset(self, c, name='bench', deps=1):
+        self.dv.new(c, name, ['x [s]'],
+                    ['y{0} (y) [V]'.format(i) for i in range(deps)])
+
+    def bigDir(self):
+        """Get a context in a directory of many datasets, making it once."""
+        if self._bigDir is None:
+            c = self.context(['', 'big'])
+            for i in range(self.n(10000)):
+                self.newDataset(c)
+            self._bigDir = c
+        return self._bigDir
+
+
+def _rows(count, cols, start=0):
+    data = np.arange(start * cols, (start + count) * cols, dtype=float)
+    return data.reshape((count, cols))
+
+
+def _add(bench, rows_per_call, calls):
+    c = bench.context(['', 'add {0}'.format(rows_per_call)])
+    bench.newDataset(c, deps=2)
+    t = Timer()
+    for i in range(calls):
+        t.time(rows_per_call, bench.dv.add, c, _rows(rows_per_call, 3, i))
+    return t,
+
+
+@benchmark('add 1')
+def add_1(bench):
+    return _add(bench, 1, bench.n(2000))
+
+
+@benchmark('add 100')
+def add_100(bench):
+    return _add(bench, 100, bench.n(500))
+
+
+@benchmark('add 10000')
+def add_10000(bench):
+    return _add(bench, 10000, bench.n(50))
+
+
+@benchmark('add_ex_t arrays')
+def add_ex_t_arrays(bench):
+    c = bench.context(['', 'add_ex_t'])
+    bench.dv.new_ex(c, 'bench', [('t', [1], 'v', 's')],
+                    [('trace', 'I', [100], 'v', 'A'),
+                     ('phase', 'I', [100], 'v', 'rad')])
+    t = Timer()
+    rows = 100
+    for i in range(bench.n(200)):
+        x = np.arange(i * rows, (i + 1) * rows, dtype=float)
+        trace = np.random.random((rows, 100))
+        phase = np.random.random((rows, 100))
+        t.time(rows, bench.dv.add_ex_t, c, (x, trace, phase))
+    return t,
+
+
+@benchmark('get stream')
+def get_stream(bench):
+    c = bench.context(['', 'get'])
+    bench.newDataset(c, deps=2)
+    total = bench.n(200000)
+    for start in range(0, total, 10000):
+        bench.dv.add(c, _rows(min(10000, total - start), 3, start))
+    t = Timer()
+    for i in range(5):
+        bench.dv.open(c, 1)
+        while True:
+            data = t.time(0, bench.dv.get, c, 10000)
+            t.rows += len(data)
+            if not len(data):
+                break
+    return t,
+
+
+def _wideRange(bench, layout):
+    c = bench.context(['', 'wide ' + layout])
+    cols = 200
+    bench.dv.new_ex(c, 'bench', [('x', [1], 'v', 's')],
+                    [('y{0}'.format(i), 'y', [1], 'v', 'V') for i in range(cols - 1)],
+                    0, '', layout)
+    total = bench.n(20000)
+    for start in range(0, total, 1000):
+        bench.dv.add(c, _rows(min(1000, total - start), cols, start))
+    t = Timer()
+    for i in range(bench.n(50)):
+        data = t.time(0, bench.dv.get_range, c, 0, None, [0, 1, 100])
+        t.rows += len(data)
+    return t
+
+
+@benchmark('get range wide rows', 'get range wide columns')
+def wide_range(bench):
+    return _wideRange(bench, 'rows'), _wideRange(bench, 'columns')
+
+
+@benchmark('dir 10k', 'open by number')
+def dir_and_open(bench):
+    c = bench.bigDir()
+    count = bench.n(10000)
+    listing = Timer()
+    for i in range(bench.n(20)):
+        listing.time(0, bench.dv.dir, c)
+    opening = Timer()
+    reader = bench.context(['', 'big'])
+    for number in np.random.randint(1, count + 1, bench.n(1000)):
+        opening.time(0, bench.dv.open, reader, int(number))
+    return listing, opening
+
+
+@benchmark('add parameters', 'get parameters')
+def parameters(bench):
+    c = bench.context(['', 'params'])
+    params = []
+    for i in range(bench.n(1000)):
+        kind = i % 3
+        if kind == 0:
+            params.append(('p{0}'.format(i), float(i)))
+        elif kind == 1:
+            params.append(('p{0}'.format(i), 'value {0}'.format(i)))
+        else:
+            params.append(('p{0}'.format(i), np.arange(10, dtype=float)))
+    adding, getting = Timer(), Timer()
+    datasets = bench.n(20)
+    for i in range(datasets):
+        bench.newDataset(c)
+        adding.time(0, bench.dv.add_parameters, c, params)
+    for number in range(1, datasets + 1):
+        bench.dv.open(c, number)
+        getting.time(0, bench.dv.get_parameters, c)
+    return adding, getting
+
+
+@benchmark('concurrent add', 'concurrent get')
+def concurrent(bench):
+    contexts = [bench.context(['', 'concurrent']) for i in range(bench.n(100))]
+    for c in contexts:
+        bench.newDataset(c)
+    adding, getting = Timer(), Timer()
+    rounds = bench.n(50)
+    for i in range(rounds):
+        for c in contexts:
+            adding.time(10, bench.dv.add, c, _rows(10, 2, i * 10))
+    for c in contexts:
+        getting.time(rounds * 10, bench.dv.get, c, None, True)
+    return adding, getting
+
+
+def run(names=None, scale=1.0, report=None):
+    """Run the benchmarks with the given result names (default: all).
+
+    Returns the results as a dict that can be written out as JSON.
+    """
+    results = collections.OrderedDict()
+    for keys, func in BENCHMARKS.items():
+        if names and not set(keys) & set(names):
+            continue
+        datadir = tempfile.mkdtemp(prefix='dvbench_')
+        try:
+            bench = Bench(datadir, scale)
+            timers = func(bench)
+            bench.dv.stopServer()
+        finally:
+            shutil.rmtree(datadir)
+        for key, timer in zip(keys, timers):
+            results[key] = timer.result()
+            if report is not None:
+                report('{}: {}'.format(key, json.dumps(results[key])))
+    return collections.OrderedDict([
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('host', platform.node()),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('h5py', h5py.__version__),
+        ('scale', scale),
+        ('results', results),
+    ])
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+            prog=os.path.basename(argv[0]),
+            description='Benchmark the Data Vault storage paths.')
+    parser.add_argument('names', nargs='*',
+                        help='results to produce (default: all)')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply calls and dataset sizes by this')
+    parser.add_argument('-o', '--output', default=None,
+                        help='write the JSON results here (default: stdout)')
+    args = parser.parse_args(argv[1:])
+
+    def report(message):
+        print >>sys.stderr, message
+    results = run(args.names, args.scale, report)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print text
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
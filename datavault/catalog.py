@@ -0,0 +1,491 @@
+"""An SQLite catalog of every dataset in the Data Vault.
+
+Finding datasets used to mean walking the directory tree one 'cd' and 'dir'
+at a time.  The catalog keeps one row per dataset in <datadir>/catalog.db,
+with its directory, name, number, title, creation and modification times,
+row count, variable labels, tags and numeric parameters, along with the
+tags of every directory, so that searches by name, tag, time or parameter
+value are answered with a single query.
+
+The server keeps the catalog up to date as datasets are created, tagged,
+given parameters and added to.  Changes are committed CATALOG_COMMIT_DELAY
+seconds after they are made, so a busy writer costs one commit every few
+seconds.  A catalog that is missing or out of date (say, after files were
+copied into the vault by hand) can be rebuilt from the files on disk.  The
+server does this in a thread when it starts without a complete catalog
+(see Catalog.rebuildInThread); to do it by hand:
+
+usage: python -m datavault.catalog /path/to/vault
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import numbers
+import os
+import re
+import sqlite3
+import sys
+import time
+import urllib
+
+from labrad.units import Value
+from twisted.internet import reactor, threads
+from twisted.python import failure
+
+from . import backend, util
+
+CATALOG_FILE = 'catalog.db'
+CATALOG_COMMIT_DELAY = 5 # seconds to wait before committing changes
+CATALOG_VERSION = 2 # user_version of a complete catalog with this schema
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    number INTEGER,
+    title TEXT,
+    created REAL,
+    modified REAL,
+    rows INTEGER,
+    independents TEXT,
+    dependents TEXT,
+    UNIQUE (dir, name)
+);
+CREATE TABLE IF NOT EXISTS tags (
+    dataset INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (dataset, tag)
+);
+CREATE TABLE IF NOT EXISTS params (
+    dataset INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (dataset, name)
+);
+CREATE TABLE IF NOT EXISTS dir_tags (
+    dir TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (dir, tag)
+);
+CREATE INDEX IF NOT EXISTS datasets_created ON datasets (created);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag, dataset);
+CREATE INDEX IF NOT EXISTS params_value ON params (name, value);
+CREATE INDEX IF NOT EXISTS dir_tags_tag ON dir_tags (tag, dir);
+'''
+
+
+def dir_key(path):
+    """Get the catalog key of a directory path like ['', 'foo', 'bar']."""
+    return '/'.join(urllib.quote(d, safe='') for d in path[1:])
+
+
+def dir_path(key):
+    """Inverse of dir_key."""
+    if not key:
+        return ['']
+    return [''] + [urllib.unquote(d) for d in key.split('/')]
+
+
+def timestamp(t):
+    """Convert a datetime to seconds since the epoch."""
+    return time.mktime(t.timetuple()) + t.microsecond / 1e6
+
+
+def param_value(data):
+    """Get the value of a parameter to catalog, or None to leave it out.
+
+    Only scalar numbers are cataloged, since those are what range queries
+    can use.  Values with units are kept in the units they were given in.
+    """
+    if isinstance(data, Value):
+        return data[data.unit]
+    if isinstance(data, numbers.Real):
+        return float(data)
+    return None
+
+
+def _regexp(pattern, s):
+    return re.search(pattern, s) is not None
+
+
+class Catalog(object):
+    """The catalog database for one Data Vault directory tree.
+
+    outdated is set if the catalog was never built completely, or was built
+    by an older version that left things out, and should be rebuilt.
+    """
+    def __init__(self, filename, reactor=reactor):
+        self.filename = filename
+        self.reactor = reactor
+        self.db = self._connect()
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        self.outdated = version < CATALOG_VERSION
+        self._commitCall = None
+        self._rows = {} # (dir, name) -> (rows, modified) not yet written
+        self._queued = None # changes made during rebuildInThread
+
+    def _connect(self):
+        db = sqlite3.connect(self.filename)
+        db.create_function('regexp', 2, _regexp)
+        db.executescript(_SCHEMA)
+        db.commit()
+        return db
+
+    @property
+    def building(self):
+        """Whether the catalog is being rebuilt, and so can't be searched."""
+        return self._queued is not None
+
+    def _queue(self, method, *args, **kw):
+        """Keep a change made while building, to make once the build is done.
+
+        Returns True if the change was kept for later.
+        """
+        if self._queued is None:
+            return False
+        self._queued.append((method, args, kw))
+        return True
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def commit(self):
+        """Write out all changes now."""
+        if self._commitCall is not None:
+            if self._commitCall.active():
+                self._commitCall.cancel()
+            self._commitCall = None
+        self._writeRows()
+        self.db.commit()
+
+    def commitLater(self):
+        if self._commitCall is None:
+            self._commitCall = self.reactor.callLater(CATALOG_COMMIT_DELAY,
+                                                      self.commit)
+
+    def _writeRows(self):
+        if self._rows:
+            self.db.executemany(
+                    'UPDATE datasets SET rows = ?, modified = ? '
+                    'WHERE dir = ? AND name = ?',
+                    [(rows, modified, key, name) for (key, name), (rows, modified)
+                     in self._rows.iteritems()])
+            self._rows = {}
+
+    def _id(self, path, name):
+        row = self.db.execute('SELECT id FROM datasets WHERE dir = ? AND name = ?',
+                              (dir_key(path), name)).fetchone()
+        return None if row is None else row[0]
+
+    def addDataset(self, path, name, number, title, created, independents,
+                   dependents, rows=0, modified=None, tags=(), params=()):
+        """Add a dataset, replacing any old entry of the same name.
+
+        created and modified are seconds since the epoch, and independents
+        and dependents lists of variable labels.
+        """
+        if self._queue(self.addDataset, path, name, number, title, created,
+                       independents, dependents, rows=rows, modified=modified,
+                       tags=tags, params=params):
+            return
+        self._insert(path, name, number, title, created, independents,
+                     dependents, rows, modified, tags, params)
+        self.commitLater()
+
+    def _insert(self, path, name, number, title, created, independents,
+                dependents, rows, modified, tags, params):
+        key = dir_key(path)
+        self._rows.pop((key, name), None)
+        old = self._id(path, name)
+        if old is not None:
+            self.db.execute('DELETE FROM tags WHERE dataset = ?', (old,))
+            self.db.execute('DELETE FROM params WHERE dataset = ?', (old,))
+            self.db.execute('DELETE FROM datasets WHERE id = ?', (old,))
+        cursor = self.db.execute(
+                'INSERT INTO datasets (dir, name, number, title, created, '
+                'modified, rows, independents, dependents) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, name, number, title, created,
+                 created if modified is None else modified, rows,
+                 '\n'.join(independents), '\n'.join(dependents)))
+        dataset = cursor.lastrowid
+        self.db.executemany('INSERT INTO tags VALUES (?, ?)',
+                            [(dataset, tag) for tag in tags])
+        self._addParams(dataset, params)
+
+    def setTags(self, path, name, tags):
+        if self._queue(self.setTags, path, name, tags):
+            return
+        dataset = self._id(path, name)
+        if dataset is None:
+            return
+        self.db.execute('DELETE FROM tags WHERE dataset = ?', (dataset,))
+        self.db.executemany('INSERT INTO tags VALUES (?, ?)',
+                            [(dataset, tag) for tag in tags])
+        self.commitLater()
+
+    def setDirTags(self, path, tags):
+        """Set the tags of the directory path, like ['', 'foo', 'bar']."""
+        if self._queue(self.setDirTags, path, tags):
+            return
+        self._setDirTags(dir_key(path), tags)
+        self.commitLater()
+
+    def _setDirTags(self, key, tags):
+        self.db.execute('DELETE FROM dir_tags WHERE dir = ?', (key,))
+        self.db.executemany('INSERT INTO dir_tags VALUES (?, ?)',
+                            [(key, tag) for tag in tags])
+
+    def addParams(self, path, name, params):
+        """Record the numeric values among params, a list of (name, data)."""
+        if self._queue(self.addParams, path, name, params):
+            return
+        dataset = self._id(path, name)
+        if dataset is None:
+            return
+        self._addParams(dataset, params)
+        self.commitLater()
+
+    def _addParams(self, dataset, params):
+        values = [(dataset, name, param_value(data)) for name, data in params]
+        self.db.executemany('INSERT OR REPLACE INTO params VALUES (?, ?, ?)',
+                            [v for v in values if v[2] is not None])
+
+    def setRows(self, path, name, rows):
+        """Note the row count of a dataset that has just been added to.
+
+        This is cheap: the count is only written out with the next commit.
+        """
+        if self._queue(self.setRows, path, name, rows):
+            return
+        self._rows[dir_key(path), name] = (rows, time.time())
+        self.commitLater()
+
+    def search(self, path=[''], regex='', tags=(), after=None, before=None,
+               params=(), limit=None):
+        """Find datasets in the directory path or below it.
+
+        regex is matched anywhere in the dataset name.  A dataset must have
+        all the given tags, except those starting with '-', which neither
+        it nor any directory between path and it may have (as when walking
+        the tree with dir, so '-trash' leaves out trashed directories too).
+        after and before limit the creation time, and params is a list of
+        (name, low, high) ranges that parameter values must be in.  Returns
+        a list of (path, name), oldest first.
+        """
+        self._writeRows()
+        where, args = [], []
+        key = dir_key(path)
+        if key:
+            where.append('(d.dir = ? OR substr(d.dir, 1, ?) = ?)')
+            args += [key, len(key) + 1, key + '/']
+        if regex:
+            where.append('d.name REGEXP ?')
+            args.append(regex)
+        for tag in tags:
+            if tag[:1] == '-':
+                tag = tag[1:]
+                where.append('NOT EXISTS (SELECT 1 FROM tags t '
+                             'WHERE t.dataset = d.id AND t.tag = ?)')
+                args.append(tag)
+                # nor the dataset's directory or a parent of it below path
+                where.append("NOT EXISTS (SELECT 1 FROM dir_tags g "
+                             "WHERE g.tag = ? AND length(g.dir) > ? AND "
+                             "(d.dir = g.dir OR "
+                             "substr(d.dir, 1, length(g.dir) + 1) = g.dir || '/'))")
+                args += [tag, len(key)]
+            else:
+                where.append('EXISTS (SELECT 1 FROM tags t '
+                             'WHERE t.dataset = d.id AND t.tag = ?)')
+                args.append(tag)
+        if after is not None:
+            where.append('d.created >= ?')
+            args.append(after)
+        if before is not None:
+            where.append('d.created < ?')
+            args.append(before)
+        for name, low, high in params:
+            where.append('EXISTS (SELECT 1 FROM params p WHERE p.dataset = d.id '
+                         'AND p.name = ? AND p.value BETWEEN ? AND ?)')
+            args += [name, low, high]
+        query = 'SELECT d.dir, d.name FROM datasets d'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY d.created, d.id'
+        if limit is not None:
+            query += ' LIMIT ?'
+            args.append(limit)
+        return [(dir_path(key), name)
+                for key, name in self.db.execute(query, args)]
+
+    def info(self, path, name):
+        """Get the cataloged fields of a dataset as a dict, or None."""
+        self._writeRows()
+        cursor = self.db.execute(
+                'SELECT number, title, created, modified, rows, independents, '
+                'dependents FROM datasets WHERE dir = ? AND name = ?',
+                (dir_key(path), name))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        fields = ['number', 'title', 'created', 'modified', 'rows',
+                  'independents', 'dependents']
+        info = dict(zip(fields, row))
+        info['independents'] = info['independents'].split('\n') if info['independents'] else []
+        info['dependents'] = info['dependents'].split('\n') if info['dependents'] else []
+        return info
+
+    def rebuild(self, datadir, report=None):
+        """Replace the contents of the catalog with what is on disk.
+
+        Returns the number of datasets cataloged.  Datasets that cannot be
+        read are reported and left out.
+        """
+        # imported here because the package imports this module
+        from datavault import filename_decode
+
+        self.db.execute('DELETE FROM params')
+        self.db.execute('DELETE FROM tags')
+        self.db.execute('DELETE FROM datasets')
+        self.db.execute('DELETE FROM dir_tags')
+        self._rows = {}
+        count = 0
+        for dirpath, dirnames, filenames in os.walk(datadir):
+            dirnames.sort()
+            rel = os.path.relpath(dirpath, datadir)
+            path = ['']
+            if rel != os.curdir:
+                path += [filename_decode(d[:-len('.dir')])
+                         for d in rel.split(os.sep)]
+            session_tags, dataset_tags = _read_tags(
+                    os.path.join(dirpath, 'session.ini'))
+            for subdir, tags in session_tags.iteritems():
+                if tags:
+                    self._setDirTags(dir_key(path + [subdir]), tags)
+            for filename in sorted(filenames):
+                base, ext = os.path.splitext(filename)
+                if ext not in ('.csv', '.hdf5'):
+                    continue
+                name = filename_decode(base)
+                try:
+                    self._addFromFile(path, name, os.path.join(dirpath, base),
+                                      dataset_tags.get(name, ()))
+                    count += 1
+                except Exception as e:
+                    if report is not None:
+                        report('{}: {}'.format(os.path.join(dirpath, filename), e))
+        self.db.execute('PRAGMA user_version = {}'.format(CATALOG_VERSION))
+        self.commit()
+        self.outdated = False
+        return count
+
+    def rebuildInThread(self, datadir, report=None):
+        """Rebuild the catalog in a thread, without holding up the server.
+
+        The new catalog is built in a separate file that then replaces this
+        one.  Until it does, searches are refused (see building) and changes
+        are kept to be made once it is in place.  Files are read with
+        read-only handles of their own (see backend.ReadOnlyFile), so files
+        the server has open for writing may be locked and left out.
+        Returns a Deferred that fires with the number of datasets cataloged.
+        """
+        self._queued = []
+        tmpname = self.filename + '.new'
+        def build():
+            if os.path.exists(tmpname):
+                os.remove(tmpname) # left over from an interrupted build
+            new = Catalog(tmpname, reactor=self.reactor)
+            try:
+                return new.rebuild(datadir, report)
+            finally:
+                new.close()
+        d = threads.deferToThread(build)
+        d.addBoth(self._built, tmpname)
+        return d
+
+    def _built(self, result, tmpname):
+        if not isinstance(result, failure.Failure):
+            self.commit()
+            self.db.close()
+            try:
+                util.replace_file(tmpname, self.filename)
+                self.outdated = False
+            except OSError:
+                result = failure.Failure() # keep the old catalog
+            self.db = self._connect()
+        queued, self._queued = self._queued, None
+        for method, args, kw in queued:
+            method(*args, **kw)
+        return result
+
+    def _addFromFile(self, path, name, base, tags):
+        # read-only, since this runs in a thread while the server may be
+        # writing the file
+        data = backend.open_backend(base, read_only=True)
+        try:
+            data.load()
+            if isinstance(data, backend.IniData):
+                title = data.title
+                created = timestamp(data.created)
+                modified = timestamp(data.modified)
+            else:
+                attrs = data.dataset.attrs
+                title = attrs['Title']
+                created = float(attrs['Creation Time'])
+                modified = float(attrs['Modification Time'])
+            rows = len(data) if hasattr(data, '__len__') else None
+            params = [(p, data.getParameter(p)) for p in data.getParamNames()]
+            self._insert(path, name, _number(name), title, created,
+                         [v.label for v in data.getIndependents()],
+                         [v.label for v in data.getDependents()],
+                         rows, modified, tags, params)
+        finally:
+            data._file.close()
+
+
+def _number(name):
+    """Get the number at the start of a dataset name like '00012 - Foo'."""
+    try:
+        return int(name[:5])
+    except ValueError:
+        return None
+
+
+def _read_tags(infofile):
+    """Get the directory and dataset tags saved in a session.ini file."""
+    if not os.path.exists(infofile):
+        return {}, {}
+    S = util.DVSafeConfigParser()
+    S.read(infofile)
+    if not S.has_section('Tags'):
+        return {}, {}
+    return (eval(S.get('Tags', 'sessions', raw=True)),
+            eval(S.get('Tags', 'datasets', raw=True)))
+
+
+def open_catalog(datadir, reactor=reactor):
+    """Open the catalog of the vault in datadir, creating it if needed."""
+    return Catalog(os.path.join(datadir, CATALOG_FILE), reactor=reactor)
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+            prog=os.path.basename(argv[0]),
+            description='Rebuild the dataset catalog of a Data Vault tree.')
+    parser.add_argument('root', help='Data Vault storage directory')
+    args = parser.parse_args(argv[1:])
+
+    def report(message):
+        print message
+    catalog = open_catalog(args.root)
+    count = catalog.rebuild(args.root, report)
+    catalog.close()
+    report('cataloged {} datasets'.format(count))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""Read Data Vault datasets straight from their files.
+
+Getting a big dataset through the server means flattening it into a LabRAD
+packet and unflattening it again, even when the analysis runs on the Data
+Vault host itself.  A process that can see the data directory can instead
+open the dataset's HDF5 file read-only and have h5py read the rows straight
+into numpy arrays:
+
+    with direct.open_dataset('/path/to/vault', ['', 'sub'], 12) as d:
+        rows = d.read(columns=[0, 2])
+        params = d.parameters()
+
+Datasets the server is still writing can be read too, with care.  The
+server flushes each file within SYNC_DELAY seconds of a change.  HDF5's
+file locking keeps readers out for as long as the server has the file
+open, so the reading process has to call disable_file_locking() first.
+Nothing then coordinates the server with the readers (the files are not
+written in SWMR mode), so a reader that is open while the server flushes
+can see a half-written file and fail.  Open the dataset, read what you
+need and close it again straight away, retry if that fails, and don't
+keep a DatasetReader open; re-open it to see newer rows.
+
+Only HDF5 datasets can be read this way.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import os
+
+import h5py
+
+from . import backend, errors, filedir, filename_encode
+
+
+def disable_file_locking():
+    """Let this process open files that the server has open for writing.
+
+    This turns off HDF5's file locking for every file the process opens
+    from now on, so only call it in processes that just read datasets.
+    """
+    os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+
+
+class _ReadOnlyFile(backend.SelfClosingFile):
+    """An HDF5 file opened read-only, next to the server that writes it.
+
+    The backends register callbacks that trim the file when it closes;
+    those are for the server to run, so they are dropped here.
+    """
+    def __init__(self, filename):
+        backend.SelfClosingFile.__init__(self, self._open, open_args=(filename,))
+
+    @staticmethod
+    def _open(filename):
+        return h5py.File(filename, 'r')
+
+    def onClose(self, callback):
+        pass
+
+
+def dataset_filename(datadir, path, name):
+    """Find the HDF5 file of a dataset in the data directory.
+
+    path is the Data Vault directory as a list starting with '' and name
+    is the dataset name or number, as for the open setting.
+    """
+    dirname = filedir(datadir, path)
+    if not os.path.isdir(dirname):
+        raise errors.DirectoryNotFoundError(path)
+    if isinstance(name, (int, long)):
+        prefix = '%05d - ' % name
+        for filename in sorted(os.listdir(dirname)):
+            if filename.startswith(prefix) and filename.endswith('.hdf5'):
+                return os.path.join(dirname, filename)
+        raise errors.DatasetNotFoundError(name)
+    filename = os.path.join(dirname, filename_encode(name))
+    if os.path.exists(filename + '.hdf5'):
+        return filename + '.hdf5'
+    if os.path.exists(filename + '.csv'):
+        raise errors.UnsupportedDatasetError('direct read')
+    raise errors.DatasetNotFoundError(name)
+
+
+def open_dataset(datadir, path, name):
+    """Open a dataset read-only, given its directory and name or number."""
+    return DatasetReader(dataset_filename(datadir, path, name))
+
+
+class DatasetReader(object):
+    """A read-only view of one dataset file.
+
+    data is the backend object for the file, so everything the server can
+    read is available; the methods here cover the common cases and return
+    plain numpy arrays.  Close the reader as soon as the reads are done
+    (see the module docstring).
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._fh = _ReadOnlyFile(filename)
+        self.data = backend.open_hdf5_file(filename, self._fh)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._fh.close()
+
+    def __len__(self):
+        """Number of rows in the dataset."""
+        if not hasattr(self.data, 'readRows'):
+            raise errors.UnsupportedDatasetError('row data')
+        return len(self.data)
+
+    def independents(self):
+        return self.data.getIndependents()
+
+    def dependents(self):
+        return self.data.getDependents()
+
+    def read(self, start=0, stop=None, columns=None):
+        """Read rows [start, stop) as a struct array with fields f0, f1, ...
+
+        columns limits the fields read to the given column numbers.
+        """
+        stop = len(self) if stop is None else stop
+        names = self.data.dtype.names
+        if columns is not None:
+            names = tuple(names[col] for col in columns)
+        return self.data.readRange(start, stop, 1, names)
+
+    def parameters(self):
+        """Get the parameters as an ordered dict of name to value."""
+        return collections.OrderedDict(
+                (name, self.data.getParameter(name))
+                for name in self.data.getParamNames())
+
+    def comments(self):
+        """Get the comments as a list of (time, user, comment)."""
+        return self.data.getComments(None, 0)[0]
+
+    def gridShape(self):
+        return self._grid().gridShape()
+
+    def axis(self, axis):
+        """Get the coordinates of the points along an axis of a grid."""
+        return self._grid().getAxis(axis)
+
+    def slab(self, start, stop):
+        """Read a box of a gridded dataset, see the get slab setting."""
+        return self._grid().readSlab(start, stop)
+
+    def _grid(self):
+        if not isinstance(self.data, backend.GriddedHDF5Data):
+            raise errors.UnsupportedDatasetError('grid data')
+        return self.data
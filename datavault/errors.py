@@ -46,3 +46,51 @@ class DataVersionMismatchError(T.Error):
     code = 11
     def __init__(self):
         self.msg = "Dataset was created with newer API, cannot be read.  Use get_ex"
+
+class UnsupportedDatasetError(T.Error):
+    code = 12
+    def __init__(self, operation):
+        self.msg = "'{0}' is not supported for this dataset.".format(operation)
+
+class BadStorageError(T.Error):
+    code = 13
+    def __init__(self, filters):
+        self.msg = "Unknown storage filters '{0}'.  Use e.g. 'gzip', 'gzip:4', 'shuffle+gzip' or 'lzf'.".format(filters)
+
+class BadColumnError(T.Error):
+    code = 14
+    def __init__(self, column, cols):
+        self.msg = "Column {0} does not exist; the dataset has {1} columns.".format(column, cols)
+
+class NoCatalogError(T.Error):
+    """This Data Vault has no dataset catalog, or is still building it."""
+    code = 15
+
+class BadLayoutError(T.Error):
+    code = 16
+    def __init__(self, layout):
+        self.msg = "Unknown storage layout '{0}'.  Use 'rows' or 'columns'.".format(layout)
+
+class BadGridError(T.Error):
+    code = 17
+    def __init__(self, problem):
+        self.msg = "Bad grid access: {0}.".format(problem)
+
+class ParameterBlobError(T.Error):
+    code = 18
+    def __init__(self, ref):
+        self.msg = "Shared parameter value '{0}' is missing from the directory's parameter store.".format(ref)
+
+class BadFieldError(T.Error):
+    code = 19
+    def __init__(self, field):
+        self.msg = "Unknown field '{0}'.  Use 'data', 'parameters' or 'comments'.".format(field)
+
+class FilePoolSizeError(T.Error):
+    code = 20
+    def __init__(self, max_open):
+        self.msg = "The file pool must allow at least one open file, not {0}.".format(max_open)
+
+class NoItemsError(T.Error):
+    """Give at least one dataset to read."""
+    code = 21
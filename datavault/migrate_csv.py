@@ -0,0 +1,185 @@
+"""Convert the legacy CSV datasets in a Data Vault tree to HDF5.
+
+Each dataset stored as a .csv file with a .ini file of metadata is copied
+into a simple (version 2) HDF5 file along with its parameters, comments and
+timestamps.  Once the new file has been checked to hold the same number of
+rows, it is renamed into place and the old files are renamed to .csv.orig
+and .ini.orig, so the Data Vault serves the HDF5 file from then on.
+
+Datasets are converted in parallel by a pool of worker processes.  The
+conversion can be interrupted and run again: datasets that are already
+converted are skipped, and half-finished ones are picked up where they
+stopped.  The Data Vault must not be running while this runs, since it may
+append to a CSV file that is being converted.
+
+usage: python -m datavault.migrate_csv [-j N] [--dry-run] /path/to/vault
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import h5py
+from twisted.internet import task
+
+from . import backend, util
+
+MIGRATE_ROWS = 1 << 16 # rows to copy at a time
+
+
+def find_datasets(root):
+    """Find the CSV datasets under root that still need to be converted.
+
+    Returns the dataset paths without file extension.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        files = set(filenames)
+        for filename in sorted(files):
+            base, ext = os.path.splitext(filename)
+            if ext == '.csv':
+                yield os.path.join(dirpath, base)
+            elif ext == '.ini' and filename.lower() != 'session.ini':
+                # converted, but stopped before the .ini was renamed
+                if base + '.csv' not in files and base + '.csv.orig' in files:
+                    yield os.path.join(dirpath, base)
+
+
+def _timestamp(dt):
+    return time.mktime(dt.timetuple())
+
+
+def _copy(csv_data, hdf5_file):
+    """Copy data and metadata from a loaded CSV dataset into a new HDF5 file."""
+    clock = task.Clock()
+    fh = backend.SelfClosingFile(h5py.File, open_args=(hdf5_file, 'w'),
+                                 reactor=clock)
+    try:
+        data = backend.SimpleHDF5Data(fh)
+        data.initialize_info(csv_data.title, csv_data.independents,
+                             csv_data.dependents)
+        rows = len(csv_data)
+        for start in xrange(0, rows, MIGRATE_ROWS):
+            block, _ = csv_data.getData(MIGRATE_ROWS, start, False, False)
+            data.addData(util.to_record_array(block))
+        for p in csv_data.parameters:
+            data.addParam(p['label'], p['data'])
+        for t, user, comment in csv_data.comments:
+            data.addComment(user, comment, timestamp=_timestamp(t))
+        attrs = data.dataset.attrs
+        attrs['Creation Time'] = _timestamp(csv_data.created)
+        attrs['Access Time'] = _timestamp(csv_data.accessed)
+        attrs['Modification Time'] = _timestamp(csv_data.modified)
+    finally:
+        fh.close()
+    return rows
+
+
+def _count_rows(hdf5_file):
+    clock = task.Clock()
+    fh = backend.SelfClosingFile(h5py.File, open_args=(hdf5_file, 'r'),
+                                 reactor=clock)
+    try:
+        return len(fh()['DataVault'])
+    finally:
+        fh.close()
+
+
+def convert(base):
+    """Convert one dataset, given its path without file extension.
+
+    Returns (base, message), where message describes what was done or why
+    the conversion failed.  Errors are reported rather than raised, so that
+    one bad file doesn't stop the whole migration.
+    """
+    csv_file = base + '.csv'
+    ini_file = base + '.ini'
+    hdf5_file = base + '.hdf5'
+    tmp_file = hdf5_file + '.tmp'
+    try:
+        if os.path.exists(csv_file):
+            if os.path.exists(hdf5_file):
+                # a previous run was stopped after checking the new file
+                message = 'resumed'
+            else:
+                # parse blocks without filling the server-wide cache
+                csv_data = backend.CsvIndexedData(
+                        csv_file, reactor=task.Clock(),
+                        cache=util.LRUCache(0))
+                try:
+                    csv_data.load()
+                    rows = _copy(csv_data, tmp_file)
+                finally:
+                    csv_data._file.close()
+                written = _count_rows(tmp_file)
+                if written != rows:
+                    raise ValueError('wrote {} rows, expected {}'.format(
+                                     written, rows))
+                os.rename(tmp_file, hdf5_file)
+                message = 'converted {} rows'.format(rows)
+            # from here on the Data Vault opens the HDF5 file instead
+            os.rename(csv_file, csv_file + '.orig')
+        else:
+            message = 'resumed'
+        if os.path.exists(ini_file):
+            os.rename(ini_file, ini_file + '.orig')
+        return base, message
+    except Exception as e:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return base, 'failed: {}'.format(e)
+
+
+def migrate(root, processes=None, report=None):
+    """Convert every CSV dataset under root.
+
+    Returns the number of datasets that failed to convert.
+    """
+    bases = list(find_datasets(root))
+    if processes == 1:
+        results = (convert(base) for base in bases)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(convert, bases)
+    failures = 0
+    for i, (base, message) in enumerate(results):
+        if message.startswith('failed'):
+            failures += 1
+        if report is not None:
+            report('[{}/{}] {}: {}'.format(i + 1, len(bases),
+                                           os.path.relpath(base, root), message))
+    if processes != 1:
+        pool.close()
+        pool.join()
+    return failures
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+            prog=os.path.basename(argv[0]),
+            description='Convert CSV datasets in a Data Vault tree to HDF5.')
+    parser.add_argument('root', help='Data Vault storage directory')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='list the datasets to convert, then stop')
+    args = parser.parse_args(argv[1:])
+
+    def report(message):
+        print message
+    if args.dry_run:
+        for base in find_datasets(args.root):
+            report(os.path.relpath(base, args.root))
+        return 0
+    failures = migrate(args.root, args.processes, report)
+    if failures:
+        report('{} datasets failed to convert'.format(failures))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
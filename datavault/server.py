@@ -2,12 +2,14 @@ from __future__ import absolute_import
 
 import collections
 
+from twisted.internet import defer
 from twisted.internet.defer import inlineCallbacks
 import twisted.internet.task
 import numpy as np
+from labrad import types as T
 from labrad.server import LabradServer, Signal, setting
 
-from . import errors
+from . import backend, catalog, errors, stats, workers
 
 
 class DataVault(LabradServer):
@@ -17,6 +19,7 @@ class DataVault(LabradServer):
         LabradServer.__init__(self)
 
         self.session_store = session_store
+        self.stats = stats.ServerStats()
 
         # session signals
         self.onNewDir = Signal(543617, 'signal: new dir', 's')
@@ -27,11 +30,28 @@ class DataVault(LabradServer):
         self.onDataAvailable = Signal(543619, 'signal: data available', '')
         self.onNewParameter = Signal(543620, 'signal: new parameter', '')
         self.onCommentsAvailable = Signal(543621, 'signal: comments available', '')
+        self.onDataCount = Signal(543623, 'signal: data count', '(w*2v)')
 
     def initServer(self):
         # create root session
         _root = self.session_store.get([''])
 
+    def addSetting(self, setting, packet=None):
+        # record the calls of every setting in self.stats
+        return LabradServer.addSetting(self, self.stats.wrap(setting), packet)
+
+    def stopServer(self):
+        self.stats.stopDumping()
+        # write out anything still sitting in write buffers or waiting to be saved
+        for session in self.session_store.get_all():
+            for dataset in session.datasets.values():
+                dataset.flush()
+            session.flush()
+        if self.session_store.catalog is not None:
+            self.session_store.catalog.commit()
+        if self.session_store.io is not None:
+            return self.session_store.io.drain()
+
     def contextKey(self, c):
         """The key used to identify a given context for notifications"""
         return c.ID
@@ -46,6 +66,7 @@ class DataVault(LabradServer):
     def expireContext(self, c):
         """Stop sending any signals to this context."""
         key = self.contextKey(c)
+        self.stats.forgetContext(c)
         def removeFromList(ls):
             if key in ls:
                 ls.remove(key)
@@ -55,11 +76,23 @@ class DataVault(LabradServer):
                 removeFromList(dataset.listeners)
                 removeFromList(dataset.param_listeners)
                 removeFromList(dataset.comment_listeners)
+                removeFromList(dataset.count_listeners)
 
     def getSession(self, c):
         """Get a session object for the current path."""
         return c['session']
 
+    def setDataset(self, c, dataset):
+        """Make dataset the current dataset, and send its data counts here."""
+        key = self.contextKey(c)
+        if 'datasetObj' in c:
+            c['datasetObj'].count_listeners.discard(key)
+        dataset.count_listeners.add(key)
+        c['dataset'] = dataset.name # not the same as name; has number prefixed
+        c['datasetObj'] = dataset
+        c['filepos'] = 0 # start at the beginning
+        c['commentpos'] = 0
+
     def getDataset(self, c):
         """Get a dataset object for the current dataset."""
         if 'dataset' not in c:
@@ -161,19 +194,22 @@ class DataVault(LabradServer):
         Returns the path and name for this dataset.
         """
         session = self.getSession(c)
-        dataset = session.newDataset(name or 'untitled', independents, dependents)
-        c['dataset'] = dataset.name # not the same as name; has number prefixed
-        c['datasetObj'] = dataset
-        c['filepos'] = 0 # start at the beginning
-        c['commentpos'] = 0
+        dataset = session.newDataset(name or 'untitled', independents, dependents,
+                                     storage=self.session_store.storage)
+        self.setDataset(c, dataset)
         c['writing'] = True
         return c['path'], c['dataset']
 
     @setting(1009, name='s', 
              independents='*(s*iss)',
              dependents='*(ss*iss)',
+             chunk_rows='w',
+             compression='s',
+             layout='s',
+             grid='*w',
              returns=['*ss'])
-    def new_ex(self, c, name, independents, dependents):
+    def new_ex(self, c, name, independents, dependents, chunk_rows=0, compression='',
+               layout='', grid=[]):
         """Create a new extended dataset
 
         Independents are specified as: (label, shape, type, unit)
@@ -199,13 +235,30 @@ class DataVault(LabradServer):
         code.  The name and parameters will be there, but no actual data.
 
         The legacy format requires each column be a scalar v[unit] type.
+
+        chunk_rows and compression control how the data is laid out in the
+        HDF5 file.  chunk_rows is the number of rows per HDF5 chunk, and
+        compression is a '+' separated filter pipeline: 'shuffle', 'gzip'
+        (or 'gzip:<level>' for levels 0-9), 'lzf' or 'none', for instance
+        'shuffle+gzip:4'.  layout is 'rows' to store each row together or
+        'columns' to store each column in its own HDF5 dataset, which makes
+        reading a few columns of a wide dataset much faster.  Anything not
+        given uses the server default.  Compression and layout are
+        transparent to readers.
+
+        grid makes a gridded dataset for sweeps over a fixed N-D grid: it
+        gives the number of points along each independent, which must all
+        be scalar 'v' columns.  Each dependent is stored as an N-D array of
+        that shape, written and read with 'add slab', 'get slab' and
+        'get slice' rather than by rows.
         """
+        storage = backend.parse_storage(compression, chunk_rows,
+                                        default=self.session_store.storage,
+                                        layout=layout)
         session = self.getSession(c)
-        dataset = session.newDataset(name, independents, dependents, extended=True)
-        c['dataset'] = dataset.name # not the same as name; has number prefixed
-        c['datasetObj'] = dataset
-        c['filepos'] = 0 # start at the beginning
-        c['commentpos'] = 0
+        dataset = session.newDataset(name, independents, dependents, extended=True,
+                                     storage=storage, grid=grid or None)
+        self.setDataset(c, dataset)
         c['writing'] = True
         return c['path'], c['dataset']
 
@@ -217,16 +270,15 @@ class DataVault(LabradServer):
         Returns the path and name for this dataset.
         """
         session = self.getSession(c)
-        dataset = session.openDataset(name)
-        c['dataset'] = dataset.name # not the same as name; has number prefixed
-        c['datasetObj'] = dataset
-        c['filepos'] = 0
-        c['commentpos'] = 0
+        return workers.then(session.openDataset(name), self._opened, c, append)
+
+    def _opened(self, dataset, c, append):
+        self.setDataset(c, dataset)
         c['writing'] = append
         key = self.contextKey(c)
-        dataset.keepStreaming(key, 0)
-        dataset.keepStreamingComments(key, 0)
-        return c['path'], c['dataset']
+        result = workers.gather([dataset.keepStreaming(key, 0),
+                                 dataset.keepStreamingComments(key, 0)])
+        return workers.then(result, lambda _: (c['path'], c['dataset']))
 
     @setting(1010, returns='s')
     def get_version(self, c):
@@ -255,8 +307,9 @@ class DataVault(LabradServer):
         data = np.atleast_2d(np.asarray(data))
         # fromarrays is faster than fromrecords, and when we have a simple 2-D array
         # we can just transpose the array.
-        rec_data = np.core.records.fromarrays(data.T, dtype=dataset.data.dtype)
-        dataset.addData(rec_data)
+        rec_data = np.core.records.fromarrays(data.T, dtype=dataset.dtype)
+        stats.count_rows(c, len(rec_data))
+        return dataset.addData(rec_data)
 
     @setting(1020, data='?', returns='')
     def add_ex(self, c, data):
@@ -273,7 +326,8 @@ class DataVault(LabradServer):
         if not c['writing']:
             raise errors.ReadOnlyError()
         list_data = [tuple(row) for row in data]
-        dataset.addData(np.core.records.fromrecords(list_data, dtype=dataset.data.dtype))
+        stats.count_rows(c, len(list_data))
+        return dataset.addData(np.core.records.fromrecords(list_data, dtype=dataset.dtype))
 
     @setting(2020, data='?', returns='')
     def add_ex_t(self, c, data):
@@ -286,7 +340,131 @@ class DataVault(LabradServer):
         dataset = self.getDataset(c)
         if not c['writing']:
             raise errors.ReadOnlyError()
-        dataset.addData(np.core.records.fromarrays(data, dtype=dataset.data.dtype))
+        rec_data = np.core.records.fromarrays(data, dtype=dataset.dtype)
+        stats.count_rows(c, len(rec_data))
+        return dataset.addData(rec_data)
+
+    @setting(30, 'buffer writes', max_rows='w', max_age='v', returns='')
+    def buffer_writes(self, c, max_rows, max_age=1.0):
+        """Buffer rows added to the current dataset in memory.
+
+        Added rows are kept in memory and written to disk in one batch once
+        max_rows rows have accumulated or the oldest buffered row is max_age
+        seconds old.  Buffered rows are returned by get immediately.  This
+        applies to all contexts writing to the dataset.  Set max_rows to zero
+        to write every add straight to disk again (the default).
+        """
+        dataset = self.getDataset(c)
+        dataset.setBuffering(max_rows, max_age)
+
+    @setting(31, 'notify interval', interval='v', max_rows='w', returns='')
+    def notify_interval(self, c, interval, max_rows=0):
+        """Limit how often notifications of added data are sent.
+
+        For the current dataset, 'data available' and 'data count' messages
+        are sent at most once every interval seconds, however often rows
+        are added.  The 'data count' message, sent to every context that has
+        the dataset open, holds the total number of rows, and the rows added
+        since the previous message if there are at most max_rows of them
+        (up to 1000, and only if all columns hold scalar numbers); otherwise
+        the list of rows is empty.  This applies to all contexts using the
+        dataset.  An interval of zero sends every notification straight away
+        (the default).
+        """
+        dataset = self.getDataset(c)
+        dataset.setNotify(interval, max_rows)
+
+    @setting(40, 'file pool', max_open='w',
+             returns='(w{max open}, w{open}, w{hits}, w{misses}, w{evictions})')
+    def file_pool(self, c, max_open=None):
+        """Get statistics about the pool of open dataset files.
+
+        Returns the most files that may be open at once, the number open now,
+        and counts of file uses that found the file already open (hits), that
+        had to open it (misses), and of files closed to stay within the limit
+        (evictions).  If max_open is given, the limit is changed first.
+        """
+        pool = backend.file_pool()
+        if max_open is not None:
+            if max_open < 1:
+                raise errors.FilePoolSizeError(max_open)
+            pool.max_open = max_open
+            pool.shrink()
+        return (pool.max_open, len(pool), pool.hits, pool.misses, pool.evictions)
+
+    @setting(41, 'object cache', sessions='w', datasets='w',
+             returns='(w{max sessions}, w{sessions}, w{session hits}, '
+                     'w{session misses}, w{max datasets}, w{datasets}, '
+                     'w{dataset hits}, w{dataset misses})')
+    def object_cache(self, c, sessions=None, datasets=None):
+        """Get statistics about the directories and datasets kept in memory.
+
+        The most recently used directory sessions and datasets are kept in
+        memory even when no context is using them, so that going back to
+        them does not mean reading their metadata from disk again.  For
+        each, returns the most that are kept, the number kept now, and
+        counts of lookups that found one in memory (hits) and that had to
+        load it (misses).  If sessions or datasets is given, that limit is
+        changed first.
+        """
+        store = self.session_store
+        if sessions is not None:
+            store.recent_sessions.resize(sessions)
+        if datasets is not None:
+            store.recent_datasets.resize(datasets)
+        result = ()
+        for recent in store.recent_sessions, store.recent_datasets:
+            result += (recent.capacity, len(recent), recent.hits, recent.misses)
+        return result
+
+    @setting(42, 'stats', reset='b',
+             returns='(*v{latency buckets [ms]}, '
+                     '*(s{setting}, w{calls}, w{errors}, v{seconds}, '
+                     'v{max seconds}, *w{latency histogram}, w{rows}, '
+                     'w{bytes in}, w{bytes out}){settings}, '
+                     '*(w{client}, w{calls}, w{errors}, v{seconds}, w{rows}, '
+                     'w{bytes in}, w{bytes out}){clients}, '
+                     '*((ww){context}, w{calls}, w{errors}, v{seconds}, w{rows}, '
+                     'w{bytes in}, w{bytes out}){contexts})')
+    def get_stats(self, c, reset=False):
+        """Get statistics about the settings called on this server.
+
+        For each setting, returns the number of calls and of those that
+        failed, the total and the longest time taken, how many calls took
+        each range of time (the first holds calls up to the first of the
+        latency buckets, the last those over the last bucket), the rows
+        added or read and the bytes received and, roughly, sent.  Then the
+        same totals, without the latencies, for each client connection and
+        each open context.  Time is counted from the request arriving until
+        its result is ready.  If reset is set the statistics are cleared
+        after being returned.
+        """
+        result = (
+            list(stats.LATENCY_BUCKETS),
+            [(name, t.calls, t.errors, t.seconds, t.max_seconds, t.histogram,
+              t.rows, t.bytes_in, t.bytes_out)
+             for name, t in self.stats.settings.items()],
+            [(source,) + t.values() for source, t in self.stats.clients.items()],
+            [(ID,) + t.values() for ID, t in sorted(self.stats.contexts.items())],
+        )
+        if reset:
+            self.stats.reset()
+        return result
+
+    @setting(43, 'dump stats', interval='v', path='*s', returns='')
+    def dump_stats(self, c, interval, path=['', 'Data Vault Stats']):
+        """Save the setting statistics to a dataset every interval seconds.
+
+        A new dataset is made in the directory path (created if needed),
+        and each dump appends a row for each setting called since the last
+        one, with the calls, errors, time, rows and bytes in and out since
+        then.  An interval of 0 stops saving them.
+        """
+        if not interval:
+            self.stats.stopDumping()
+            return
+        session = self.session_store.get(path)
+        self.stats.dumpEvery(interval, session, self.session_store.storage)
 
     @setting(21, limit='w', startOver='b', returns='*2v')
     def get(self, c, limit=None, startOver=False):
@@ -300,10 +478,148 @@ class DataVault(LabradServer):
         """
         dataset = self.getDataset(c)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], simpleOnly=True)
-        key = self.contextKey(c)
-        dataset.keepStreaming(key, c['filepos'])
-        return data
+        result = dataset.getData(limit, c['filepos'], simpleOnly=True)
+        return workers.then(result, self._streamData, c, dataset)
+
+    @setting(22, 'get decimated', x_col='w', n_buckets='w', start='w',
+                 stop='w', returns='*2v')
+    def get_decimated(self, c, x_col, n_buckets, start=0, stop=None):
+        """Get a reduced view of rows [start, stop) of the current dataset.
+
+        Meant for plotting: the rows are split into n_buckets equal runs and
+        each run becomes two rows, the first holding the minimum and the
+        second the maximum of every column.  Column x_col instead holds the
+        values from the first and last row of the run.  Ranges of at most
+        2*n_buckets rows are returned unchanged.  By default the whole
+        dataset is used.  All columns must hold scalar numbers, and are
+        returned as floats.
+
+        This does not affect the position used by get or data notifications.
+        """
+        dataset = self.getDataset(c)
+        return dataset.getDecimated(x_col, n_buckets, start, stop)
+
+    @setting(25, 'query', column='w', lo='v', hi='v', limit='w', start='w',
+                 returns='(w*2v)')
+    def query(self, c, column, lo, hi, limit=None, start=0):
+        """Find rows of the current dataset with lo <= value of column <= hi.
+
+        Returns (next, rows): up to limit matching rows at or after row
+        start, and the row from which to repeat the query to get the rest;
+        next equals the number of rows once every match has been returned.
+        By default all matching rows are returned.  Blocks of rows whose
+        minimum and maximum rule out a match are not read, and on columns
+        whose values never decrease (such as timestamps) the matching rows
+        are found by binary search.  All columns must hold scalar numbers,
+        and are returned as floats.
+
+        This does not affect the position used by get or data notifications.
+        """
+        dataset = self.getDataset(c)
+        result = dataset.query(column, lo, hi, limit, start)
+        result = workers.then(result, lambda result: (result[1], result[0]))
+        return workers.then(result, self._countRead, c, lambda result: result[1])
+
+    @setting(23, 'get range', start='w', stop='w', columns='*w', step='w',
+                 returns='*2v')
+    def get_range(self, c, start, stop=None, columns=[], step=1):
+        """Get rows [start, stop) of the current dataset.
+
+        Only the columns with the given indices are returned, or all of them
+        if columns is empty.  With step > 1 only every step'th row is
+        returned.  By default rows are returned up to the end of the dataset.
+        The selected columns must all hold floats.
+
+        Unlike get, this reads at any position and does not affect the
+        position used by get or data notifications.
+        """
+        dataset = self.getDataset(c)
+        result = dataset.getRange(start, stop, step, columns)
+        return workers.then(result, self._countRead, c)
+
+    @setting(2023, 'get range ex t', start='w', stop='w', columns='*w',
+                   step='w', returns='?')
+    def get_range_ex_t(self, c, start, stop=None, columns=[], step=1):
+        """Get rows [start, stop) of the current dataset in the extended format.
+
+        Like get range, but returns a cluster with a list for each selected
+        column, as get_ex_t does.  Columns can hold any type.
+        """
+        dataset = self.getDataset(c)
+        result = dataset.getRange(start, stop, step, columns, transpose=True)
+        return workers.then(result, self._countRead, c, lambda data: data[0])
+
+    @setting(2024, 'grid shape', returns='*w')
+    def grid_shape(self, c):
+        """Get the number of points along each axis of a gridded dataset."""
+        dataset = self.getDataset(c)
+        return list(dataset.gridShape())
+
+    @setting(2025, 'set axis', axis='w', values='*v', returns='')
+    def set_axis(self, c, axis, values):
+        """Set the coordinates of the points along an axis of a gridded dataset.
+
+        Coordinates are in the units of that independent.  Until they are
+        set, the coordinates are the point indices 0, 1, 2...
+        """
+        dataset = self.getDataset(c)
+        return dataset.setAxis(axis, values)
+
+    @setting(2026, 'get axis', axis='w', returns='*v')
+    def get_axis(self, c, axis):
+        """Get the coordinates of the points along an axis of a gridded dataset."""
+        dataset = self.getDataset(c)
+        return dataset.getAxis(axis)
+
+    @setting(2027, 'add slab', start='*w', data='?', returns='')
+    def add_slab(self, c, start, data):
+        """Write a rectangular slab of points in a gridded dataset.
+
+        start is the index of the first corner of the slab, with an entry
+        for each axis.  data is a cluster with an array for each dependent;
+        their leading dimensions give the shape of the slab.  To write one
+        point, send arrays with a length of 1 along each axis.  Points can
+        be written in any order and rewritten.
+        """
+        dataset = self.getDataset(c)
+        if not isinstance(data, tuple):
+            data = (data,)
+        return dataset.addSlab(list(start), data)
+
+    @setting(2028, 'get slab', start='*w', stop='*w', returns='?')
+    def get_slab(self, c, start, stop):
+        """Get the points of a gridded dataset in [start, stop) along each axis.
+
+        Returns a cluster with an array for each dependent and, last, a
+        boolean array that is true for the points that have been written.
+        Points not written yet are NaN in float and complex dependents.
+        """
+        dataset = self.getDataset(c)
+        result = dataset.getSlab(list(start), list(stop))
+        return workers.then(result, self._streamSlab, c, dataset)
+
+    @setting(2029, 'get slice', axis='w', index='w', returns='?')
+    def get_slice(self, c, axis, index):
+        """Get the plane of points at index along axis of a gridded dataset.
+
+        Like get slab, but the arrays have one dimension less.  For a 2-D
+        grid this is a single line, for a 3-D grid an image.
+        """
+        dataset = self.getDataset(c)
+        result = dataset.getSlice(axis, index)
+        return workers.then(result, self._streamSlab, c, dataset)
+
+    def _streamSlab(self, result, c, dataset):
+        """Ask for a notification when the grid changes, and return the data."""
+        deps, filled = result
+        streaming = dataset.keepStreaming(self.contextKey(c), 0)
+        return workers.then(streaming, lambda _: tuple(deps) + (filled,))
+
+    @setting(24, 'row count', returns='w')
+    def row_count(self, c):
+        """Get the number of rows in the current dataset."""
+        dataset = self.getDataset(c)
+        return dataset.rowCount('row count')
 
     @setting(1021, limit='w', startOver='b', returns='?')
     def get_ex(self, c, limit=None, startOver=False):
@@ -316,10 +632,8 @@ class DataVault(LabradServer):
         """
         dataset = self.getDataset(c)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], transpose=False)
-        ctx = self.contextKey(c)
-        dataset.keepStreaming(ctx, c['filepos'])
-        return data
+        result = dataset.getData(limit, c['filepos'], transpose=False)
+        return workers.then(result, self._streamData, c, dataset)
 
     @setting(2021, limit='w', startOver='b', returns='?')
     def get_ex_t(self, c, limit=None, startOver=False):
@@ -334,10 +648,21 @@ class DataVault(LabradServer):
         """
         dataset = self.getDataset(c)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], transpose=True)
-        ctx = self.contextKey(c)
-        dataset.keepStreaming(ctx, c['filepos'])
-        return data
+        result = dataset.getData(limit, c['filepos'], transpose=True)
+        return workers.then(result, self._streamData, c, dataset)
+
+    def _countRead(self, result, c, rows=lambda data: data):
+        """Count the rows read by this request, for the stats."""
+        stats.count_rows(c, len(rows(result)))
+        return result
+
+    def _streamData(self, result, c, dataset):
+        """Update the read position after a get, and return the data."""
+        data, pos = result
+        stats.count_rows(c, pos - c['filepos'])
+        c['filepos'] = pos
+        streaming = dataset.keepStreaming(self.contextKey(c), c['filepos'])
+        return workers.then(streaming, lambda _: data)
 
     @setting(100, returns='(*(ss){independents}, *(sss){dependents})')
     def variables(self, c):
@@ -398,13 +723,13 @@ class DataVault(LabradServer):
     def add_parameter(self, c, name, data):
         """Add a new parameter to the current dataset."""
         dataset = self.getDataset(c)
-        dataset.addParameter(name, data)
+        return dataset.addParameters([(name, data)])
 
     @setting(124, 'add parameters', params='?{((s?)(s?)...)}', returns='')
     def add_parameters(self, c, params):
         """Add a new parameter to the current dataset."""
         dataset = self.getDataset(c)
-        dataset.addParameters(params)
+        return dataset.addParameters(params)
 
 
     @setting(126, 'get name', returns='s')
@@ -429,12 +754,13 @@ class DataVault(LabradServer):
         are not allowed).
         """
         dataset = self.getDataset(c)
-        names = dataset.getParamNames()
-        params = tuple((name, dataset.getParameter(name)) for name in names)
         key = self.contextKey(c)
         dataset.param_listeners.add(key) # send a message when new parameters are added
+        return workers.then(dataset.getParameters(), self._parameters)
+
+    def _parameters(self, params):
         if len(params):
-            return params
+            return tuple(params)
 
     @setting(200, 'add comment', comment=['s'], user=['s'], returns=[''])
     def add_comment(self, c, comment, user='anonymous'):
@@ -448,10 +774,114 @@ class DataVault(LabradServer):
         """Get comments for the current dataset."""
         dataset = self.getDataset(c)
         c['commentpos'] = 0 if startOver else c['commentpos']
-        comments, c['commentpos'] = dataset.getComments(limit, c['commentpos'])
-        key = self.contextKey(c)
-        dataset.keepStreamingComments(key, c['commentpos'])
-        return comments
+        result = dataset.getComments(limit, c['commentpos'])
+        return workers.then(result, self._streamComments, c, dataset)
+
+    def _streamComments(self, result, c, dataset):
+        comments, c['commentpos'] = result
+        result = dataset.keepStreamingComments(self.contextKey(c), c['commentpos'])
+        return workers.then(result, lambda _: comments)
+
+    @setting(60, 'get many', items=['*(*sw)', '*(*ss)'], fields=['s', '*s'],
+                 returns='?')
+    def get_many(self, c, items, fields=('data', 'parameters')):
+        """Read several datasets in one request.
+
+        items is a list of (path, name or number).  Paths starting with ''
+        are absolute, others are relative to the current directory.  fields
+        chooses what to read from each dataset: 'data' (all of the rows, in
+        the get_ex_t format for extended datasets and as a 2-D array for
+        simple ones), 'parameters' (as from get parameters) and 'comments'.
+        The datasets are read concurrently when the server does its file I/O
+        in worker threads.
+
+        Returns a cluster with one entry per item: its path, name and an
+        error message, followed by the requested fields in order.  The error
+        message is '' for items that were read; failed items have no fields,
+        and do not fail the rest of the batch.  The current dataset of this
+        context is left alone.  items must not be empty, since an empty
+        cluster can't be sent.
+        """
+        if not items:
+            raise errors.NoItemsError()
+        if isinstance(fields, str):
+            fields = [fields]
+        for field in fields:
+            if field not in ('data', 'parameters', 'comments'):
+                raise errors.BadFieldError(field)
+        results = []
+        for path, name in items:
+            path = self._itemPath(c, path)
+            try:
+                result = self._readItem(path, name, fields)
+            except Exception as e:
+                result = self._itemError(path, name, e)
+            else:
+                if isinstance(result, defer.Deferred):
+                    result.addErrback(lambda failure, path=path, name=name:
+                                      self._itemError(path, name, failure.value))
+            results.append(result)
+        return workers.then(workers.gather(results), tuple)
+
+    def _itemPath(self, c, path):
+        path = list(path)
+        if path and path[0] == '':
+            return path
+        return c['path'] + [segment for segment in path if segment]
+
+    def _readItem(self, path, name, fields):
+        if not self.session_store.exists(path):
+            raise errors.DirectoryNotFoundError(path)
+        dataset = self.session_store.get(path).openDataset(name)
+        return workers.then(dataset, self._readFields, path, fields)
+
+    def _readFields(self, dataset, path, fields):
+        reads = []
+        for field in fields:
+            if field == 'data':
+                # simple datasets only come as a 2-D array, as from get
+                result = dataset.getData(None, 0, transpose=dataset.extended)
+                reads.append(workers.then(result, lambda result: result[0]))
+            elif field == 'parameters':
+                reads.append(workers.then(dataset.getParameters(), tuple))
+            else:
+                result = dataset.getComments(None, 0)
+                reads.append(workers.then(result, lambda result: result[0]))
+        return workers.then(workers.gather(reads),
+                            lambda values: (path, dataset.name, '') + tuple(values))
+
+    def _itemError(self, path, name, e):
+        if isinstance(e, T.Error):
+            message = e.msg
+        else:
+            message = '{0}: {1}'.format(type(e).__name__, e)
+        return (path, str(name), message)
+
+    @setting(50, 'search', regex='s', tags=['s', '*s'], after='t', before='t',
+                 params='*(svv)', limit='w', returns='*(*s{path}, s{name})')
+    def search(self, c, regex='', tags=[], after=None, before=None, params=[],
+               limit=None):
+        """Find datasets in the current directory and its subdirectories.
+
+        regex is searched for in the dataset names (so '' matches every
+        dataset).  Datasets must have all of the given tags, except for tags
+        starting with '-', which they must not have.  after and before limit
+        the creation time, and params is a list of (name, low, high) ranges
+        that numeric parameters must lie in, in the units they were saved
+        with.  Returns the path and name of each dataset found, oldest
+        first, up to limit of them.
+        """
+        dataset_catalog = self.session_store.catalog
+        if dataset_catalog is None or dataset_catalog.building:
+            raise errors.NoCatalogError()
+        if isinstance(tags, str):
+            tags = [tags]
+        if after is not None:
+            after = catalog.timestamp(after)
+        if before is not None:
+            before = catalog.timestamp(before)
+        return dataset_catalog.search(
+                c['path'], regex, tags, after, before, params, limit)
 
     @setting(300, 'update tags', tags=['s', '*s'],
                   dirs=['s', '*s'], datasets=['s', '*s'],
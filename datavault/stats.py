@@ -0,0 +1,217 @@
+"""Per-setting statistics for the Data Vault server.
+
+When the Data Vault is slow, these show which settings and which clients
+it is spending its time on.  Each setting is wrapped in a TimedSetting
+when it is registered, which records for every call:
+
+- the time from the request arriving until its result is ready, which
+  includes any wait for the I/O worker threads, in a histogram with
+  LATENCY_BUCKETS (in milliseconds),
+- the size of the request and an estimate of the size of the result,
+- the rows added or read, which the settings that move rows report with
+  count_rows, and
+- whether it failed.
+
+The counts are kept per setting, per client connection and per context.
+A call costs a couple of clock reads and dict updates, so the statistics
+are always on.  They can be appended to a dataset every so often (see
+ServerStats.dumpEvery) to keep a history.
+"""
+
+from __future__ import absolute_import
+
+import bisect
+import collections
+import time
+
+import numpy as np
+from twisted.internet import defer, reactor, task
+from twisted.python import failure
+
+from . import util
+
+LATENCY_BUCKETS = (0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000, 3000, 10000)
+PAYLOAD_SAMPLE = 16 # longer lists are sized from their first element
+STATS_CLIENTS = 1000 # most client connections to keep totals for
+ROWS_KEY = '_stats rows' # context key collecting the rows of a request
+
+STATS_INDEPENDENTS = [('time', [1], 'v', 's'), ('setting', [1], 's', '')]
+STATS_DEPENDENTS = [('calls', 'calls', [1], 'v', ''),
+                    ('errors', 'errors', [1], 'v', ''),
+                    ('time', 'busy', [1], 'v', 's'),
+                    ('rows', 'rows', [1], 'v', ''),
+                    ('bytes', 'in', [1], 'v', ''),
+                    ('bytes', 'out', [1], 'v', '')]
+
+
+def count_rows(c, rows):
+    """Add to the rows moved by the request being handled in context c."""
+    c[ROWS_KEY] = c.get(ROWS_KEY, 0) + rows
+
+
+def payload_bytes(value):
+    """Estimate the flattened size of a setting result, cheaply."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, basestring):
+        return 4 + len(value)
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return 4
+        if len(value) > PAYLOAD_SAMPLE:
+            return 4 + len(value) * payload_bytes(value[0])
+        return 4 + sum(payload_bytes(item) for item in value)
+    return 8
+
+
+class Totals(object):
+    """Calls, time, rows and bytes of the requests from one source."""
+    __slots__ = ('calls', 'errors', 'seconds', 'rows', 'bytes_in', 'bytes_out')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def add(self, seconds, rows, bytes_in, bytes_out, failed):
+        self.calls += 1
+        self.errors += failed
+        self.seconds += seconds
+        self.rows += rows
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+
+    def values(self):
+        return (self.calls, self.errors, self.seconds, self.rows,
+                self.bytes_in, self.bytes_out)
+
+
+class SettingTotals(Totals):
+    """Totals of one setting, with the latency histogram."""
+    __slots__ = ('max_seconds', 'histogram')
+
+    def __init__(self):
+        Totals.__init__(self)
+        self.max_seconds = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, seconds, rows, bytes_in, bytes_out, failed):
+        Totals.add(self, seconds, rows, bytes_in, bytes_out, failed)
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds * 1e3)] += 1
+
+
+class ServerStats(object):
+    """Collects the statistics of the settings of one server."""
+    def __init__(self, reactor=reactor):
+        self.reactor = reactor
+        self._dumpCall = None
+        self.reset()
+
+    def reset(self):
+        self.settings = collections.OrderedDict() # by setting name
+        self.clients = util.LRUCache(STATS_CLIENTS)
+        self.contexts = {}
+        self._dumped = {} # setting totals at the last dump
+
+    def wrap(self, setting):
+        """Wrap a setting so that its calls are recorded here."""
+        return TimedSetting(setting, self)
+
+    def record(self, name, c, seconds, bytes_in, result):
+        failed = isinstance(result, (Exception, failure.Failure))
+        bytes_out = 0 if failed else payload_bytes(result)
+        rows = c.pop(ROWS_KEY, 0)
+        totals = self.settings.get(name)
+        if totals is None:
+            totals = self.settings[name] = SettingTotals()
+        totals.add(seconds, rows, bytes_in, bytes_out, failed)
+        source = getattr(c, 'source', None)
+        if source is not None:
+            totals = self.clients.get(source)
+            if totals is None:
+                totals = self.clients[source] = Totals()
+            totals.add(seconds, rows, bytes_in, bytes_out, failed)
+        ID = getattr(c, 'ID', None)
+        if ID is not None:
+            totals = self.contexts.get(ID)
+            if totals is None:
+                totals = self.contexts[ID] = Totals()
+            totals.add(seconds, rows, bytes_in, bytes_out, failed)
+
+    def forgetContext(self, c):
+        self.contexts.pop(getattr(c, 'ID', None), None)
+
+    def dumpEvery(self, interval, session, storage):
+        """Append the statistics to a new dataset in session every interval.
+
+        Each dump adds a row for each setting called since the last dump,
+        with the time and the counts since then.
+        """
+        self.stopDumping()
+        self._dumped = dict((name, totals.values())
+                            for name, totals in self.settings.items())
+        self._dumpSession = session
+        self._dumpStorage = storage
+        self._dumpDataset = None
+        self._dumpCall = task.LoopingCall(self.dump)
+        self._dumpCall.clock = self.reactor
+        self._dumpCall.start(interval, now=False)
+
+    def stopDumping(self):
+        if self._dumpCall is not None:
+            self._dumpCall.stop()
+            self._dumpCall = None
+
+    def dump(self):
+        now = time.time()
+        rows = []
+        for name, totals in self.settings.items():
+            values = totals.values()
+            last = self._dumped.get(name, (0,) * len(values))
+            if values[0] > last[0]:
+                rows.append((now, name) +
+                            tuple(float(v - l) for v, l in zip(values, last)))
+            self._dumped[name] = values
+        if not rows:
+            return
+        if self._dumpDataset is None:
+            self._dumpDataset = self._dumpSession.newDataset(
+                    'Data Vault stats', STATS_INDEPENDENTS, STATS_DEPENDENTS,
+                    extended=True, storage=self._dumpStorage)
+        dataset = self._dumpDataset
+        dataset.addData(np.core.records.fromrecords(rows, dtype=dataset.dtype))
+
+
+class TimedSetting(object):
+    """A setting that records each call in a ServerStats.
+
+    Everything else is passed through to the wrapped setting.
+    """
+    def __init__(self, setting, stats):
+        self._setting = setting
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._setting, name)
+
+    def handleRequest(self, server, c, flat_data):
+        start = time.time()
+        bytes_in = len(flat_data.bytes)
+        c[ROWS_KEY] = 0
+        try:
+            result = self._setting.handleRequest(server, c, flat_data)
+        except Exception as e:
+            self._done(e, c, start, bytes_in)
+            raise
+        if isinstance(result, defer.Deferred):
+            return result.addBoth(self._done, c, start, bytes_in)
+        return self._done(result, c, start, bytes_in)
+
+    def _done(self, result, c, start, bytes_in):
+        self._stats.record(self._setting.name, c, time.time() - start,
+                           bytes_in, result)
+        return result
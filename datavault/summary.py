@@ -0,0 +1,233 @@
+"""Per-block summaries of dataset columns.
+
+Plots and queries over long datasets only need a coarse view of most of the
+data.  A BlockSummary keeps the minimum, maximum, first and last value of
+every column for each block of SUMMARY_BLOCK_ROWS rows, so that those
+requests can be answered from the summaries plus a few rows at the edges
+instead of reading the whole dataset.  Queries for rows with values in a
+given range skip every block whose minimum and maximum rule it out, and on
+columns that never decrease (timestamps, say) they become binary searches.
+"""
+
+import numpy as np
+
+from . import errors
+
+SUMMARY_BLOCK_ROWS = 1024 # rows summarized by each block
+QUERY_READ_BLOCKS = 64 # most blocks to read at once when scanning
+
+
+def numeric_columns(rows, setting):
+    """Convert struct array rows to a 2-D float array.
+
+    Only datasets whose columns are all scalar integers or reals can be
+    summarized; for others UnsupportedDatasetError is raised, naming setting.
+    """
+    columns = []
+    for name in rows.dtype.names:
+        col = rows[name]
+        if col.ndim != 1 or col.dtype.kind not in 'iuf':
+            raise errors.UnsupportedDatasetError(setting)
+        columns.append(col)
+    if not columns:
+        return np.zeros((len(rows), 0))
+    return np.column_stack(columns).astype(float)
+
+
+class BlockSummary(object):
+    """Minimum, maximum, first and last value of each column per block.
+
+    Complete blocks never change; the summary of the last block is updated
+    as rows are appended.  NaNs are ignored by the minimum and maximum.
+    increasing records which columns have never decreased so far.
+    """
+    def __init__(self, cols, block_rows=SUMMARY_BLOCK_ROWS):
+        self.cols = cols
+        self.block_rows = block_rows
+        self.rows = 0
+        self.blocks = 0
+        self.increasing = np.ones(cols, dtype=bool)
+        self._mins = np.empty((0, cols))
+        self._maxs = np.empty((0, cols))
+        self._firsts = np.empty((0, cols))
+        self._lasts = np.empty((0, cols))
+
+    @property
+    def mins(self):
+        return self._mins[:self.blocks]
+
+    @property
+    def maxs(self):
+        return self._maxs[:self.blocks]
+
+    @property
+    def firsts(self):
+        return self._firsts[:self.blocks]
+
+    @property
+    def lasts(self):
+        return self._lasts[:self.blocks]
+
+    def _reserve(self, blocks):
+        """Make room for at least blocks blocks, growing geometrically."""
+        capacity = len(self._mins)
+        if blocks <= capacity:
+            return
+        capacity = max(blocks, 2 * capacity, 16)
+        for name in ['_mins', '_maxs', '_firsts', '_lasts']:
+            old = getattr(self, name)
+            new = np.empty((capacity, self.cols))
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add(self, values):
+        """Add appended rows, given as a 2-D float array."""
+        if len(values):
+            with np.errstate(invalid='ignore'): # NaNs are not increasing
+                self.increasing &= np.all(np.diff(values, axis=0) >= 0, axis=0)
+                if self.blocks:
+                    self.increasing &= values[0] >= self._lasts[self.blocks - 1]
+        B = self.block_rows
+        pos = 0
+        offset = self.rows % B
+        if offset and len(values):
+            # finish off the partial last block
+            chunk = values[:B - offset]
+            i = self.blocks - 1
+            self._mins[i] = np.fmin(self._mins[i], np.fmin.reduce(chunk, axis=0))
+            self._maxs[i] = np.fmax(self._maxs[i], np.fmax.reduce(chunk, axis=0))
+            self._lasts[i] = chunk[-1]
+            pos = len(chunk)
+        rest = values[pos:]
+        if len(rest):
+            n = -(-len(rest) // B)
+            self._reserve(self.blocks + n)
+            full = len(rest) // B
+            i = self.blocks
+            if full:
+                blocks = rest[:full * B].reshape((full, B, self.cols))
+                self._mins[i:i+full] = np.fmin.reduce(blocks, axis=1)
+                self._maxs[i:i+full] = np.fmax.reduce(blocks, axis=1)
+                self._firsts[i:i+full] = blocks[:, 0]
+                self._lasts[i:i+full] = blocks[:, -1]
+            if n > full:
+                tail = rest[full * B:]
+                self._mins[i+full] = np.fmin.reduce(tail, axis=0)
+                self._maxs[i+full] = np.fmax.reduce(tail, axis=0)
+                self._firsts[i+full] = tail[0]
+                self._lasts[i+full] = tail[-1]
+            self.blocks += n
+        self.rows += len(values)
+
+    def decimate(self, read, x_col, n_buckets, start, stop):
+        """Get a min/max envelope of rows [start, stop) in n_buckets buckets.
+
+        read(start, stop) must return the given rows as a 2-D float array.
+        The rows are split into n_buckets equal runs, and each is reduced to
+        two rows: the first holds the minimum of every column and the second
+        the maximum, except that column x_col holds the x value of the first
+        and last row of the bucket.  When buckets are at least two blocks
+        long their edges are moved to the nearest block boundary, so they
+        can be computed from the summaries.  Ranges with no more than
+        2*n_buckets rows are returned as they are.
+        """
+        rows = stop - start
+        if rows <= 2 * n_buckets:
+            return read(start, stop)
+        edges = start + (np.arange(n_buckets + 1) * rows) // n_buckets
+        B = self.block_rows
+        if rows // n_buckets < 2 * B:
+            # buckets are too small for the block summaries to help
+            values = read(start, stop)
+            first_idx = edges[:-1] - start
+            mins = np.fmin.reduceat(values, first_idx)
+            maxs = np.fmax.reduceat(values, first_idx)
+            firsts = values[first_idx]
+            lasts = values[edges[1:] - start - 1]
+        else:
+            # whole blocks come from the summary, the ragged ends from the
+            # file, and bucket edges are moved to the nearest block boundary
+            edges[1:-1] = (edges[1:-1] + B // 2) // B * B
+            b0 = -(-start // B)
+            b1 = stop // B
+            head = read(start, b0 * B)
+            tail = read(b1 * B, stop)
+            unit_starts = np.concatenate((np.arange(start, b0 * B),
+                                          np.arange(b0, b1) * B,
+                                          np.arange(b1 * B, stop)))
+            unit_mins = np.concatenate((head, self.mins[b0:b1], tail))
+            unit_maxs = np.concatenate((head, self.maxs[b0:b1], tail))
+            unit_firsts = np.concatenate((head, self.firsts[b0:b1], tail))
+            unit_lasts = np.concatenate((head, self.lasts[b0:b1], tail))
+            # buckets still span at least one block, so none of them is empty
+            bucket = np.searchsorted(edges, unit_starts, side='right') - 1
+            first_idx = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+            last_idx = np.concatenate((first_idx[1:], [len(bucket)])) - 1
+            mins = np.fmin.reduceat(unit_mins, first_idx)
+            maxs = np.fmax.reduceat(unit_maxs, first_idx)
+            firsts = unit_firsts[first_idx]
+            lasts = unit_lasts[last_idx]
+        envelope = np.empty((2 * n_buckets, self.cols))
+        envelope[0::2] = mins
+        envelope[1::2] = maxs
+        envelope[0::2, x_col] = firsts[:, x_col]
+        envelope[1::2, x_col] = lasts[:, x_col]
+        return envelope
+
+    def _bound(self, read, col, value, side):
+        """First row whose value in col is >= value ('left') or > value ('right').
+
+        Only valid for columns that never decrease.
+        """
+        b = np.searchsorted(self.lasts[:, col], value, side=side)
+        if b == self.blocks:
+            return self.rows
+        start = b * self.block_rows
+        block = read(start, min(start + self.block_rows, self.rows))
+        return start + int(np.searchsorted(block[:, col], value, side=side))
+
+    def query(self, read, col, lo, hi, limit, start):
+        """Find rows from start on where lo <= value of col <= hi.
+
+        read(start, stop) must return the given rows as a 2-D float array.
+        Returns up to limit matching rows (all if limit is None) and the row
+        after the last one looked at, where a later query can carry on.
+        """
+        B = self.block_rows
+        if limit is None:
+            limit = self.rows
+        if self.increasing[col]:
+            first = max(start, self._bound(read, col, lo, 'left'))
+            end = self._bound(read, col, hi, 'right')
+            stop = max(first, min(end, first + limit))
+            if stop < end or not limit:
+                return read(first, stop), stop
+            # no row from end on can match, so the query is done
+            return read(first, stop), self.rows
+
+        # skip the blocks whose range rules them out
+        found = []
+        count = 0
+        candidates = np.flatnonzero((self.maxs[:, col] >= lo) &
+                                    (self.mins[:, col] <= hi))
+        candidates = candidates[candidates >= start // B]
+        runs = np.split(candidates, np.flatnonzero(np.diff(candidates) != 1) + 1)
+        for run in runs:
+            for i in xrange(0, len(run), QUERY_READ_BLOCKS):
+                blocks = run[i:i + QUERY_READ_BLOCKS]
+                a = max(blocks[0] * B, start)
+                b = min((blocks[-1] + 1) * B, self.rows)
+                values = read(a, b)
+                with np.errstate(invalid='ignore'):
+                    match = np.flatnonzero((values[:, col] >= lo) &
+                                           (values[:, col] <= hi))
+                if count + len(match) >= limit:
+                    match = match[:limit - count]
+                    found.append(values[match])
+                    next_row = a + match[-1] + 1 if len(match) else a
+                    return np.concatenate(found), next_row
+                found.append(values[match])
+                count += len(match)
+        if not found:
+            return np.zeros((0, self.cols)), self.rows
+        return np.concatenate(found), self.rows
@@ -1,5 +1,6 @@
 import datetime
 import h5py
+import mock
 import numpy as np
 import os
 import pytest
@@ -14,7 +15,7 @@ from labrad import units as U
 
 from twisted.internet import task
 
-from datavault import backend, errors
+from datavault import backend, errors, util
 
 
 def _unique_filename(suffix='.hdf5'):
@@ -69,6 +70,85 @@ class UtilityMethodsTest(_TestCase):
         self.assertRaises(
                 ValueError, backend.labrad_urldecode, url_string)
 
+    def test_parse_storage(self):
+        storage = backend.parse_storage('shuffle+gzip:4', 512)
+        self.assertEqual(storage, backend.StorageOptions(
+                chunk_rows=512, compression='gzip', compression_opts=4,
+                shuffle=True, layout='rows'))
+        self.assertEqual(backend.parse_storage('lzf').compression, 'lzf')
+        self.assertEqual(backend.parse_storage(), backend.DEFAULT_STORAGE)
+        # Empty arguments keep the defaults, 'none' turns them off.
+        self.assertEqual(backend.parse_storage('', 0, default=storage), storage)
+        self.assertEqual(
+                backend.parse_storage('none', 0, default=storage).compression,
+                None)
+
+    def test_parse_storage_layout(self):
+        self.assertEqual(backend.parse_storage().layout, 'rows')
+        storage = backend.parse_storage(layout='columns')
+        self.assertEqual(storage.layout, 'columns')
+        self.assertEqual(backend.parse_storage('gzip', default=storage).layout,
+                         'columns')
+        self.assertEqual(
+                backend.parse_storage(layout='rows', default=storage).layout,
+                'rows')
+        self.assertRaises(errors.BadLayoutError, backend.parse_storage,
+                          layout='diagonal')
+
+    def test_parse_storage_bad_filters(self):
+        for filters in ['zip', 'gzip:12', 'lzf:3', 'shuffle+foo']:
+            self.assertRaises(
+                    errors.BadStorageError, backend.parse_storage, filters)
+
+
+class ParamBlobStoreTest(_TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='dvtest')
+
+    def tearDown(self):
+        for name in os.listdir(self.dir):
+            os.unlink(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def test_share_and_load(self):
+        store = backend.param_blobs(self.dir)
+        self.assertIs(store, backend.param_blobs(self.dir + '/'))
+        small = backend.labrad_urlencode(1.5)
+        self.assertEqual(store.share(small), small)
+
+        value = np.arange(100.0)
+        big = backend.labrad_urlencode(value)
+        ref = store.share(big)
+        self.assertTrue(ref.startswith(backend.PARAM_BLOB_PREFIX))
+        self.assertEqual(ref, store.share(big))
+        self.assert_arrays_equal(backend.ParamBlobStore(store.filename).load(ref),
+                                 value)
+        self.assertRaises(errors.ParameterBlobError, store.load,
+                          backend.PARAM_BLOB_PREFIX + 'missing')
+
+    def test_hdf5_datasets_share_values(self):
+        value = np.arange(100.0)
+        datasets = []
+        for name in ['a.hdf5', 'b.hdf5']:
+            fh = backend.SelfClosingFile(
+                    h5py.File, open_args=(os.path.join(self.dir, name), 'a'),
+                    reactor=task.Clock())
+            data = backend.ExtendedHDF5Data(fh)
+            data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS)
+            data.share_params = True
+            data.addParam('big', value)
+            data.addParam('small', 2.0)
+            datasets.append(data)
+        refs = [data.dataset.attrs['Param.big'] for data in datasets]
+        self.assertEqual(refs[0], refs[1])
+        self.assertTrue(refs[0].startswith(backend.PARAM_BLOB_PREFIX))
+        self.assertEqual(datasets[0].dataset.attrs['Param.small'],
+                         backend.labrad_urlencode(2.0))
+        for data in datasets:
+            self.assert_arrays_equal(data.getParameter('big'), value)
+            data._file.close()
+
 
 class _MockFile(object):
     def __init__(self):
@@ -132,6 +212,102 @@ class SelfClosingFileTest(_TestCase):
         self.assertTrue(self.close_callback_called,
                     msg='Registered callback not called!')
 
+    def test_close_now(self):
+        closed = []
+        self.file.onClose(closed.append)
+        self.file.close()
+        self.assertFalse(self.opener.file.is_open, msg='File not closed')
+        self.assertEqual(closed, [self.file])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        # Closing again does nothing.
+        self.file.close()
+        self.assertEqual(closed, [self.file])
+
+
+class FilePoolTest(_TestCase):
+    """Tests for the FilePool shared by SelfClosingFiles."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pool = backend.FilePool(max_open=2, reactor=self.clock)
+        self.openers = [_MockFileOpener() for _ in range(3)]
+
+    def get_file(self, idx, timeout=10):
+        return backend.SelfClosingFile(opener=self.openers[idx],
+                                       timeout=timeout,
+                                       reactor=self.clock,
+                                       pool=self.pool)
+
+    def test_evicts_least_recently_used(self):
+        files = [self.get_file(0), self.get_file(1)]
+        files[0]()
+        files.append(self.get_file(2))
+        self.assertEqual(len(self.pool), 2)
+        self.assertFalse(self.openers[1].file.is_open)
+        self.assertTrue(self.openers[0].file.is_open)
+        self.assertEqual(
+                (self.pool.hits, self.pool.misses, self.pool.evictions),
+                (1, 3, 1))
+        # Reopens on demand.
+        files[1]()
+        self.assertTrue(self.openers[1].file.is_open)
+        self.assertEqual(self.pool.misses, 4)
+
+    def test_one_timer_for_all_files(self):
+        short = self.get_file(0, timeout=1)
+        long = self.get_file(1, timeout=5)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(1)
+        self.assertFalse(self.openers[0].file.is_open)
+        self.assertTrue(self.openers[1].file.is_open)
+        self.clock.advance(3)
+        self.assertTrue(self.openers[1].file.is_open)
+        self.clock.advance(1)
+        self.assertFalse(self.openers[1].file.is_open)
+        self.assertEqual(len(self.pool), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_pinned_files_stay_open(self):
+        files = [self.get_file(0, timeout=1), self.get_file(1)]
+        files[0].pin()
+        files.append(self.get_file(2))
+        # the least recently used file that isn't pinned goes instead
+        self.assertTrue(self.openers[0].file.is_open)
+        self.assertFalse(self.openers[1].file.is_open)
+        self.clock.advance(2)
+        self.assertTrue(self.openers[0].file.is_open)
+        hits = self.pool.hits
+        files[0]()
+        self.assertEqual(self.pool.hits, hits) # pinned uses skip the pool
+        files[0].unpin()
+        self.clock.advance(1)
+        self.assertFalse(self.openers[0].file.is_open)
+
+    def test_opened_pinned(self):
+        f = backend.SelfClosingFile(opener=self.openers[0], timeout=1,
+                                    reactor=self.clock, pool=self.pool,
+                                    pinned=True)
+        # nothing reaches the pool until the file is unpinned
+        self.assertTrue(f() is self.openers[0].file)
+        self.assertEqual(len(self.pool), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        f.unpin()
+        self.assertEqual(len(self.pool), 1)
+        self.assertEqual(self.pool.misses, 1)
+        self.clock.advance(1)
+        self.assertFalse(self.openers[0].file.is_open)
+
+    def test_file_in_use_stays_open(self):
+        self.pool.max_open = 0
+        f = self.get_file(0)
+        self.assertTrue(f() is self.openers[0].file)
+        self.assertTrue(self.openers[0].file.is_open)
+        # opening another closes the first, but not the one being opened
+        self.get_file(1)
+        self.assertFalse(self.openers[0].file.is_open)
+        self.assertTrue(self.openers[1].file.is_open)
+        self.assertEqual(len(self.pool), 1)
+
 
 # Dependent and Independent variables used for testing IniData and HDF5MetaData.
 _INDEPENDENTS = [
@@ -407,10 +583,38 @@ class _MockAttrs(dict):
         self[name] = np.asarray(data, dtype=dtype)
 
 
+class _MockResizableDataset(object):
+    """Mock of a resizable 1-D h5py Dataset backed by a numpy array."""
+    def __init__(self, shape, dtype):
+        self.data = np.zeros(shape, dtype=dtype)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def resize(self, shape):
+        extra = np.zeros((shape[0] - len(self.data),), dtype=self.data.dtype)
+        self.data = np.hstack((self.data, extra))
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+
+class _MockGroup(dict):
+    """Mock Group class holding the datasets next to a _MockDataset."""
+    def create_dataset(self, name, shape, dtype, **kw):
+        self[name] = _MockResizableDataset(shape, dtype)
+        return self[name]
+
+
 class _MockDataset(object):
     """Mock Dataset class to use in the HDF5MetaDataTest."""
     def __init__(self):
         self.attrs = _MockAttrs()
+        self.parent = _MockGroup()
 
 
 class HDF5MetaDataTest(_MetadataTest):
@@ -420,6 +624,28 @@ class HDF5MetaDataTest(_MetadataTest):
         data.dataset = _MockDataset()
         return data
 
+    def test_parameter_index(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        data.addParam('Alpha', 1.5)
+        data.addParam('beta', 'two')
+        self.assertEqual(sorted(data.getParamNames()), ['Alpha', 'beta'])
+        self.assertEqual(data.getParameter('alpha', case_sensitive=False), 1.5)
+        self.assertEqual(data.getParameter('BETA', case_sensitive=False), 'two')
+        self.assertRaises(errors.BadParameterError, data.getParameter, 'alpha')
+
+        # Decoded values are cached, so the attributes are not read again.
+        data.dataset.attrs['Param.Alpha'] = backend.labrad_urlencode(3.0)
+        self.assertEqual(data.getParameter('Alpha'), 1.5)
+
+        # Adding a parameter updates the index without scanning again.
+        self.assertRaises(errors.ParameterInUseError, data.addParam, 'beta', 3)
+        with mock.patch.object(_MockAttrs, '__iter__') as scan:
+            data.addParam('Gamma', 3)
+            self.assertEqual(data.getParamNames(), ['Alpha', 'Gamma', 'beta'])
+            self.assertEqual(data.getParameter('gamma', case_sensitive=False), 3)
+            self.assertFalse(scan.called)
+
 
 class _BackendDataTestCase(_TestCase):
     def assert_data_in_backend(self, backend_data, expected_data):
@@ -567,12 +793,13 @@ class _BackendDataTest(_BackendDataTestCase):
                None)
 
 
-class CsvNumpyDataTest(_BackendDataTest):
+class CsvIndexedDataTest(_BackendDataTest):
 
     def setUp(self):
-        self.filename = _unique_filename(suffix='raw')
+        self.filename = _unique_filename(suffix='.csv')
         self.files_to_remove = []
         self.clock = task.Clock()
+        self.cache = util.LRUCache(1 << 20, sizeof=lambda a: a.nbytes)
         self.data = self.get_backend_data(self.filename)
         # Initialize the metadata.
         self.data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
@@ -582,22 +809,100 @@ class CsvNumpyDataTest(_BackendDataTest):
             _remove_file_if_exists(name)
             _remove_file_if_exists(name[:-4] + '.ini')
 
-
     def get_backend_data(self, filename):
         self.files_to_remove.append(filename)
-        return backend.CsvNumpyData(filename, reactor=self.clock)
+        return backend.CsvIndexedData(
+                filename, reactor=self.clock, cache=self.cache)
 
     def test_empty_data_read(self):
-        read_data = self.data.data
-        self.assertEqual(read_data.dtype, np.dtype(float))
-        self.assertEqual(read_data.size, 0)
-        self.assertEqual(read_data[0].size, 0)
+        read_data, next_pos = self.data.getData(None, 0, False, None)
+        self.assertEqual(read_data.shape, (0, 3))
+        self.assertEqual(next_pos, 0)
+        self.assertFalse(self.data.hasMore(0))
 
     def test_add_data_wrong_number_of_columns(self):
         self.assertRaises(errors.BadDataError, self.data.addData, [(1, 2)])
         self.assertRaises(
                errors.BadDataError, self.data.addData, [(1, 2, 3, 4)])
 
+    def test_read_only(self):
+        rows = np.arange(6, dtype=float).reshape((2, 3))
+        self.data.addData(util.to_record_array(rows))
+        self.data.save()
+        data = backend.open_backend(self.filename[:-4], read_only=True)
+        self.assertIsInstance(data._file, backend.ReadOnlyFile)
+        data.load()
+        read_data, _ = data.getData(None, 0, False, None)
+        self.assert_arrays_equal(read_data, rows)
+        data._file.close()
+
+    def test_last_line_without_line_break(self):
+        with open(self.filename, 'ab') as f:
+            f.write('1,2,3\r\n4,5,6')
+        self.assertEqual(len(self.data), 2)
+        read_data, _ = self.data.getData(None, 0, False, None)
+        self.assert_arrays_equal(read_data, [[1, 2, 3], [4, 5, 6]])
+        # Appending ends that row first.
+        self.data.addData(util.to_record_array(np.array([[7.0, 8, 9]])))
+        self.assertEqual(len(self.data), 3)
+        read_data, _ = self.data.getData(None, 1, False, None)
+        self.assert_arrays_equal(read_data, [[4, 5, 6], [7, 8, 9]])
+
+    def test_blank_lines(self):
+        n = backend.CSV_BLOCK_ROWS + 2
+        rows = np.arange(3 * n, dtype=float).reshape((n, 3))
+        lines = ['{},{},{}\r\n'.format(*row) for row in rows]
+        lines.insert(5, '\r\n')
+        lines.insert(0, '\n')
+        with open(self.filename, 'ab') as f:
+            f.write(''.join(lines))
+        self.assertEqual(len(self.data), n)
+        read_data, _ = self.data.getData(None, 0, False, None)
+        self.assert_arrays_equal(read_data, rows)
+
+    def test_read_window_across_blocks(self):
+        n = 3 * backend.CSV_BLOCK_ROWS + 10
+        rows = np.arange(3 * n, dtype=float).reshape((n, 3))
+        self.data.addData(util.to_record_array(rows[:100]))
+        self.data.addData(util.to_record_array(rows[100:]))
+        self.assertEqual(len(self.data), n)
+
+        start = backend.CSV_BLOCK_ROWS - 5
+        read_data, next_pos = self.data.getData(300, start, False, None)
+        self.assertEqual(next_pos, start + 300)
+        self.assert_arrays_equal(read_data, rows[start:start + 300])
+        # only complete blocks are cached
+        self.assertEqual(len(self.cache), 3)
+        self.data.getData(1, n - 1, False, None)
+        self.assertEqual(len(self.cache), 3)
+
+        read_data, next_pos = self.data.getData(None, n - 3, False, None)
+        self.assertEqual(next_pos, n)
+        self.assert_arrays_equal(read_data, rows[n - 3:])
+        self.assertEqual(self.data.getData(5, n, False, None)[1], n)
+
+    def test_cache_budget(self):
+        block_bytes = backend.CSV_BLOCK_ROWS * 3 * 8
+        self.cache.capacity = 2 * block_bytes
+        n = 4 * backend.CSV_BLOCK_ROWS
+        rows = np.arange(3 * n, dtype=float).reshape((n, 3))
+        self.data.addData(util.to_record_array(rows))
+        read_data, _ = self.data.getData(None, 0, False, None)
+        self.assert_arrays_equal(read_data, rows)
+        self.assertEqual(len(self.cache), 2)
+        self.assertLessEqual(self.cache.size, self.cache.capacity)
+
+    def test_read_legacy_formatting(self):
+        with open(self.filename, 'ab') as f:
+            f.write('1, 2, 3\r\n4,5,6\n7, nan, -inf\r\n8, 9')
+        self.assertEqual(len(self.data), 3)
+        read_data, next_pos = self.data.getData(None, 0, False, None)
+        self.assertEqual(next_pos, 3)
+        self.assert_arrays_equal(read_data[:2], [[1, 2, 3], [4, 5, 6]])
+        self.assertTrue(np.isnan(read_data[2, 1]))
+        self.assertEqual(read_data[2, 2], -np.inf)
+
+
 class ExtendedHDF5DataTest(_BackendDataTest):
 
     def setUp(self):
@@ -622,6 +927,26 @@ class ExtendedHDF5DataTest(_BackendDataTest):
         read_data, _ =  self.data.getData(None, 0, False, None)
         self.assertEqual(read_data, [])
 
+    def test_migrate_comments_attribute(self):
+        # Older files store the comments in an attribute.
+        h5file = self.data.file
+        del h5file['Comments']
+        old_comments = np.array([(1.0, 'old user', 'old comment')],
+                                dtype=self.data.comment_type)
+        self.data.dataset.attrs.create('Comments', old_comments,
+                                       dtype=self.data.comment_type)
+        self.assertEqual(self.data.numComments(), 1)
+        comments, _ = self.data.getComments(None, 0)
+        self.assertEqual(comments[0][1:], ('old user', 'old comment'))
+
+        self.data.addComment('new user', 'new comment')
+        self.assertNotIn('Comments', self.data.dataset.attrs)
+        self.assertEqual(h5file['Comments'].shape, (2,))
+        comments, next_pos = self.data.getComments(None, 1)
+        self.assertEqual(next_pos, 2)
+        self.assertEqual(comments[0][1:], ('new user', 'new comment'))
+        self.assertEqual(self.data.getComments(None, 5), ([], 5))
+
     def test_get_data_transpose(self):
         data_to_add = np.recarray(
             (2, ),
@@ -770,6 +1095,57 @@ class ExtendedHDF5DataTest(_BackendDataTest):
         added_data, _ = data.getData(None, 0, False, None)
         self.assertEqual(added_data[0][0], "{'a': 0}")
 
+    def test_append_grows_in_chunks_and_trims_on_close(self):
+        row = np.recarray(
+            (1, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        for i in xrange(10):
+            row[0] = (i, 2*i, 3*i)
+            self.data.addData(row)
+        self.assertEqual(len(self.data), 10)
+        self.assertGreaterEqual(self.data.dataset.shape[0], 10)
+        self.assertEqual(self.data.dataset.shape[0] % self.data.dataset.chunks[0], 0)
+        self.assertTrue(self.data.hasMore(9))
+        self.assertFalse(self.data.hasMore(10))
+        read_data, next_pos = self.data.getData(None, 8, False, None)
+        self.assertEqual(next_pos, 10)
+        self.assertEqual(len(read_data), 2)
+
+        # Closing the file drops the preallocated rows.
+        self.clock.advance(backend.FILE_TIMEOUT_SEC)
+        self.assertEqual(self.data.dataset.shape[0], 10)
+        self.assertEqual(len(self.get_backend_data(self.filename)), 10)
+
+    def test_trim_keeps_rows_added_by_another_object(self):
+        row = np.recarray(
+            (1, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        for i in xrange(10):
+            row[0] = (i, 2*i, 3*i)
+            self.data.addData(row)
+        self.assertGreaterEqual(self.data.dataset.shape[0], 12)
+        # another object on the same file adds two rows
+        self.data.dataset.attrs.modify('Row Count', 12)
+        self.clock.advance(backend.FILE_TIMEOUT_SEC)
+        self.assertEqual(self.data.dataset.shape[0], 12)
+
+    def test_compressed_storage(self):
+        name = _unique_filename()
+        data = self.get_backend_data(name)
+        storage = backend.parse_storage('shuffle+gzip', 64)
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS, storage)
+        self.assertEqual(data.dataset.chunks, (64,))
+        self.assertEqual(data.dataset.compression, 'gzip')
+        self.assertTrue(data.dataset.shuffle)
+        rows = np.recarray(
+            (100, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        rows[:] = [(i, i, i) for i in xrange(100)]
+        data.addData(rows)
+        read_data, next_pos = data.getData(None, 0, True, None)
+        self.assertEqual(next_pos, 100)
+        self.assert_arrays_equal(read_data[0], range(100))
+
     def test_add_string_array_column(self):
         name = _unique_filename()
         data = self.get_backend_data(name)
@@ -811,5 +1187,213 @@ class SimpleHDF5DataTest(_BackendDataTest):
         self.assertEqual(read_data.dtype, np.dtype(float))
         self.assertEqual(read_data.size, 0)
 
+    def test_read_ignores_preallocated_rows(self):
+        data = np.recarray(
+            (3, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        data[:] = [(1, 2, 3), (4, 5, 6), (7, 8, 9)]
+        self.data.addData(data)
+        self.assertGreater(self.data.dataset.shape[0], 3)
+        self.assertEqual(len(self.data), 3)
+        read_data, next_pos = self.data.getData(None, 0, False, None)
+        self.assertEqual(next_pos, 3)
+        self.assert_arrays_equal(read_data, [[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+        read_data, next_pos = self.data.getData(10, 2, False, None)
+        self.assertEqual(next_pos, 3)
+        self.assert_arrays_equal(read_data, [[7, 8, 9]])
+
+class ColumnarHDF5DataTest(_BackendDataTest):
+
+    def setUp(self):
+        self.filename = _unique_filename(suffix='.hdf5')
+        self.files_to_remove = []
+        self.clock = task.Clock()
+        self.data = self.get_backend_data(self.filename)
+        # Initialize the metadata.
+        self.data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+
+    def tearDown(self):
+        for name in self.files_to_remove:
+            _remove_file_if_exists(name)
+
+    def get_backend_data(self, filename):
+        self.files_to_remove.append(filename)
+        fh = backend.SelfClosingFile(
+                h5py.File, open_args=(filename, 'a'), reactor=self.clock)
+        return backend.ColumnarHDF5Data(fh)
+
+    def test_empty_data_read(self):
+        read_data, _ =  self.data.getData(None, 0, False, None)
+        self.assertEqual(read_data, [])
+
+    def test_one_dataset_per_column(self):
+        self.assertEqual(list(self.data.file.attrs['Version']), [4, 0, 0])
+        group = self.data.file['DataVault']
+        self.assertEqual(sorted(group), ['f0', 'f1', 'f2'])
+        self.assertEqual(group.attrs['Title'], 'FooTitle')
+        self.assertEqual(self.data.dtype.names, ('f0', 'f1', 'f2'))
+
+    def test_get_data_transpose(self):
+        data_to_add = np.recarray(
+            (2, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        data_to_add[0] = (1, 2, 3)
+        data_to_add[1] = (4, 5, 6)
+        self.data.addData(data_to_add)
+
+        actual, next_pos = self.data.getData(None, 0, True, None)
+        self.assertEqual(next_pos, 2)
+        self.assertEqual(len(actual), 3)
+        self.assert_arrays_equal(actual, [[1, 4], [2, 5], [3, 6]])
+        simple, _ = self.data.getData(1, 1, False, True)
+        self.assert_arrays_equal(simple, [[4, 5, 6]])
+
+    def test_read_range(self):
+        rows = np.recarray(
+            (10, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        rows[:] = [(i, 10 * i, 100 * i) for i in xrange(10)]
+        self.data.addData(rows)
+        read = self.data.readRange(1, 8, 3, ['f2', 'f0'])
+        self.assertEqual(read.dtype.names, ('f2', 'f0'))
+        self.assert_arrays_equal(read['f2'], [100, 400, 700])
+        self.assert_arrays_equal(read['f0'], [1, 4, 7])
+        self.assertEqual(len(self.data.readRange(10, 20, 1, ['f1'])), 0)
+
+    def test_array_and_string_columns(self):
+        name = _unique_filename()
+        data = self.get_backend_data(name)
+        independents = [
+                backend.Independent(label='x', shape=(2, 2), datatype='c',
+                                    unit='V'),
+                backend.Independent(label='s', shape=(1,), datatype='s',
+                                    unit='')]
+        data.initialize_info('Foo', independents, [])
+        self.assertEqual(data.file['DataVault/f0'].shape, (0, 2, 2))
+        rows = np.recarray(
+            (2, ),
+            dtype=[('f0', '<c16', (2, 2)), ('f1', 'O')])
+        rows[0] = ([[0j, 1j], [1j, 0j]], 'foo')
+        rows[1] = ([[2j, 3j], [4j, 5j]], 'bar')
+        data.addData(rows)
+        read_data, _ = data.getData(None, 0, False, None)
+        self.assert_arrays_equal(read_data[1][0], [[2j, 3j], [4j, 5j]])
+        self.assertEqual(read_data[0][1], 'foo')
+        columns, _ = data.getData(None, 0, True, None)
+        self.assertEqual(columns[0].shape, (2, 2, 2))
+        self.assertEqual(columns[1], ['foo', 'bar'])
+        self.assertRaises(errors.DataVersionMismatchError,
+                          data.getData, None, 0, False, True)
+
+    def test_append_grows_in_chunks_and_trims_on_close(self):
+        row = np.recarray(
+            (1, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        for i in xrange(10):
+            row[0] = (i, 2*i, 3*i)
+            self.data.addData(row)
+        self.assertEqual(len(self.data), 10)
+        column = self.data.file['DataVault/f1']
+        self.assertGreaterEqual(column.shape[0], 10)
+        self.assertEqual(column.shape[0] % column.chunks[0], 0)
+
+        # Closing the file drops the preallocated rows.
+        self.clock.advance(backend.FILE_TIMEOUT_SEC)
+        for name in ['f0', 'f1', 'f2']:
+            self.assertEqual(self.data.file['DataVault'][name].shape, (10,))
+        reopened = backend.open_hdf5_file(self.filename)
+        self.assertIsInstance(reopened, backend.ColumnarHDF5Data)
+        self.assertEqual(len(reopened), 10)
+        reopened._file.close()
+
+    def test_trim_keeps_rows_added_by_another_object(self):
+        row = np.recarray(
+            (1, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        for i in xrange(10):
+            row[0] = (i, 2*i, 3*i)
+            self.data.addData(row)
+        self.assertGreaterEqual(self.data.file['DataVault/f0'].shape[0], 12)
+        # another object on the same file adds two rows
+        self.data.file['DataVault'].attrs.modify('Row Count', 12)
+        self.clock.advance(backend.FILE_TIMEOUT_SEC)
+        for name in ['f0', 'f1', 'f2']:
+            self.assertEqual(self.data.file['DataVault'][name].shape, (12,))
+
+
+class GriddedHDF5DataTest(_TestCase):
+
+    def setUp(self):
+        self.filename = _unique_filename(suffix='.hdf5')
+        self.clock = task.Clock()
+        fh = backend.SelfClosingFile(
+                h5py.File, open_args=(self.filename, 'a'), reactor=self.clock)
+        self.data = backend.GriddedHDF5Data(fh)
+        independents = [
+                backend.Independent(label='x', shape=(1,), datatype='v', unit='V'),
+                backend.Independent(label='y', shape=(1,), datatype='v', unit='V')]
+        dependents = [
+                backend.Dependent(label='z', legend='', shape=(1,), datatype='v',
+                                  unit='A'),
+                backend.Dependent(label='w', legend='', shape=(2,), datatype='c',
+                                  unit='')]
+        self.data.initialize_info('Foo', independents, dependents, grid=(4, 3))
+
+    def tearDown(self):
+        _remove_file_if_exists(self.filename)
+
+    def test_initialize(self):
+        self.assertEqual(list(self.data.file.attrs['Version']), [5, 0, 0])
+        self.assertEqual(self.data.gridShape(), (4, 3))
+        self.assertEqual(self.data.file['DataVault/f1'].shape, (4, 3, 2))
+        self.assert_arrays_equal(self.data.getAxis(1), [0, 1, 2])
+        self.data.setAxis(1, [.1, .2, .3])
+        self.assert_arrays_equal(self.data.getAxis(1), [.1, .2, .3])
+        self.assertRaises(errors.BadGridError, self.data.setAxis, 1, [1, 2])
+        self.assertRaises(errors.BadGridError, self.data.getAxis, 2)
+        self.assertRaises(errors.UnsupportedDatasetError,
+                          self.data.getData, None, 0, False, False)
+
+    def test_write_and_read_slabs(self):
+        z = np.arange(6.0).reshape((2, 3))
+        w = np.ones((2, 3, 2), dtype=complex)
+        self.data.writeSlab([1, 0], [z, w])
+        self.data.writeSlab([3, 2], [[[9.0]], [[[2j, 3j]]]])
+
+        deps, filled = self.data.readSlab([0, 0], [10, 10])
+        self.assertEqual(deps[0].shape, (4, 3))
+        self.assert_arrays_equal(deps[0][1:3], z)
+        self.assertEqual(deps[0][3, 2], 9.0)
+        self.assertTrue(np.isnan(deps[0][0, 0]))
+        self.assert_arrays_equal(deps[1][3, 2], [2j, 3j])
+        self.assertEqual(filled.sum(), 7)
+        self.assertFalse(filled[0].any())
+
+        deps, filled = self.data.readSlice(1, 2)
+        self.assertEqual(deps[0].shape, (4,))
+        self.assertEqual(deps[1].shape, (4, 2))
+        self.assert_arrays_equal(filled, [False, True, True, True])
+
+    def test_bad_slabs(self):
+        z = np.zeros((2, 2))
+        w = np.zeros((2, 2, 2), dtype=complex)
+        self.assertRaises(errors.BadGridError, self.data.writeSlab, [3, 0], [z, w])
+        self.assertRaises(errors.BadGridError, self.data.writeSlab, [0], [z, w])
+        self.assertRaises(errors.BadGridError, self.data.writeSlab, [0, 0], [z])
+        self.assertRaises(errors.BadGridError, self.data.writeSlab, [0, 0],
+                          [z, w[:, :1]])
+        self.assertRaises(errors.BadGridError, self.data.readSlice, 0, 4)
+
+    def test_reopen(self):
+        self.data.writeSlab([0, 0], [[[1.0]], [[[1j, 1j]]]])
+        self.data._file.close()
+        data = backend.open_hdf5_file(self.filename)
+        self.assertIsInstance(data, backend.GriddedHDF5Data)
+        deps, filled = data.readSlab([0, 0], [1, 1])
+        self.assertEqual(deps[0][0, 0], 1.0)
+        self.assertTrue(filled[0, 0])
+        data._file.close()
+
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
@@ -0,0 +1,21 @@
+import json
+import unittest
+
+from datavault import benchmark
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_run(self):
+        results = benchmark.run(scale=0.001)
+        names = [name for keys in benchmark.BENCHMARKS for name in keys]
+        self.assertEqual(names, list(results['results']))
+        for name, result in results['results'].items():
+            self.assertGreater(result['calls'], 0, name)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'], name)
+        self.assertEqual(10000, results['results']['add 10000']['rows'])
+        json.loads(json.dumps(results))
+
+    def test_run_some(self):
+        results = benchmark.run(['dir 10k'], scale=0.001)
+        self.assertEqual(['dir 10k', 'open by number'], list(results['results']))
@@ -0,0 +1,129 @@
+import mock
+import numpy as np
+import shutil
+import tempfile
+import unittest
+
+from labrad.units import Value
+from twisted.internet import defer, task
+
+from datavault import SessionStore, catalog
+
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp(prefix='dvtest_')
+        self.clock = task.Clock()
+        self.catalog = catalog.open_catalog(self.datadir, reactor=self.clock)
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.datadir)
+
+    def add(self, path, name, created, tags=(), params=()):
+        self.catalog.addDataset(path, name, int(name[:5]), name[8:], created,
+                                ['x'], ['y'], tags=tags, params=params)
+
+    def test_search(self):
+        self.add([''], '00001 - Rabi', 100, tags=['good'],
+                 params=[('freq', Value(5.1, 'GHz')), ('note', 'hi')])
+        self.add(['', 'a/b'], '00001 - Ramsey', 200, params=[('freq', 6.0)])
+        self.add(['', 'a/b', 'c'], '00001 - Rabi', 300, tags=['good', 'trash'])
+        self.add(['', 'a'], '00002 - T1', 400)
+
+        def names(**kw):
+            return [(list(path), name) for path, name in self.catalog.search(**kw)]
+        self.assertEqual(4, len(names()))
+        self.assertEqual([([''], '00001 - Rabi'), (['', 'a/b', 'c'], '00001 - Rabi')],
+                         names(regex='Rab'))
+        self.assertEqual([(['', 'a/b'], '00001 - Ramsey'),
+                          (['', 'a/b', 'c'], '00001 - Rabi')],
+                         names(path=['', 'a/b']))
+        self.assertEqual([([''], '00001 - Rabi')], names(tags=['good', '-trash']))
+
+        # Excluded tags also leave out datasets in tagged directories below path.
+        self.catalog.setDirTags(['', 'a/b'], ['trash'])
+        self.assertEqual([([''], '00001 - Rabi'), (['', 'a'], '00002 - T1')],
+                         names(tags=['-trash']))
+        self.assertEqual(2, len(names(path=['', 'a/b'], tags=['-trash'])))
+        self.assertEqual(['00001 - Ramsey', '00001 - Rabi'],
+                         [n for _, n in names(after=200, before=400)])
+        self.assertEqual(['00001 - Rabi'],
+                         [n for _, n in names(params=[('freq', 5, 5.5)])])
+        self.assertEqual(['00001 - Rabi'], [n for _, n in names(limit=1)])
+
+    def test_updates(self):
+        self.add(['', 'a'], '00001 - Rabi', 100)
+        self.catalog.setTags(['', 'a'], '00001 - Rabi', ['star'])
+        self.catalog.addParams(['', 'a'], '00001 - Rabi', [('power', -10)])
+        self.catalog.setRows(['', 'a'], '00001 - Rabi', 42)
+        self.assertEqual(1, len(self.catalog.search(tags=['star'],
+                                                    params=[('power', -20, 0)])))
+        self.assertEqual(42, self.catalog.info(['', 'a'], '00001 - Rabi')['rows'])
+
+        # Changes are committed after a delay.
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.advance(catalog.CATALOG_COMMIT_DELAY)
+        self.assertEqual(0, len(self.clock.getDelayedCalls()))
+        other = catalog.open_catalog(self.datadir)
+        self.assertEqual(42, other.info(['', 'a'], '00001 - Rabi')['rows'])
+        other.close()
+
+    def test_rebuild(self):
+        hub = mock.MagicMock()
+        store = SessionStore(self.datadir, hub, catalog=self.catalog)
+        session = store.get(['', 'sub/dir'])
+        dataset = session.newDataset('Rabi', ['x [s]'], ['y (E) [V]'])
+        dataset.addParameter('freq', 5.0)
+        dataset.addData(np.core.records.fromarrays([[1.0, 2.0], [3.0, 4.0]],
+                                                   dtype=dataset.data.dtype))
+        session.updateTags(['good'], [], [dataset.name])
+        root = store.get([''])
+        root.updateTags(['trash'], ['sub/dir'], [])
+        self.assertEqual(0, len(self.catalog.search(tags=['-trash'])))
+        expected = self.catalog.info(['', 'sub/dir'], dataset.name)
+        self.assertEqual(2, expected['rows'])
+        self.assertEqual(['x'], expected['independents'])
+        self.assertEqual(1, len(self.catalog.search(tags=['good'],
+                                                    params=[('freq', 5, 5)])))
+        dataset.data._file.close()
+        session.flush()
+        root.flush()
+
+        self.assertEqual(1, self.catalog.rebuild(self.datadir))
+        rebuilt = self.catalog.info(['', 'sub/dir'], dataset.name)
+        self.assertEqual(expected['title'], rebuilt['title'])
+        self.assertEqual(expected['rows'], rebuilt['rows'])
+        self.assertEqual(expected['dependents'], rebuilt['dependents'])
+        self.assertAlmostEqual(expected['created'], rebuilt['created'], places=0)
+        self.assertEqual(1, len(self.catalog.search(tags=['good'],
+                                                    params=[('freq', 5, 5)])))
+        self.assertEqual(0, len(self.catalog.search(tags=['-trash'])))
+        self.assertFalse(self.catalog.outdated)
+
+    def test_rebuild_in_thread(self):
+        self.assertTrue(self.catalog.outdated)
+        hub = mock.MagicMock()
+        store = SessionStore(self.datadir, hub, catalog=self.catalog)
+        session = store.get(['', 'a'])
+        session.newDataset('Rabi', ['x [s]'], ['y (E) [V]']).data._file.close()
+        session.flush()
+
+        with mock.patch('twisted.internet.threads.deferToThread') as thread:
+            build = defer.Deferred()
+            thread.side_effect = lambda f: build.addCallback(lambda _: f())
+            counts = []
+            self.catalog.rebuildInThread(self.datadir).addCallback(counts.append)
+            # changes made while building are made once it is done
+            self.assertTrue(self.catalog.building)
+            session.newDataset('Ramsey', ['x [s]'], ['y (E) [V]']).data._file.close()
+            build.callback(None)
+        self.assertEqual([2], counts)
+        self.assertFalse(self.catalog.building)
+        self.assertFalse(self.catalog.outdated)
+        self.assertEqual(['00001 - Rabi', '00002 - Ramsey'],
+                         [name for _, name in self.catalog.search()])
+        other = catalog.open_catalog(self.datadir)
+        self.assertFalse(other.outdated)
+        other.close()
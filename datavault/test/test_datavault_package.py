@@ -4,12 +4,14 @@ import os
 import pytest
 import tempfile
 import unittest
+import weakref
 
 from labrad import types
 
 from twisted.internet import task
 
-from datavault import Session, Dataset, SessionStore
+from datavault import Session, Dataset, SessionStore, SESSION_SAVE_DELAY
+from datavault import errors
 
 
 def _unique_dir():
@@ -61,11 +63,24 @@ class TestSessionStore(unittest.TestCase):
 
     def test_get_all_sessions(self):
         store = SessionStore(self.datadir, self.hub)
+        store.recent_sessions.resize(0)
         # Create a new session.
         foo_session = store.get('foo')
         bar_session = store.get('bar')
         self.assertEqual([foo_session, bar_session], store.get_all())
 
+    def test_recent_sessions(self):
+        store = SessionStore(self.datadir, self.hub)
+        store.get(['', 'foo'])
+        # Unused sessions stay in memory until pushed out of the cache.
+        session = weakref.ref(store.get(['', 'foo']))
+        self.assertIsNotNone(session())
+        self.assertEqual((1, 2), (store.recent_sessions.hits,
+                                  store.recent_sessions.misses))
+        self.assertEqual(2, len(store.recent_sessions))
+        store.recent_sessions.resize(0)
+        self.assertIsNone(session())
+
 
 class _DatavaultTestCase(unittest.TestCase):
     _TITLE = 'Foo'
@@ -168,6 +183,100 @@ class SessionTest(_DatavaultTestCase):
         d2 = s2.openDataset(datasets[0])
         self.assertDatasetsEqual(d1, d2)
 
+    def test_deferred_save(self):
+        clock = task.Clock()
+        s = Session(self.datadir, ['foo'], self.hub, self.store, reactor=clock)
+        self.assertTrue(os.path.exists(s.infofile))
+        self.assertEqual(0, len(clock.getDelayedCalls()))
+        old_mtime = int(os.path.getmtime(s.infofile)) - 100
+        os.utime(s.infofile, (old_mtime, old_mtime))
+        s.access()
+        s.access()
+        self.assertEqual(1, len(clock.getDelayedCalls()))
+        self.assertEqual(old_mtime, os.path.getmtime(s.infofile))
+        clock.advance(SESSION_SAVE_DELAY)
+        self.assertNotEqual(old_mtime, os.path.getmtime(s.infofile))
+
+        # New datasets save the counter immediately.
+        s.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        s2 = self._get_session()
+        self.assertEqual(2, s2.counter)
+
+        s.access()
+        s.flush()
+        self.assertEqual(0, len(clock.getDelayedCalls()))
+        self.assertFalse(os.path.exists(s.infofile + '.tmp'))
+
+    def test_directory_index(self):
+        session = self._get_session(path=['parent'])
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        self.store.get.return_value = session
+        self._get_session(path=['parent', 'child'])
+        self.assertEqual((['child'], ['00001 - Foo']), session.listContents([]))
+        self.assertEqual('00001 - Foo', session.openDataset(1).name)
+        with self.assertRaises(errors.DatasetNotFoundError):
+            session.openDataset(2)
+
+        # Files added behind our back show up once the mtime is trusted.
+        session.index.clock = lambda: os.path.getmtime(session.dir) + 100
+        session.listDatasets()
+        other = os.path.join(session.dir, '00002 - Bar.hdf5')
+        open(other, 'w').close()
+        mtime = os.path.getmtime(session.dir) + 1
+        os.utime(session.dir, (mtime, mtime))
+        self.assertEqual(['00001 - Foo', '00002 - Bar'], session.listDatasets())
+        self.assertEqual('00002 - Bar', session.index.numbers[2])
+
+        # A number used twice finds the first of its names.
+        for name in ['00002 - Baz.hdf5', '00002 - Abc.csv']:
+            open(os.path.join(session.dir, name), 'w').close()
+        mtime += 1
+        os.utime(session.dir, (mtime, mtime))
+        session.listDatasets()
+        self.assertEqual('00002 - Abc', session.index.numbers[2])
+
+    def test_directory_index_trusts_own_changes(self):
+        session = Session(self.datadir, ['parent'], self.hub, self.store,
+                          share_params=True)
+        session.index.clock = lambda: os.path.getmtime(session.dir) + 100
+        session.listContents([])
+        # Our own changes keep the listing, however recent the mtime.
+        with mock.patch.object(session.index, '_scan') as scan:
+            dataset = session.newDataset(
+                    self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+            dataset.addParameter('foo', 1)
+            session.save()
+            self.assertEqual(['00001 - Foo'], session.listDatasets())
+            self.assertFalse(scan.called)
+
+    def test_directory_index_rescans_after_others_changes(self):
+        session = self._get_session(path=['parent'])
+        session.index.clock = lambda: os.path.getmtime(session.dir) + 100
+        session.listDatasets()
+        # Someone else adds a file, then we change the directory too.
+        other = os.path.join(session.dir, '00002 - Bar.hdf5')
+        open(other, 'w').close()
+        mtime = os.path.getmtime(session.dir) + 1
+        os.utime(session.dir, (mtime, mtime))
+        session.save()
+        self.assertEqual(['00002 - Bar'], session.listDatasets())
+
+    def test_list_contents_tag_filters(self):
+        session = self._get_session()
+        for _ in range(3):
+            session.newDataset(
+                    self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        session.updateTags(['star'], [], ['00001 - Foo', '00003 - Foo'])
+        session.updateTags(['trash'], [], ['00003 - Foo', '00009 - Gone'])
+        _, datasets = session.listContents(['star'])
+        self.assertEqual(['00001 - Foo', '00003 - Foo'], datasets)
+        _, datasets = session.listContents(['trash'])
+        self.assertEqual(['00003 - Foo'], datasets)
+        _, datasets = session.listContents(['star', '-trash'])
+        self.assertEqual(['00001 - Foo'], datasets)
+        _, datasets = session.listContents(['-trash', 'star'])
+        self.assertEqual(['00001 - Foo'], datasets)
+
     def test_add_new_tags(self):
         session1 = self._get_session()
         dataset1 = session1.newDataset(
@@ -495,6 +604,49 @@ class DatasetTest(_DatavaultTestCase):
         self.assertEqual('user 1', retreived_comment[0][1])
         self.assertEqual('comment 1', retreived_comment[0][2])
 
+    def test_buffered_add_data(self):
+        clock = task.Clock()
+        dataset = Dataset(
+                self.session,
+                "Foo Name",
+                title=self._TITLE,
+                create=True,
+                independents=self._INDEPENDENTS,
+                dependents=self._DEPENDENTS,
+                reactor=clock)
+        dataset.setBuffering(3, 5)
+        dataset.listeners.add('foo listener')
+
+        dataset.addData(
+                self._get_records_simple([(1, 2, 3)], dataset.data.dtype))
+        self.hub.onDataAvailable.assert_called_with(None, set(['foo listener']))
+        dataset.addData(
+                self._get_records_simple([(2, 3, 4)], dataset.data.dtype))
+
+        # Nothing is on disk yet, but readers see the buffered rows.
+        self.assertEqual(0, len(dataset.data))
+        self.assertTrue(dataset.hasMore(1))
+        data_in_dataset, count = dataset.getData(None, 0, simpleOnly=True)
+        self.assertEqual(count, 2)
+        self.assertArrayEqual([[1, 2, 3], [2, 3, 4]], data_in_dataset)
+
+        # Filling the buffer writes it out.
+        dataset.addData(
+                self._get_records_simple([(3, 4, 5)], dataset.data.dtype))
+        self.assertEqual(3, len(dataset.data))
+
+        # Reads may span rows on disk and rows still in the buffer.
+        dataset.addData(
+                self._get_records_simple([(4, 5, 6)], dataset.data.dtype))
+        data_in_dataset, count = dataset.getData(2, 2, simpleOnly=True)
+        self.assertEqual(count, 4)
+        self.assertArrayEqual([[3, 4, 5], [4, 5, 6]], data_in_dataset)
+
+        # Old rows are written out after max_age.
+        clock.advance(5)
+        self.assertEqual(4, len(dataset.data))
+        self.assertFalse(dataset.hasMore(4))
+
     def test_keep_streaming(self):
         dataset = Dataset(
                 self.session,
@@ -521,6 +673,47 @@ class DatasetTest(_DatavaultTestCase):
         # Trigger the listener again.
         self.hub.onDataAvailable.assert_called_with(None, set([listener]))
 
+    def test_notify_interval(self):
+        clock = task.Clock()
+        dataset = Dataset(
+                self.session,
+                "Foo Name",
+                title=self._TITLE,
+                create=True,
+                independents=self._INDEPENDENTS,
+                dependents=self._DEPENDENTS,
+                reactor=clock)
+        dataset.setNotify(1.0, 2)
+        dataset.count_listeners.add('watcher')
+        rows = [(1, 2, 3), (2, 3, 4), (3, 4, 5)]
+
+        # The first add is announced straight away.
+        dataset.listeners.add('listener')
+        dataset.addData(self._get_records_simple(rows[:1], dataset.data.dtype))
+        self.hub.onDataAvailable.assert_called_with(None, set(['listener']))
+        count, new_rows = self.hub.onDataCount.call_args[0][0]
+        self.assertEqual(1, count)
+        self.assertArrayEqual([[1, 2, 3]], new_rows)
+
+        # Adds within the interval are sent together at the end of it.
+        self.hub.reset_mock()
+        dataset.keepStreaming('listener', 1)
+        dataset.addData(self._get_records_simple(rows[1:2], dataset.data.dtype))
+        dataset.addData(self._get_records_simple(rows[2:], dataset.data.dtype))
+        self.assertFalse(self.hub.onDataAvailable.called)
+        clock.advance(1.0)
+        self.hub.onDataAvailable.assert_called_once_with(None, set(['listener']))
+        count, new_rows = self.hub.onDataCount.call_args[0][0]
+        self.assertEqual(3, count)
+        self.assertArrayEqual(rows[1:], new_rows)
+
+        # Too many rows to send: only the count goes out.
+        clock.advance(1.0)
+        dataset.addData(self._get_records_simple(rows, dataset.data.dtype))
+        count, new_rows = self.hub.onDataCount.call_args[0][0]
+        self.assertEqual(6, count)
+        self.assertEqual(0, len(new_rows))
+
 
 if __name__ == '__main__':
     pytest.main(['-v', '-s', __file__])
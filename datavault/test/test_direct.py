@@ -0,0 +1,70 @@
+import mock
+import numpy as np
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from twisted.internet import task
+
+from datavault import SessionStore, direct, errors
+
+
+class DirectReadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp(prefix='dvtest_')
+        self.clock = task.Clock()
+        self.store = SessionStore(self.datadir, mock.MagicMock())
+        self.session = self.store.get(['', 'sub'])
+
+    def tearDown(self):
+        for dataset in self.session.datasets.values():
+            dataset.data._file.close()
+        shutil.rmtree(self.datadir)
+
+    def newDataset(self, name):
+        dataset = self.session.newDataset(name, ['x [s]'], ['y (E) [V]'])
+        dataset.reactor = self.clock
+        return dataset
+
+    def rows(self, dataset, x, y):
+        return np.core.records.fromarrays([x, y], dtype=dataset.data.dtype)
+
+    def test_read(self):
+        dataset = self.newDataset('Rabi')
+        dataset.addData(self.rows(dataset, [1.0, 2.0, 3.0], [4.0, 5.0, 6.0]))
+        dataset.addParameter('freq', 5.0)
+        dataset.addComment('me', 'good')
+
+        with direct.open_dataset(self.datadir, ['', 'sub'], 1) as d:
+            self.assertEqual(3, len(d))
+            self.assertTrue(np.array_equal([4, 5, 6], d.read()['f1']))
+            rows = d.read(1, None, [1])
+            self.assertEqual(('f1',), rows.dtype.names)
+            self.assertTrue(np.array_equal([5, 6], rows['f1']))
+            self.assertEqual({'freq': 5.0}, dict(d.parameters()))
+            self.assertEqual([('me', 'good')], [c[1:] for c in d.comments()])
+            self.assertEqual('x', d.independents()[0].label)
+            self.assertRaises(errors.UnsupportedDatasetError, d.gridShape)
+
+        self.assertEqual(direct.dataset_filename(self.datadir, ['', 'sub'], 1),
+                         direct.dataset_filename(self.datadir, ['', 'sub'],
+                                                 '00001 - Rabi'))
+        self.assertRaises(errors.DatasetNotFoundError, direct.open_dataset,
+                          self.datadir, ['', 'sub'], 2)
+        self.assertRaises(errors.DirectoryNotFoundError, direct.open_dataset,
+                          self.datadir, ['', 'missing'], 1)
+
+    def test_read_while_writing(self):
+        dataset = self.newDataset('Rabi')
+        dataset.addData(self.rows(dataset, [1.0, 2.0], [3.0, 4.0]))
+        # another process sees the rows once the file has been flushed
+        self.clock.advance(1)
+        code = ('from datavault import direct\n'
+                'direct.disable_file_locking()\n'
+                'with direct.open_dataset({!r}, ["", "sub"], 1) as d:\n'
+                '    print len(d), d.read()["f1"].sum()\n').format(self.datadir)
+        out = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual('2 7.0', out.strip().splitlines()[-1])
@@ -0,0 +1,89 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from twisted.internet import task
+
+from datavault import backend, migrate_csv, util
+
+_INDEPENDENTS = [
+        backend.Independent(
+                label='FirstVariable', shape=(1,), datatype='v', unit='Ghz')]
+_DEPENDENTS = [
+        backend.Dependent(
+                label='Cents', legend='OnlyDependent', shape=(1,),
+                datatype='v', unit='Dollars')]
+
+
+class MigrateCsvTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.dir = os.path.join(self.root, 'sub.dir')
+        os.mkdir(self.dir)
+        self.base = os.path.join(self.dir, '00001 - Foo')
+        self.rows = np.arange(20, dtype=float).reshape((10, 2))
+
+        data = backend.CsvNumpyData(self.base + '.csv', reactor=task.Clock())
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS)
+        data.created = datetime.datetime(2012, 9, 21, 3, 14, 15)
+        data.addData(util.to_record_array(self.rows))
+        data.addParam('Alpha', 1.5)
+        data.comments.append(
+                (datetime.datetime(2012, 9, 22, 3, 14, 15), 'user', 'hello'))
+        data.save()
+        data._file.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_migrate(self):
+        self.assertEqual(list(migrate_csv.find_datasets(self.root)), [self.base])
+        messages = []
+        failures = migrate_csv.migrate(self.root, 1, messages.append)
+        self.assertEqual(failures, 0)
+        self.assertEqual(len(messages), 1)
+        self.assertTrue(messages[0].endswith('converted 10 rows'))
+        for ext in ['.hdf5', '.csv.orig', '.ini.orig']:
+            self.assertTrue(os.path.exists(self.base + ext))
+        for ext in ['.csv', '.ini', '.hdf5.tmp']:
+            self.assertFalse(os.path.exists(self.base + ext))
+
+        data = backend.open_backend(self.base)
+        self.assertIsInstance(data, backend.SimpleHDF5Data)
+        read_data, _ = data.getData(None, 0, False, None)
+        self.assertTrue(np.array_equal(read_data, self.rows))
+        self.assertEqual(data.getIndependents(), _INDEPENDENTS)
+        self.assertEqual(data.getDependents(), _DEPENDENTS)
+        self.assertEqual(data.getParameter('Alpha'), 1.5)
+        comments, _ = data.getComments(None, 0)
+        self.assertEqual(comments, [
+                (datetime.datetime(2012, 9, 22, 3, 14, 15), 'user', 'hello')])
+        created = datetime.datetime.fromtimestamp(
+                data.dataset.attrs['Creation Time'])
+        self.assertEqual(created, datetime.datetime(2012, 9, 21, 3, 14, 15))
+        data._file.close()
+
+        # Nothing left to do the second time round.
+        self.assertEqual(list(migrate_csv.find_datasets(self.root)), [])
+
+    def test_resume_after_rename(self):
+        migrate_csv.migrate(self.root, 1)
+        # Pretend we stopped before moving the .ini out of the way.
+        os.rename(self.base + '.ini.orig', self.base + '.ini')
+        self.assertEqual(list(migrate_csv.find_datasets(self.root)), [self.base])
+        self.assertEqual(migrate_csv.convert(self.base), (self.base, 'resumed'))
+        self.assertTrue(os.path.exists(self.base + '.ini.orig'))
+
+    def test_failure_leaves_csv(self):
+        with open(self.base + '.ini', 'w') as f:
+            f.write('not an ini file')
+        base, message = migrate_csv.convert(self.base)
+        self.assertTrue(message.startswith('failed'))
+        self.assertTrue(os.path.exists(self.base + '.csv'))
+        self.assertFalse(os.path.exists(self.base + '.hdf5'))
+        self.assertFalse(os.path.exists(self.base + '.hdf5.tmp'))
@@ -9,8 +9,9 @@ from twisted.internet import reactor, task
 
 from labrad.server import LabradServer, Signal, setting
 from labrad import server
+from labrad import types as T
 
-from datavault import backend, errors, server, SessionStore
+from datavault import backend, catalog, errors, server, SessionStore
 
 
 def _unique_dir():
@@ -226,7 +227,9 @@ class DataVaultTest(unittest.TestCase):
         self.datavault.cd(self.context, path='first', create=True)
         self.datavault.cd(self.context, path=['second', 'third'], create=True)
         all_sessions = self.datavault.dump_existing_sessions(self.context)
-        self.assertEqual(['/first/second/third'], all_sessions)
+        # the directories passed through are kept in memory too
+        self.assertEqual(['', '/first', '/first/second', '/first/second/third'],
+                         sorted(all_sessions))
 
     def test_add_simple_data(self):
         self.datavault.initContext(self.context)
@@ -345,5 +348,372 @@ class DataVaultTest(unittest.TestCase):
                 self.datavault.get,
                 self.context)
 
+    def test_new_ex_with_compression(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context,
+                'foo',
+                [('x', [1], 'v', 'ms')],
+                [('y', 'E', [1], 'v', 'eV')],
+                chunk_rows=128,
+                compression='lzf')
+        dataset = self.datavault.getDataset(self.context)
+        self.assertEqual((128,), dataset.data.dataset.chunks)
+        self.assertEqual('lzf', dataset.data.dataset.compression)
+        self.assertRaises(
+                errors.BadStorageError,
+                self.datavault.new_ex,
+                self.context,
+                'foo',
+                [('x', [1], 'v', 'ms')],
+                [('y', 'E', [1], 'v', 'eV')],
+                compression='bzip2')
+
+    def test_columnar_layout(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context,
+                'foo',
+                [('x', [1], 'v', 'ms')],
+                [('y', 'E', [2], 'v', 'eV'), ('z', 'F', [1], 'v', 'eV')],
+                layout='columns')
+        dataset = self.datavault.getDataset(self.context)
+        self.assertEqual('4.0.0', self.datavault.get_version(self.context))
+        x = np.arange(5.0)
+        y = np.arange(10.0).reshape((5, 2))
+        z = x * 10
+        self.datavault.add_ex_t(self.context, (x, y, z))
+        data = self.datavault.get_ex_t(self.context)
+        self.assertArrayEqual(x, data[0])
+        self.assertArrayEqual(y, data[1])
+        rows = self.datavault.get_range(self.context, 1, 4, [2, 0])
+        self.assertArrayEqual(np.column_stack((z, x))[1:4], rows)
+        self.assertRaises(
+                errors.BadLayoutError,
+                self.datavault.new_ex,
+                self.context,
+                'foo',
+                [('x', [1], 'v', 'ms')],
+                [('y', 'E', [1], 'v', 'eV')],
+                layout='diagonal')
+
+        # The server default applies to simple datasets too.
+        self.store.storage = backend.parse_storage(layout='columns')
+        self.datavault.new(self.context, 'bar', ['x [ms]'], ['y (E) [eV]'])
+        self.assertEqual('4.0.0', self.datavault.get_version(self.context))
+        self.datavault.add(self.context, [[1, 2], [3, 4]])
+        self.assertArrayEqual([[1, 2], [3, 4]], self.datavault.get(self.context))
+        self.assertEqual(2, self.datavault.query(self.context, 1, 3, 5)[0])
+
+    def test_grid(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context,
+                'sweep',
+                [('x', [1], 'v', 'V'), ('y', [1], 'v', 'V')],
+                [('z', 'I', [1], 'v', 'A')],
+                grid=[3, 2])
+        self.assertEqual([3, 2], self.datavault.grid_shape(self.context))
+        self.assertEqual('5.0.0', self.datavault.get_version(self.context))
+        self.datavault.set_axis(self.context, 0, [.1, .2, .3])
+        self.assertArrayEqual([.1, .2, .3],
+                              self.datavault.get_axis(self.context, 0))
+
+        self.datavault.add_slab(self.context, [0, 0], np.array([[1.0, 2.0]]))
+        self.datavault.add_slab(self.context, [2, 1], ([[5.0]],))
+        z, filled = self.datavault.get_slab(self.context, [0, 0], [3, 2])
+        self.assertArrayEqual([[1, 2], [0, 0], [0, 5]], np.nan_to_num(z))
+        self.assertArrayEqual([[True, True], [False, False], [False, True]], filled)
+        z, filled = self.datavault.get_slice(self.context, 1, 1)
+        self.assertArrayEqual([2, 0, 5], np.nan_to_num(z))
+        self.assertArrayEqual([True, False, True], filled)
+
+        # Gridded datasets have no rows.
+        self.assertRaises(errors.UnsupportedDatasetError,
+                          self.datavault.get_ex_t, self.context)
+        self.assertRaises(errors.UnsupportedDatasetError,
+                          self.datavault.row_count, self.context)
+        self.assertRaises(errors.BadGridError, self.datavault.new_ex,
+                          self.context, 'bad', [('x', [1], 'v', 'V')],
+                          [('z', 'I', [1], 'v', 'A')], grid=[3, 2])
+
+        self.datavault.new(self.context, 'rows', ['x [ms]'], ['y (E) [eV]'])
+        self.assertRaises(errors.UnsupportedDatasetError,
+                          self.datavault.get_slab, self.context, [0], [1])
+
+    def test_share_params(self):
+        self.store.share_params = True
+        self.store._sessions.clear()
+        self.datavault.initContext(self.context)
+        value = np.arange(200.0)
+        for name in ['foo', 'bar']:
+            self.datavault.new(self.context, name, ['x [ms]'], ['y (E) [eV]'])
+            self.datavault.add_parameters(self.context, (('big', value),))
+        self.datavault.open(self.context, 1)
+        self.assertArrayEqual(value,
+                              self.datavault.get_parameter(self.context, 'big'))
+        blobs = os.path.join(self.datadir, backend.PARAM_BLOB_FILE)
+        self.assertTrue(os.path.exists(blobs))
+        self.assertEqual(['00001 - foo', '00002 - bar'],
+                         self.datavault.dir(self.context)[1])
+
+    def test_buffer_writes(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context,
+                'foo',
+                [('x', 'ms'), ('y', 'Volt')],
+                [('z', 'E', 'eV')])
+        self.datavault.buffer_writes(self.context, 100)
+        self.datavault.add(self.context, [(.1, .2, .3), (.4, .5, .6)])
+        data = self.datavault.get(self.context)
+        self.assertArrayEqual([[.1, .2, .3], [.4, .5, .6]], data)
+
+        dataset = self.datavault.getDataset(self.context)
+        self.assertEqual(0, len(dataset.data))
+        self.datavault.stopServer()
+        self.assertEqual(2, len(dataset.data))
+
+    def test_get_decimated(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', ['x [ms]'], ['y (E) [eV]'])
+        n = 3 * 2048
+        x = np.arange(n, dtype=float)
+        y = np.sin(x / 100.0)
+        self.datavault.add(self.context, np.column_stack((x[:5000], y[:5000])))
+        envelope = self.datavault.get_decimated(self.context, 0, 3)
+        self.assertArrayEqual([0, 1665, 1666], envelope[:3, 0])
+        self.assertAlmostEqual(-1, envelope[0, 1], places=3)
+        self.assertAlmostEqual(1, envelope[1, 1], places=3)
+
+        # The summary follows appended rows.
+        self.datavault.add(self.context, np.column_stack((x[5000:], y[5000:])))
+        envelope = self.datavault.get_decimated(self.context, 0, 2, 2048)
+        self.assertEqual((4, 2), envelope.shape)
+        self.assertArrayEqual([2048, 4095, 4096, n - 1], envelope[:, 0])
+        self.assertEqual(y[4096:].max(), envelope[3, 1])
+        self.assertEqual(y[2048:4096].min(), envelope[0, 1])
+
+        # The streaming position is not affected.
+        data = self.datavault.get(self.context, 2)
+        self.assertArrayEqual([[0, 0], [1, y[1]]], data)
+
+        self.assertRaises(errors.BadColumnError,
+                          self.datavault.get_decimated, self.context, 2, 3)
+
+    def test_query(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', ['t [s]'], ['y (E) [eV]'])
+        t = np.arange(3000, dtype=float)
+        y = np.sin(t / 100.0)
+        self.datavault.add(self.context, np.column_stack((t, y)))
+        next_row, rows = self.datavault.query(self.context, 0, 1500, 1599.5)
+        self.assertArrayEqual(np.column_stack((t, y))[1500:1600], rows)
+        self.assertEqual(3000, next_row)
+
+        next_row, rows = self.datavault.query(self.context, 1, 0.99, 1, 5)
+        self.assertEqual(5, len(rows))
+        self.assertTrue(np.all(rows[:, 1] >= 0.99))
+        self.assertEqual(rows[-1, 0] + 1, next_row)
+        _, rest = self.datavault.query(self.context, 1, 0.99, 1, None, next_row)
+        self.assertEqual(np.sum(y >= 0.99), 5 + len(rest))
+
+        self.assertRaises(errors.BadColumnError,
+                          self.datavault.query, self.context, 2, 0, 1)
+
+    def test_data_count(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', ['x [ms]'], ['y (E) [eV]'])
+        self.datavault.notify_interval(self.context, 0, 10)
+        self.datavault.add(self.context, [[1, 2], [3, 4]])
+        (count, rows), contexts = self.hub.onDataCount.call_args[0]
+        self.assertEqual(2, count)
+        self.assertArrayEqual([[1, 2], [3, 4]], rows)
+        self.assertEqual(set([self.context.ID]), contexts)
+
+        # Opening another dataset stops the counts for this one.
+        self.datavault.new(self.context, 'bar', ['x [ms]'], ['y (E) [eV]'])
+        self.assertEqual(set(), contexts)
+
+    def test_search(self):
+        self.datavault.initContext(self.context)
+        self.assertRaises(errors.NoCatalogError,
+                          self.datavault.search, self.context)
+
+        self.store.catalog = catalog.open_catalog(self.datadir, task.Clock())
+        self.datavault = server.DataVault(self.store)
+        self.set_default_labrad_server_mocks(self.datavault)
+        self.datavault.initContext(self.context)
+        self.datavault.mkdir(self.context, 'sub')
+        self.datavault.cd(self.context, 'sub')
+        self.datavault.new(self.context, 'Rabi', ['x [ms]'], ['y (E) [eV]'])
+        self.datavault.add_parameter(self.context, 'freq', 5.0)
+        self.datavault.new(self.context, 'Ramsey', ['x [ms]'], ['y (E) [eV]'])
+        self.datavault.cd(self.context, '')
+        self.assertEqual([(['', 'sub'], '00001 - Rabi')],
+                         self.datavault.search(self.context, 'Rabi'))
+        found = self.datavault.search(self.context, '', [], None, None,
+                                      [('freq', 4, 6)])
+        self.assertEqual([(['', 'sub'], '00001 - Rabi')], found)
+        self.assertEqual(2, len(self.datavault.search(self.context)))
+        self.store.catalog.close()
+
+    def test_get_many(self):
+        self.datavault.initContext(self.context)
+        self.datavault.cd(self.context, 'sub', True)
+        self.datavault.new(self.context, 'cal', ['x [ms]'], ['y (E) [eV]'])
+        self.datavault.add(self.context, [[1.0, 2.0], [3.0, 4.0]])
+        self.datavault.add_parameter(self.context, 'freq', 5.0)
+        self.datavault.add_comment(self.context, 'good', 'me')
+        self.datavault.new(self.context, 'other', ['x [ms]'], ['y (E) [eV]'])
+        self.datavault.cd(self.context, '')
+
+        items = [(['', 'sub'], 1), (['sub'], 3), (['', 'missing'], 1)]
+        found, missing, nodir = self.datavault.get_many(
+                self.context, items, ['data', 'parameters', 'comments'])
+        path, name, error, data, params, comments = found
+        self.assertEqual((['', 'sub'], '00001 - cal', ''), (path, name, error))
+        self.assertArrayEqual([[1, 2], [3, 4]], data)
+        self.assertEqual((('freq', 5.0),), params)
+        self.assertEqual([('me', 'good')], [c[1:] for c in comments])
+        self.assertEqual((['', 'sub'], '3'), missing[:2])
+        self.assertIn('not found', missing[2])
+        self.assertEqual(3, len(missing))
+        self.assertEqual(3, len(nodir))
+        self.assertFalse(self.store.exists(['', 'missing']))
+
+        # The context's own dataset is not changed.
+        self.assertEqual('00002 - other', self.context['dataset'])
+        self.assertRaises(errors.BadFieldError, self.datavault.get_many,
+                          self.context, items, 'bogus')
+        self.assertRaises(errors.NoItemsError, self.datavault.get_many,
+                          self.context, [])
+
+    def test_get_range(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', ['x [ms]', 'y [V]'], ['z (E) [eV]'])
+        data = np.arange(30, dtype=float).reshape((10, 3))
+        self.datavault.buffer_writes(self.context, 100)
+        self.datavault.add(self.context, data[:6])
+        self.datavault.getDataset(self.context).flush()
+        self.datavault.add(self.context, data[6:])
+        self.assertEqual(10, self.datavault.row_count(self.context))
+
+        rows = self.datavault.get_range(self.context, 2, 5)
+        self.assertArrayEqual(data[2:5], rows)
+        rows = self.datavault.get_range(self.context, 1, None, [2, 0], 2)
+        self.assertArrayEqual(data[1::2][:, [2, 0]], rows)
+        rows = self.datavault.get_range(self.context, 3, 100, [1])
+        self.assertArrayEqual(data[3:, [1]], rows)
+        self.assertEqual((0, 3), self.datavault.get_range(self.context, 20).shape)
+        self.assertRaises(errors.BadColumnError,
+                          self.datavault.get_range, self.context, 0, 5, [3])
+
+        # The streaming position is untouched.
+        self.assertArrayEqual(data, self.datavault.get(self.context))
+
+    def test_get_range_ex_t(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context,
+                'foo',
+                [('t', [1], 't', ''), ('x', [1], 'v', 'ms')],
+                [('label', 'legend', [1], 's', '')])
+        self.datavault.add_ex_t(self.context, ([1, 2, 3], [.1, .2, .3], ['a', 'b', 'c']))
+        t, label = self.datavault.get_range_ex_t(self.context, 0, 3, [0, 2], 2)
+        self.assertArrayEqual([1, 3], t)
+        self.assertEqual(['a', 'c'], label)
+        self.assertRaises(errors.DataVersionMismatchError,
+                          self.datavault.get_range, self.context, 0, 3, [0])
+        self.assertArrayEqual([[.2]], self.datavault.get_range(self.context, 1, 2, [1]))
+
+    def test_file_pool(self):
+        self.datavault.initContext(self.context)
+        pool = backend.file_pool()
+        max_open = pool.max_open
+        self.addCleanup(setattr, pool, 'max_open', max_open)
+        self.datavault.new(self.context, 'foo', ['x [ms]'], ['y (E) [eV]'])
+        self.datavault.new(self.context, 'bar', ['x [ms]'], ['y (E) [eV]'])
+        stats = self.datavault.file_pool(self.context)
+        self.assertEqual(stats[0], max_open)
+        self.assertGreaterEqual(stats[1], 2)
+
+        stats = self.datavault.file_pool(self.context, 1)
+        self.assertEqual(stats[:2], (1, 1))
+        self.assertGreaterEqual(stats[4], 1)
+        self.assertRaises(errors.FilePoolSizeError, self.datavault.file_pool,
+                          self.context, 0)
+        self.assertEqual(1, pool.max_open)
+
+    def test_object_cache(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', ['x [ms]'], ['y (E) [eV]'])
+        self.datavault.new(self.context, 'bar', ['x [ms]'], ['y (E) [eV]'])
+        self.datavault.open(self.context, 1)
+        stats = self.datavault.object_cache(self.context)
+        self.assertEqual((1, 1), stats[2:4]) # the root session
+        self.assertEqual((1000, 2, 1, 0), stats[4:])
+
+        # 'bar' is dropped once no context uses it and it falls out of the cache
+        stats = self.datavault.object_cache(self.context, None, 1)
+        self.assertEqual((1, 1), stats[4:6])
+        self.datavault.open(self.context, 2)
+        stats = self.datavault.object_cache(self.context)
+        self.assertEqual((1, 1, 1, 1), stats[4:])
+
+    def test_stats(self):
+        packet = mock.MagicMock()
+        for s in self.datavault._findSettingHandlers():
+            if not isinstance(s, Signal):
+                self.datavault.addSetting(s, packet)
+        settings = dict((s.name, s) for s in self.datavault.settings.values())
+        def call(name, data=None, tag=None):
+            flat = T.flatten(data, tag)
+            return settings[name].handleRequest(self.datavault, self.context, flat)
+
+        self.context.source = 7
+        self.datavault.initContext(self.context)
+        call('new', ('foo', ['x [ms]'], ['y (E) [eV]']), '(s*s*s)')
+        call('add', np.array([[1.0, 2.0], [3.0, 4.0]]), '*2v')
+        data = call('get')
+        self.assertEqual((2, 2), data.shape)
+        self.assertRaises(errors.DatasetNotFoundError, call, 'open', 5, 'w')
+
+        buckets, by_setting, clients, contexts = self.datavault.get_stats(
+                self.context)
+        by_setting = dict((s[0], s[1:]) for s in by_setting)
+        calls, failed, seconds, longest, histogram, rows, bytes_in, bytes_out = by_setting['add']
+        self.assertEqual((1, 0, 2), (calls, failed, rows))
+        self.assertEqual(len(buckets) + 1, len(histogram))
+        self.assertEqual(1, sum(histogram))
+        self.assertGreater(bytes_in, 32)
+        self.assertEqual((1, 0, 2), (by_setting['get'][0], by_setting['get'][1],
+                                     by_setting['get'][5]))
+        self.assertEqual(32, by_setting['get'][7])
+        self.assertEqual((1, 1), by_setting['open'][:2])
+        self.assertEqual([(7, 4, 1)], [client[:3] for client in clients])
+        self.assertEqual([('test-context', 4, 1)], [ctx[:3] for ctx in contexts])
+
+        self.datavault.get_stats(self.context, True)
+        self.assertEqual([], self.datavault.get_stats(self.context)[1])
+
+    def test_dump_stats(self):
+        clock = task.Clock()
+        self.datavault.stats.reactor = clock
+        self.datavault.initContext(self.context)
+        setting = self.datavault.stats.wrap(server.DataVault.dir)
+        self.datavault.dump_stats(self.context, 10, ['', 'stats'])
+        setting.handleRequest(self.datavault, self.context, T.flatten(None))
+        setting.handleRequest(self.datavault, self.context, T.flatten(None))
+        clock.advance(10)
+        clock.advance(10) # nothing new to save
+        self.datavault.dump_stats(self.context, 0)
+
+        self.datavault.cd(self.context, 'stats')
+        self.datavault.open(self.context, 1)
+        rows = self.datavault.get_ex(self.context)
+        self.assertEqual(1, len(rows))
+        self.assertEqual(('dir', 2.0, 0.0), rows[0][1:4])
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
@@ -0,0 +1,126 @@
+import unittest
+
+import numpy as np
+
+from datavault import errors, summary
+
+
+def _reference_envelope(values, x_col, edges):
+    """Brute force envelope of values for the given bucket edges."""
+    rows = []
+    for a, b in zip(edges[:-1], edges[1:]):
+        bucket = values[a:b]
+        low = np.nanmin(bucket, axis=0)
+        high = np.nanmax(bucket, axis=0)
+        low[x_col] = bucket[0, x_col]
+        high[x_col] = bucket[-1, x_col]
+        rows.extend([low, high])
+    return np.array(rows)
+
+
+class BlockSummaryTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.values = np.column_stack((np.arange(1000.0),
+                                       rng.normal(size=1000),
+                                       rng.normal(size=1000)))
+        self.values[17, 2] = np.nan
+        self.read = lambda a, b: self.values[a:b]
+
+    def get_summary(self, sizes):
+        blocks = summary.BlockSummary(3, block_rows=16)
+        pos = 0
+        for size in sizes:
+            blocks.add(self.values[pos:pos + size])
+            pos += size
+        return blocks
+
+    def test_add_in_pieces(self):
+        whole = self.get_summary([1000])
+        pieces = self.get_summary([1, 5, 10, 100, 3, 16, 865])
+        self.assertEqual(whole.rows, 1000)
+        self.assertEqual(pieces.blocks, 63)
+        for name in ['mins', 'maxs', 'firsts', 'lasts']:
+            self.assertTrue(np.array_equal(getattr(whole, name),
+                                           getattr(pieces, name)), name)
+        self.assertEqual(whole.mins[1, 2], np.nanmin(self.values[16:32, 2]))
+        self.assertEqual(whole.lasts[-1, 0], 999)
+
+    def test_decimate_small_buckets(self):
+        blocks = self.get_summary([1000])
+        envelope = blocks.decimate(self.read, 0, 10, 5, 305)
+        expected = _reference_envelope(self.values, 0, range(5, 306, 30))
+        self.assertTrue(np.array_equal(envelope, expected))
+
+    def test_decimate_from_blocks(self):
+        blocks = self.get_summary([1000])
+        envelope = blocks.decimate(self.read, 0, 7, 3, 997)
+        # edges move to block boundaries (multiples of 16)
+        edges = [3, 144, 288, 432, 576, 720, 848, 997]
+        expected = _reference_envelope(self.values, 0, edges)
+        self.assertEqual(envelope.shape, (14, 3))
+        self.assertTrue(np.array_equal(envelope, expected))
+
+    def test_decimate_few_rows(self):
+        blocks = self.get_summary([1000])
+        envelope = blocks.decimate(self.read, 0, 10, 100, 110)
+        self.assertTrue(np.array_equal(envelope, self.values[100:110]))
+
+    def test_numeric_columns(self):
+        rows = np.zeros(2, dtype=[('f0', 'i8'), ('f1', 'f8')])
+        rows['f0'] = [1, 2]
+        values = summary.numeric_columns(rows, 'foo')
+        self.assertEqual(values.dtype, np.float64)
+        self.assertEqual(values.shape, (2, 2))
+        rows = np.zeros(2, dtype=[('f0', 'f8'), ('f1', 'f8', (2,))])
+        self.assertRaises(errors.UnsupportedDatasetError,
+                          summary.numeric_columns, rows, 'foo')
+
+    def test_increasing(self):
+        blocks = self.get_summary([10, 100, 890])
+        self.assertEqual([True, False, False], list(blocks.increasing))
+        blocks.add(np.array([[998.0, 0, 0]]))
+        self.assertFalse(blocks.increasing[0])
+
+    def test_query_increasing(self):
+        blocks = self.get_summary([1000])
+        rows, next_row = blocks.query(self.read, 0, 99.5, 140, None, 0)
+        self.assertTrue(np.array_equal(rows, self.values[100:141]))
+        self.assertEqual(next_row, 1000)
+        rows, next_row = blocks.query(self.read, 0, 99.5, 140, 10, 120)
+        self.assertTrue(np.array_equal(rows, self.values[120:130]))
+        self.assertEqual(next_row, 130)
+        rows, next_row = blocks.query(self.read, 0, 99.5, 140, 0, 120)
+        self.assertEqual(rows.shape, (0, 3))
+        self.assertEqual(next_row, 120)
+        rows, next_row = blocks.query(self.read, 0, 2000, 3000, None, 0)
+        self.assertEqual(rows.shape, (0, 3))
+        self.assertEqual(next_row, 1000)
+
+    def test_query_scan(self):
+        blocks = self.get_summary([1000])
+        reads = []
+        def read(a, b):
+            reads.append((a, b))
+            return self.values[a:b]
+        column = self.values[:, 1]
+        expected = self.values[(column >= 2) & (column <= 2.5)]
+        rows, next_row = blocks.query(read, 1, 2, 2.5, None, 0)
+        self.assertTrue(np.array_equal(rows, expected))
+        self.assertEqual(next_row, 1000)
+        # only blocks that can hold a match are read
+        self.assertTrue(sum(b - a for a, b in reads) < 1000)
+
+        # page through the matches a few at a time
+        pages = []
+        next_row = 0
+        while next_row < 1000:
+            rows, next_row = blocks.query(self.read, 1, 2, 2.5, 3, next_row)
+            pages.append(rows)
+        self.assertTrue(np.array_equal(np.concatenate(pages), expected))
+
+    def test_query_nan(self):
+        blocks = self.get_summary([1000])
+        rows, _ = blocks.query(self.read, 2, -np.inf, np.inf, None, 0)
+        self.assertEqual(len(rows), 999)
@@ -1,5 +1,10 @@
 import StringIO
+import errno
+import mock
+import os
 import pytest
+import shutil
+import tempfile
 import unittest
 
 import numpy as np
@@ -56,5 +61,40 @@ class Testutil(unittest.TestCase):
         expected = '{' + 'foo' + '}'
         self.assertEqual(expected, actual)
 
+    def test_lru_cache(self):
+        cache = util.LRUCache(10, sizeof=len)
+        cache['a'] = 'xxxx'
+        cache['b'] = 'xxxx'
+        self.assertEqual('xxxx', cache.get('a'))
+        cache['c'] = 'xxxx'
+        # 'b' was used least recently, so it goes to keep within budget.
+        self.assertNotIn('b', cache)
+        self.assertEqual(8, cache.size)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        cache['a'] = 'x'
+        self.assertEqual(5, cache.size)
+        cache.clear()
+        self.assertEqual((0, 0), (len(cache), cache.size))
+
+    def test_write_atomic(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'session.ini')
+            util.write_atomic(filename, 'one')
+            util.write_atomic(filename, 'two')
+            with open(filename) as f:
+                self.assertEqual('two', f.read())
+
+            # A failed rename keeps the original file.
+            failure = OSError(errno.EACCES, 'Permission denied')
+            with mock.patch.object(util.os, 'name', 'posix'), \
+                    mock.patch.object(util.os, 'rename', side_effect=failure):
+                self.assertRaises(OSError, util.write_atomic, filename, 'three')
+            with open(filename) as f:
+                self.assertEqual('two', f.read())
+        finally:
+            shutil.rmtree(tmpdir)
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
@@ -0,0 +1,237 @@
+import mock
+import numpy as np
+import tempfile
+import unittest
+
+from twisted.internet import defer, task
+
+from datavault import Dataset, Session, workers
+
+
+class _MockFile(object):
+    def __init__(self):
+        self.pins = 0
+
+    def pin(self):
+        self.pins += 1
+
+    def unpin(self):
+        self.pins -= 1
+
+
+class _ManualScheduler(workers.IOScheduler):
+    """Runs each job when the test says so instead of in a thread."""
+    def __init__(self, max_reads):
+        workers.IOScheduler.__init__(self, size=1, max_reads=max_reads)
+        self.running = []
+
+    def _inThread(self, func, *args):
+        d = defer.Deferred()
+        self.running.append((func, args, d))
+        return d
+
+    def finish(self, name):
+        for job in self.running:
+            if job[1][0] == name:
+                self.running.remove(job)
+                job[2].callback(name)
+                return
+        raise AssertionError('{} is not running'.format(name))
+
+    def names(self):
+        return [args[0] for _, args, _ in self.running]
+
+
+class IOSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.io = _ManualScheduler(max_reads=1)
+        self.f = _MockFile()
+        self.g = _MockFile()
+        self.results = []
+
+    def submit(self, f, kind, name):
+        d = self.io.submit(f, kind, lambda name: name, name)
+        d.addCallback(self.results.append)
+
+    def test_in_order_for_each_file(self):
+        self.submit(self.f, workers.WRITE, 'w1')
+        self.submit(self.f, workers.WRITE, 'w2')
+        self.submit(self.g, workers.WRITE, 'w3')
+        self.assertEqual(['w1', 'w3'], self.io.names())
+        self.assertEqual(2, self.f.pins)
+        self.io.finish('w1')
+        self.assertEqual(['w3', 'w2'], self.io.names())
+        self.io.finish('w2')
+        self.io.finish('w3')
+        self.assertEqual(['w1', 'w2', 'w3'], self.results)
+        self.assertEqual(0, self.f.pins)
+
+    def test_read_limit(self):
+        self.submit(self.f, workers.READ, 'r1')
+        self.submit(self.g, workers.READ, 'r2')
+        self.submit(self.g, workers.WRITE, 'w1')
+        self.assertEqual(['r1'], self.io.names())
+        self.io.finish('r1')
+        self.assertEqual(['r2'], self.io.names())
+        self.io.finish('r2')
+        self.assertEqual(['w1'], self.io.names())
+
+    def test_small_jobs_pass_reads(self):
+        self.submit(self.f, workers.WRITE, 'w1')
+        for kind, name in [(workers.READ, 'r1'), (workers.WRITE, 'w2'),
+                           (workers.READ, 'r2'), (workers.READ, 'r3'),
+                           (workers.SMALL, 's1')]:
+            self.submit(self.f, kind, name)
+        for name in ['w1', 'r1', 'w2', 's1', 'r2', 'r3']:
+            self.assertEqual([name], self.io.names())
+            self.io.finish(name)
+        self.assertEqual(['w1', 'r1', 'w2', 's1', 'r2', 'r3'], self.results)
+
+    def test_drain(self):
+        drained = []
+        self.io.drain().addCallback(drained.append)
+        self.assertEqual([None], drained)
+        self.submit(self.f, workers.WRITE, 'w1')
+        self.io.drain().addCallback(drained.append)
+        self.assertEqual([None], drained)
+        self.io.finish('w1')
+        self.assertEqual([None, None], drained)
+
+    def test_errors_reach_caller(self):
+        errors = []
+        d = self.io.submit(self.f, workers.WRITE, lambda name: name, 'w1')
+        d.addErrback(errors.append)
+        self.io.running[0][2].errback(ValueError('oops'))
+        self.assertTrue(errors[0].check(ValueError))
+        self.assertEqual(0, self.f.pins)
+
+
+class GatherTest(unittest.TestCase):
+
+    def test_gather(self):
+        self.assertEqual([1, 2], workers.gather([1, 2]))
+        d1, d2 = defer.Deferred(), defer.Deferred()
+        results = []
+        workers.gather([d1, 2, d2]).addBoth(results.append)
+        d2.callback(3)
+        self.assertEqual([], results)
+        d1.callback(1)
+        self.assertEqual([[1, 2, 3]], results)
+
+    def test_gather_failure(self):
+        d = defer.Deferred()
+        results = []
+        workers.gather([d, 2]).addBoth(results.append)
+        d.errback(ValueError('oops'))
+        self.assertTrue(results[0].check(ValueError))
+
+
+class _SyncScheduler(workers.IOScheduler):
+    def _inThread(self, func, *args):
+        return defer.maybeDeferred(func, *args)
+
+
+class DatasetIOTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = mock.MagicMock()
+        self.session.dir = tempfile.mkdtemp(prefix='dvtest_')
+        self.io = _SyncScheduler()
+
+    def result(self, d):
+        self.assertIsInstance(d, defer.Deferred)
+        results = []
+        d.addBoth(results.append)
+        return results[0]
+
+    def test_buffered_rows_through_scheduler(self):
+        dataset = Dataset(self.session, 'Foo', title='Foo', create=True,
+                          independents=['x [s]'], dependents=['y (E) [V]'],
+                          io=self.io)
+        dataset.setBuffering(10, 1.0)
+        rows = np.core.records.fromarrays([[1.0, 2.0], [3.0, 4.0]],
+                                          dtype=dataset.data.dtype)
+        dataset.addData(rows)
+        data, pos = self.result(dataset.getData(None, 0, simpleOnly=True))
+        self.assertEqual(2, pos)
+        self.assertTrue(np.array_equal([[1, 3], [2, 4]], data))
+
+        dataset.flush()
+        self.assertEqual(2, len(dataset.data))
+        data = self.result(dataset.getRange(1, None, 1, [1]))
+        self.assertTrue(np.array_equal([[4]], data))
+        next_row = self.result(dataset.query(0, 0, 1.5, None, 0))[1]
+        self.assertEqual(2, next_row)
+        self.assertEqual(0, dataset.data._file.pins)
+
+    def test_parameters_and_comments_through_scheduler(self):
+        dataset = Dataset(self.session, 'Foo', title='Foo', create=True,
+                          independents=['x [s]'], dependents=['y (E) [V]'],
+                          io=self.io)
+        self.result(dataset.addParameter('alpha', 1.5))
+        self.result(dataset.addComment('me', 'hi'))
+        self.assertEqual(['alpha'], self.result(dataset.getParamNames()))
+        self.assertEqual(1.5, self.result(
+                dataset.getParameter('ALPHA', case_sensitive=False)))
+        self.assertEqual([('alpha', 1.5)], self.result(dataset.getParameters()))
+        self.assertIsNone(self.result(dataset.access()))
+
+        self.result(dataset.keepStreamingComments('ctx', 1))
+        self.assertEqual(set(['ctx']), dataset.comment_listeners)
+        self.result(dataset.keepStreamingComments('ctx', 0))
+        self.assertEqual(set(), dataset.comment_listeners)
+        self.session.hub.onCommentsAvailable.assert_called_with(None, ['ctx'])
+
+    def test_row_count_and_streaming_through_scheduler(self):
+        dataset = Dataset(self.session, 'Foo', title='Foo', create=True,
+                          independents=['x [s]'], dependents=['y (E) [V]'],
+                          io=self.io)
+        dataset.setBuffering(10, 1.0)
+        rows = np.core.records.fromarrays([[1.0, 2.0], [3.0, 4.0]],
+                                          dtype=dataset.data.dtype)
+        dataset.addData(rows)
+        self.assertEqual(2, dataset._rows)
+        self.assertEqual(2, self.result(dataset.rowCount('row count')))
+        self.assertTrue(self.result(dataset.hasMore(1)))
+        self.assertFalse(self.result(dataset.hasMore(2)))
+        dataset.flush()
+        self.assertEqual(2, self.result(dataset.rowCount('row count')))
+
+        self.result(dataset.keepStreaming('ctx', 2))
+        self.assertEqual(set(['ctx']), dataset.listeners)
+
+    def test_streaming_sees_notifications_while_checking(self):
+        dataset = Dataset(self.session, 'Foo', title='Foo', create=True,
+                          independents=['x [s]'], dependents=['y (E) [V]'],
+                          io=self.io)
+        more = defer.Deferred()
+        with mock.patch.object(dataset, 'hasMore', return_value=more):
+            d = dataset.keepStreaming('ctx', 0)
+        # rows are added after hasMore was asked, but before it answers
+        dataset.addData(np.core.records.fromarrays(
+                [[1.0], [3.0]], dtype=dataset.data.dtype))
+        more.callback(False)
+        self.result(d)
+        self.assertEqual(set(), dataset.listeners)
+        self.session.hub.onDataAvailable.assert_called_with(None, ['ctx'])
+
+    def test_open_through_scheduler(self):
+        session = Session(self.session.dir, ['foo'], mock.MagicMock(),
+                          mock.MagicMock(), reactor=task.Clock(), io=self.io)
+        created = session.newDataset('Foo', ['x [s]'], ['y (E) [V]'])
+        del session.datasets[created.name]
+
+        opening = defer.Deferred()
+        with mock.patch.object(self.io, 'call', return_value=opening) as call:
+            d1 = session.openDataset(1)
+            d2 = session.openDataset(1)
+        # both wait for the one open in a worker thread
+        self.assertEqual(1, call.call_count)
+        opening.callback(Dataset.openFile(call.call_args[0][1]))
+        dataset = self.result(d1)
+        self.assertIs(dataset, self.result(d2))
+        self.assertIs(dataset, session.openDataset(1))
+        self.assertEqual(['x'], [i.label for i in dataset.getIndependents()])
+        self.assertEqual(created.getRowType(), dataset.getRowType())
+        self.assertEqual(created.dtype, dataset.dtype)
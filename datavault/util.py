@@ -1,4 +1,7 @@
+import collections
 import ConfigParser as cp
+import errno
+import os
 
 import numpy as np
 
@@ -28,6 +31,99 @@ class DVSafeConfigParser(cp.SafeConfigParser):
             fp.write(newline)
 
 
+def write_atomic(filename, contents):
+    """Replace the contents of a file so that readers never see a partial write.
+
+    The data goes to a temporary file in the same directory which is then
+    renamed over the original (see replace_file).
+    """
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'wb') as f:
+        f.write(contents)
+        f.flush()
+        os.fsync(f.fileno())
+    replace_file(tmpname, filename)
+
+
+def replace_file(src, dst):
+    """Rename src to dst, replacing dst if it exists.
+
+    Windows refuses to rename onto an existing file, so there the original
+    has to be removed first.  Any other error is raised, and dst is kept.
+    """
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if os.name != 'nt' and e.errno != errno.EEXIST:
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+class LRUCache(object):
+    """Mapping that drops its least recently used entries beyond a budget.
+
+    The budget is counted with sizeof, which gives the cost of each value
+    (1 by default, so capacity is a number of entries; use nbytes for arrays
+    to make it a memory budget).
+    """
+    def __init__(self, capacity, sizeof=lambda value: 1):
+        self.capacity = capacity
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Get a value and mark it as recently used."""
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self.pop(key)
+        self._entries[key] = value
+        self.size += self.sizeof(value)
+        self._evict()
+
+    def resize(self, capacity):
+        """Change the budget, dropping entries that no longer fit."""
+        self.capacity = capacity
+        self._evict()
+
+    def _evict(self):
+        while self.size > self.capacity and self._entries:
+            _, old = self._entries.popitem(last=False)
+            self.size -= self.sizeof(old)
+
+    def items(self):
+        """List the entries, least recently used first, without using them."""
+        return self._entries.items()
+
+    def pop(self, key, default=None):
+        if key not in self._entries:
+            return default
+        value = self._entries.pop(key)
+        self.size -= self.sizeof(value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+
 def to_record_array(data):
     """Take a 2-D array of numpy data and return a 1-D array of records."""
     return np.core.records.fromarrays(data.T)
@@ -0,0 +1,147 @@
+"""Run dataset file I/O in worker threads.
+
+Without an IOScheduler the Data Vault reads and writes dataset files in the
+reactor thread, so one slow read (say a big get over NFS) holds up every
+other client.  An IOScheduler runs those reads and writes in a pool of
+worker threads instead, and the settings return Deferreds:
+
+- Jobs for the same file run one at a time, in the order they were
+  submitted, so appended rows are written in order and a read sees every
+  write submitted before it.  Jobs for different files run concurrently.
+- At most max_reads bulk reads run at once.  Further reads wait in their
+  file's queue, which keeps a burst of large gets from taking over the pool.
+- Small jobs (parameters, comments) don't count towards max_reads, and go
+  ahead of any reads still waiting in their file's queue.
+
+The file used by a job is pinned while the job is queued or running, so
+the FilePool does not close it under a worker thread.
+"""
+
+import collections
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import threadpool
+
+IO_THREADS = 4 # worker threads for dataset file I/O
+IO_MAX_READS = 2 # most bulk reads running at once
+
+READ = 'read'
+WRITE = 'write'
+SMALL = 'small'
+
+
+def then(result, f, *args):
+    """Call f(result, *args) now, or once result fires if it is a Deferred."""
+    if isinstance(result, defer.Deferred):
+        return result.addCallback(f, *args)
+    return f(result, *args)
+
+def gather(results):
+    """Combine results, some of which may be Deferreds, into one list.
+
+    Returns the list now if none of them is a Deferred, and otherwise a
+    Deferred firing with it once all have fired, or with the first failure.
+    """
+    results = list(results)
+    pending = [r for r in results if isinstance(r, defer.Deferred)]
+    if not pending:
+        return results
+    def done(values):
+        values = iter(values)
+        return [next(values) if isinstance(r, defer.Deferred) else r
+                for r in results]
+    def failed(failure):
+        failure.trap(defer.FirstError)
+        return failure.value.subFailure
+    d = defer.gatherResults(pending, consumeErrors=True)
+    return d.addCallbacks(done, failed)
+
+
+class IOScheduler(object):
+    """Runs file I/O jobs in worker threads, in order for each file.
+
+    Jobs are submitted from the reactor thread, and their Deferreds fire in
+    the reactor thread.  Keep max_reads below size, the number of worker
+    threads, so that writes and small jobs always find a free thread.
+    """
+    def __init__(self, size=IO_THREADS, max_reads=IO_MAX_READS,
+                 reactor=reactor):
+        self.reactor = reactor
+        self.pool = threadpool.ThreadPool(size, size, 'datavault io')
+        self.reads = defer.DeferredSemaphore(max_reads)
+        self._queues = {} # file -> jobs waiting to run; only for busy files
+        self._idle = []
+
+    def start(self):
+        self.pool.start()
+        self.reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+
+    def stop(self):
+        if self.pool.started:
+            self.pool.stop()
+
+    def submit(self, f, kind, func, *args):
+        """Run func(*args) in a worker thread once f is free.
+
+        f is the SelfClosingFile that func uses, and kind is READ, WRITE or
+        SMALL.  Returns a Deferred that fires with the result.
+        """
+        d = defer.Deferred()
+        job = (kind, func, args, d)
+        f.pin()
+        queue = self._queues.get(f)
+        if queue is None:
+            self._queues[f] = collections.deque()
+            self._run(f, job)
+        elif kind == SMALL:
+            # go ahead of the reads at the end of the queue
+            i = len(queue)
+            while i and queue[i - 1][0] == READ:
+                i -= 1
+            queue.rotate(-i)
+            queue.appendleft(job)
+            queue.rotate(i)
+        else:
+            queue.append(job)
+        return d
+
+    def call(self, func, *args):
+        """Run func(*args) in a worker thread, apart from any file's queue.
+
+        This is for jobs with no open file yet, such as opening one.
+        Returns a Deferred that fires with the result.
+        """
+        return self._inThread(func, *args)
+
+    def drain(self):
+        """Get a Deferred that fires once every submitted job has finished."""
+        d = defer.Deferred()
+        if self._queues:
+            self._idle.append(d)
+        else:
+            d.callback(None)
+        return d
+
+    def _run(self, f, job):
+        kind, func, args, d = job
+        if kind == READ:
+            result = self.reads.run(self._inThread, func, *args)
+        else:
+            result = self._inThread(func, *args)
+        result.addBoth(self._done, f, d)
+
+    def _inThread(self, func, *args):
+        return threads.deferToThreadPool(self.reactor, self.pool, func, *args)
+
+    def _done(self, result, f, d):
+        f.unpin()
+        queue = self._queues[f]
+        if queue:
+            self._run(f, queue.popleft())
+        else:
+            del self._queues[f]
+            if not self._queues:
+                idle, self._idle = self._idle, []
+                for waiting in idle:
+                    waiting.callback(None)
+        d.callback(result)
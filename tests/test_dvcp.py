@@ -0,0 +1,270 @@
+from __future__ import absolute_import
+
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '_Modules'))
+import dvcp
+
+INDEP = [('x', [1], 'v', 's')]
+DEP = [('y', 'y', [1], 'v', 'V')]
+
+
+class FakeVault(object):
+    """An in-memory data vault.  Calling it gives a new context."""
+    def __init__(self):
+        self.dirs = set([('',)])
+        self.datasets = {} # (path, name) -> FakeDataset
+        self.trash = set() # (path, name) of trashed datasets
+        self.broken = set() # names of datasets whose rows can't be read
+        self.calls = [] # names of all settings called
+
+    def __call__(self):
+        return FakeContext(self)
+
+    def add(self, path, name, rows, params=None, comments=()):
+        for i in range(1, len(path) + 1):
+            self.dirs.add(tuple(path[:i]))
+        dataset = FakeDataset(INDEP, DEP)
+        dataset.data = np.column_stack((np.arange(rows, dtype=float),
+                                        np.arange(rows, dtype=float) ** 2))
+        dataset.params = params
+        dataset.comments = list(comments)
+        self.datasets[tuple(path), name] = dataset
+        return dataset
+
+    def get(self, path, name):
+        return self.datasets[tuple(path), name]
+
+
+class FakeDataset(object):
+    def __init__(self, indep, dep):
+        self.vars = (indep, dep)
+        self.data = np.zeros((0, len(indep) + len(dep)))
+        self.params = None
+        self.comments = []
+
+
+class FakeContext(object):
+    """One context on a FakeVault, with the settings dvcp uses."""
+    def __init__(self, vault):
+        self.vault = vault
+        self.path = ('',)
+        self.dataset = None
+
+    def packet(self):
+        return FakePacket(self)
+
+    def cd(self, path, create=False):
+        path = tuple(path) if path[0] == '' else self.path + tuple(path)
+        if path not in self.vault.dirs:
+            if not create:
+                raise ValueError('no directory {}'.format(path))
+            for i in range(1, len(path) + 1):
+                self.vault.dirs.add(path[:i])
+        self.path = path
+        return list(path)
+
+    def dir(self, tagFilters=['-trash']):
+        dirs = sorted(d[-1] for d in self.vault.dirs
+                      if d[:-1] == self.path and len(d) > len(self.path))
+        datasets = sorted(n for p, n in self.vault.datasets if p == self.path
+                          and ('-trash' not in tagFilters or
+                               (p, n) not in self.vault.trash))
+        return dirs, datasets
+
+    def open(self, name, append=False):
+        self.name = name
+        self.dataset = self.vault.get(self.path, name)
+
+    def new_ex(self, title, indep, dep):
+        count = len([p for p, _ in self.vault.datasets if p == self.path])
+        self.name = '{:05d} - {}'.format(count + 1, title)
+        self.dataset = FakeDataset(indep, dep)
+        self.vault.datasets[self.path, self.name] = self.dataset
+        return list(self.path), self.name
+
+    def variables_ex(self):
+        return self.dataset.vars
+
+    def row_count(self):
+        return len(self.dataset.data)
+
+    def get_range_ex_t(self, start, stop):
+        if self.name in self.vault.broken:
+            raise ValueError('cannot read {}'.format(self.name))
+        return tuple(self.dataset.data[start:stop].T)
+
+    def add_ex_t(self, data):
+        self.dataset.data = np.vstack((self.dataset.data, np.column_stack(data)))
+
+    def get_parameters(self):
+        return self.dataset.params
+
+    def add_parameters(self, params):
+        have = self.dataset.params or ()
+        for name, _ in params:
+            if name in [n for n, _ in have]:
+                raise ValueError('parameter {} in use'.format(name))
+        self.dataset.params = tuple(have) + tuple(params)
+
+    def get_comments(self):
+        return [(0, user, comment) for user, comment in self.dataset.comments]
+
+    def add_comment(self, comment, user):
+        self.dataset.comments.append((user, comment))
+
+
+class FakePacket(object):
+    """Collects settings, and runs them when the result is asked for."""
+    def __init__(self, context):
+        self.context = context
+        self.records = []
+
+    def __getattr__(self, name):
+        def record(*args, **kw):
+            self.records.append((name, args, kw.pop('key', None)))
+        return record
+
+    def send_future(self):
+        return self
+
+    def send(self):
+        return self.result()
+
+    def result(self):
+        answer = {}
+        for name, args, key in self.records:
+            self.context.vault.calls.append(name)
+            value = getattr(self.context, name)(*args)
+            if key is not None:
+                answer[key] = value
+        return answer
+
+
+def replicator(src, dst, manifest, **kw):
+    return dvcp.Replicator(src, dst, manifest, **kw)
+
+
+def test_find_skips_trash_and_excluded():
+    src = FakeVault()
+    src.add(['', 'a'], '00001 - x', 1)
+    src.add(['', 'a'], '00002 - y', 1)
+    src.add(['', 'a', 'b'], '00001 - z', 1)
+    src.add(['', 'a', 'skip'], '00001 - w', 1)
+    src.trash.add((('', 'a'), '00002 - y'))
+    found = replicator(src, FakeVault(), None).find(['', 'a'], ['skip'])
+    assert found == [(['', 'a'], '00001 - x'), (['', 'a', 'b'], '00001 - z')]
+
+
+def test_copy_in_chunks(tmpdir):
+    src, dst = FakeVault(), FakeVault()
+    source = src.add(['', 'a'], '00001 - x', 10, params=(('p', 1.0),),
+                     comments=[('me', 'hi')])
+    manifest = dvcp.Manifest(str(tmpdir.join('manifest')))
+    rep = replicator(src, dst, manifest, chunk_rows=3)
+    assert (1, 0) == rep.run(rep.find(['', 'a']), ['', 'a'], ['', 'copy'])
+
+    copy = dst.get(['', 'copy'], '00001 - x')
+    assert np.array_equal(source.data, copy.data)
+    assert copy.params == (('p', 1.0),)
+    assert copy.comments == [('me', 'hi')]
+    assert dst.calls.count('add_ex_t') == 4 # 3 + 3 + 3 + 1 rows
+    entry = manifest.get(['', 'a'], '00001 - x')
+    assert (10, True) == (entry['rows'], entry['done'])
+
+
+def test_resume_from_partial_manifest(tmpdir):
+    src, dst = FakeVault(), FakeVault()
+    source = src.add(['', 'a'], '00001 - x', 10)
+    src.add(['', 'a'], '00002 - y', 2)
+    copy = dst.add(['', 'copy'], '00001 - x', 4)
+    filename = str(tmpdir.join('manifest'))
+    manifest = dvcp.Manifest(filename)
+    manifest.record(['', 'a'], '00001 - x', ['', 'copy'], '00001 - x', 4)
+    manifest.close()
+
+    manifest = dvcp.Manifest(filename)
+    rep = replicator(src, dst, manifest, chunk_rows=3)
+    assert (2, 0) == rep.run(rep.find(['', 'a']), ['', 'a'], ['', 'copy'])
+    assert np.array_equal(source.data, copy.data)
+    assert dst.calls.count('new_ex') == 1 # only for the second dataset
+    # copied rows are not read again: 3 + 3 + 0 rows, then 2 + 0 rows
+    assert src.calls.count('get_range_ex_t') == 5
+    assert len(dst.get(['', 'copy'], '00002 - y').data) == 2
+
+    # finished datasets are not copied again
+    del dst.calls[:]
+    assert (0, 0) == rep.run(rep.find(['', 'a']), ['', 'a'], ['', 'copy'])
+    assert dst.calls == []
+
+
+def test_manifest_truncated_last_line(tmpdir):
+    filename = str(tmpdir.join('manifest'))
+    entry = {'source': ['', 'a', '00001 - x'], 'dest': ['', 'b', '00001 - x'],
+             'rows': 5, 'done': False}
+    with open(filename, 'w') as f:
+        f.write(json.dumps(entry) + '\n')
+        f.write(json.dumps(dict(entry, rows=8))[:20])
+
+    manifest = dvcp.Manifest(filename)
+    assert 5 == manifest.get(['', 'a'], '00001 - x')['rows']
+    manifest.record(['', 'a'], '00001 - x', ['', 'b'], '00001 - x', 9)
+    manifest.close()
+    # the new record is not lost behind the cut-off line
+    assert 9 == dvcp.Manifest(filename).get(['', 'a'], '00001 - x')['rows']
+
+
+def test_failure_isolation(tmpdir):
+    src, dst = FakeVault(), FakeVault()
+    for i in range(1, 5):
+        src.add(['', 'a'], '{:05d} - x'.format(i), 7)
+    src.broken.add('00002 - x')
+    manifest = dvcp.Manifest(str(tmpdir.join('manifest')))
+    reports = []
+    rep = replicator(src, dst, manifest, streams=2, chunk_rows=3,
+                     report=reports.append)
+    assert (3, 1) == rep.run(rep.find(['', 'a']), ['', 'a'], ['', 'copy'])
+    for i in [1, 3, 4]:
+        name = '{:05d} - x'.format(i)
+        assert manifest.get(['', 'a'], name)['done']
+        assert np.array_equal(src.get(['', 'a'], name).data,
+                              dst.get(['', 'copy'], name).data)
+    assert not manifest.get(['', 'a'], '00002 - x')['done']
+    assert any(r.startswith('failed') and '00002 - x' in r for r in reports)
+
+
+def test_resume_after_unrecorded_write(tmpdir):
+    src, dst = FakeVault(), FakeVault()
+    source = src.add(['', 'a'], '00001 - x', 10)
+    # the copy got rows 4 to 6, but we stopped before recording them
+    copy = dst.add(['', 'copy'], '00001 - x', 7)
+    manifest = dvcp.Manifest(str(tmpdir.join('manifest')))
+    manifest.record(['', 'a'], '00001 - x', ['', 'copy'], '00001 - x', 4)
+
+    rep = replicator(src, dst, manifest, chunk_rows=3)
+    assert (1, 0) == rep.run(rep.find(['', 'a']), ['', 'a'], ['', 'copy'])
+    assert np.array_equal(source.data, copy.data)
+    assert 10 == manifest.get(['', 'a'], '00001 - x')['rows']
+
+
+def test_resume_after_unrecorded_parameters(tmpdir):
+    src, dst = FakeVault(), FakeVault()
+    source = src.add(['', 'a'], '00001 - x', 3, params=(('p', 1.0), ('q', 2.0)),
+                     comments=[('me', 'hi'), ('me', 'bye')])
+    # the copy got its rows, a parameter and a comment, but is not done
+    copy = dst.add(['', 'copy'], '00001 - x', 3, params=(('p', 1.0),),
+                   comments=[('me', 'hi')])
+    manifest = dvcp.Manifest(str(tmpdir.join('manifest')))
+    manifest.record(['', 'a'], '00001 - x', ['', 'copy'], '00001 - x', 3)
+
+    rep = replicator(src, dst, manifest, chunk_rows=3)
+    assert (1, 0) == rep.run(rep.find(['', 'a']), ['', 'a'], ['', 'copy'])
+    assert np.array_equal(source.data, copy.data)
+    assert copy.params == (('p', 1.0), ('q', 2.0))
+    assert copy.comments == [('me', 'hi'), ('me', 'bye')]
+    assert manifest.get(['', 'a'], '00001 - x')['done']